@@ -0,0 +1,77 @@
+import tempfile
+import time
+
+import numpy as np
+from django.db import transaction
+from django.test import override_settings
+
+from app.models import Metacell, MetacellGeneExpression
+from app.utils.expression_store import MetacellExpressionStore
+from rest.services import MetacellMarkerService
+from rest.views import MetacellMarkerViewSet
+
+from .benchmarkmarkers import Command as MarkerBenchmarkCommand
+from .benchmarkmarkers import Rollback
+
+
+class Command(MarkerBenchmarkCommand):
+    """
+    Benchmarks the cell type marker backends (SQL query and NumPy reductions of the expression store).
+
+    Uses the synthetic dataset of `benchmarkmarkers`, rolled back afterwards, and times both backends
+    for foreground selections of increasing size.
+    """
+
+    help = "Benchmark the SQL and NumPy cell type marker backends on synthetic data."
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--foreground", type=int, nargs="+", default=[1, 10, 100, 1000], help="Foreground metacells per query"
+        )
+        parser.add_argument("--fc-min", type=float, default=2, help="Minimum foreground fold-change (default: 2)")
+
+    @staticmethod
+    def time(func, repeat):
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            rows = func()
+            times.append(time.perf_counter() - start)
+        return len(rows), np.array(times) * 1000
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic(), tempfile.TemporaryDirectory() as tmpdir:
+                dataset = self.create_dataset(
+                    options["metacells"], options["genes"], options["density"], options["seed"]
+                )
+                n_rows = MetacellGeneExpression.objects.filter(dataset=dataset).count()
+                with override_settings(EXPRESSION_STORE_DIR=tmpdir):
+                    start = time.perf_counter()
+                    MetacellExpressionStore(dataset).build()
+                    self.stdout.write(
+                        f"Synthetic dataset: {options['metacells']} metacells, {options['genes']} genes, "
+                        f"{n_rows} expression rows (store built in {time.perf_counter() - start:.1f} s)"
+                    )
+
+                    service = MetacellMarkerService(dataset)
+                    view = MetacellMarkerViewSet()
+                    metacells = list(Metacell.objects.filter(dataset=dataset).order_by("pk").values_list("pk", "name"))
+                    for size in options["foreground"]:
+                        ids, names = zip(*metacells[:size])
+                        backends = {
+                            "sql": lambda names=names: list(
+                                view.get_raw_queryset(dataset, list(names), options["fc_min"], "mean")
+                            ),
+                            "numpy": lambda ids=ids: service.compute(ids, options["fc_min"], "mean"),
+                        }
+                        for backend, func in backends.items():
+                            markers, times = self.time(func, options["repeat"])
+                            self.stdout.write(
+                                f"foreground={len(ids)} {backend}: {markers} markers, "
+                                f"p50 {np.median(times):.1f} ms, max {times.max():.1f} ms"
+                            )
+                raise Rollback
+        except Rollback:
+            pass
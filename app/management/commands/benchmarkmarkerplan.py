@@ -0,0 +1,124 @@
+import json
+from datetime import UTC, datetime
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import override_settings
+
+from app.models import (
+    Dataset,
+    Gene,
+    Metacell,
+    MetacellGeneExpression,
+    MetacellType,
+    Species,
+)
+from app.utils.partitions import MGE_TABLE, get_partition_name, is_partitioned
+from app.utils.query_plans import check_plan, explain, get_index_names, summarize
+from rest.views import MetacellMarkerViewSet
+
+# Dense expression of every gene of the species in every metacell of the dataset (subsampled by density)
+_EXPRESSION_SQL = f"""
+    INSERT INTO {MGE_TABLE} (dataset_id, gene_id, metacell_id, umi_raw, umifrac, fold_change)
+    SELECT mc.dataset_id, g.id, mc.id, floor(random() * 20), random() / 100, exp(random_normal())
+    FROM app_metacell mc
+    CROSS JOIN app_gene g
+    WHERE mc.dataset_id = %(dataset_id)s AND g.species_id = %(species_id)s AND random() < %(density)s
+"""
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks the plan of the marker query (`MetacellMarkerViewSet._MARKER_SQL`) on a synthetic dataset.
+
+    Generates a dataset with millions of expression rows in SQL and vacuums it, then runs
+    `EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)` on the marker query with both fold-change filter types.
+    The plan must keep the shape described in the comments of the query: an index-only scan on
+    `app_mge_dataset_gene_covering`, a single SubPlan for foreground membership and no sort on disk.
+    Timing and buffer counts are printed and can be appended to a JSON Lines file (`--record`) to
+    follow them across PostgreSQL upgrades. The dataset is deleted afterwards.
+    """
+
+    help = "Check the plan shape and benchmark the marker query on a synthetic dataset."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--metacells", type=int, default=1000, help="Number of metacells (default: 1000)")
+        parser.add_argument("--genes", type=int, default=2000, help="Number of genes (default: 2000)")
+        parser.add_argument(
+            "--density", type=float, default=1.0, help="Fraction of expressed genes per metacell (default: 1)"
+        )
+        parser.add_argument("--repeat", type=int, default=3, help="Runs per query (default: 3)")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+        parser.add_argument("--record", help="JSON Lines file to append the results to")
+
+    def create_dataset(self, n_metacells, n_genes, density, seed):
+        species = Species.objects.create(scientific_name="Benchmarkus planus", common_name="benchmark")
+        dataset = Dataset.objects.create(species=species, name="benchmark")
+        types = MetacellType.objects.bulk_create(
+            [MetacellType(dataset=dataset, name=f"type{i}") for i in range(max(n_metacells // 50, 1))]
+        )
+        Metacell.objects.bulk_create(
+            [Metacell(dataset=dataset, name=str(i + 1), type=types[i % len(types)]) for i in range(n_metacells)]
+        )
+        Gene.objects.bulk_create([Gene(species=species, name=f"gene{i}") for i in range(n_genes)])
+
+        table = get_partition_name(dataset.pk) if is_partitioned() else MGE_TABLE
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT setseed(%s)", [(seed % 1000) / 1000])
+            cursor.execute(_EXPRESSION_SQL, {"dataset_id": dataset.pk, "species_id": species.pk, "density": density})
+            # Sets the visibility map (required for index-only scans) and statistics
+            cursor.execute(f"VACUUM (ANALYZE) {connection.ops.quote_name(table)}")
+            cursor.execute("ANALYZE app_metacell")
+        return dataset
+
+    def benchmark(self, dataset, fc_min_type, repeat):
+        with override_settings(METACELL_EXPRESSION_BACKEND="rows"):
+            queryset = MetacellMarkerViewSet().get_raw_queryset(dataset, ["type0"], 2, fc_min_type)
+        runs = [explain(queryset.raw_query, queryset.params) for _ in range(repeat)]
+        indexes = get_index_names("app_mge_dataset_gene_covering")
+        problems = check_plan(runs[-1], index_only_scan=indexes, max_subplans=1)
+
+        result = summarize(runs[-1])
+        for key in ("planning_ms", "execution_ms"):
+            result[key] = float(np.median([run[key.replace("_ms", " Time").title()] for run in runs]))
+        return result, problems
+
+    def handle(self, *args, **options):
+        dataset = self.create_dataset(options["metacells"], options["genes"], options["density"], options["seed"])
+        try:
+            n_rows = MetacellGeneExpression.objects.filter(dataset=dataset).count()
+            self.stdout.write(
+                f"Synthetic dataset: {options['metacells']} metacells, {options['genes']} genes, {n_rows} rows"
+            )
+
+            all_problems = []
+            for fc_min_type in ("mean", "median"):
+                result, problems = self.benchmark(dataset, fc_min_type, options["repeat"])
+                all_problems += [f"{fc_min_type}: {problem}" for problem in problems]
+                self.stdout.write(
+                    f"fc_min_type={fc_min_type}: p50 {result['execution_ms']:.1f} ms "
+                    f"(planning {result['planning_ms']:.1f} ms), {result['shared_hit_blocks']} shared blocks hit, "
+                    f"{result['shared_read_blocks']} read, {result['temp_written_blocks']} temp blocks written"
+                )
+
+                if options["record"]:
+                    record = {
+                        "timestamp": datetime.now(UTC).isoformat(),
+                        "postgres": connection.pg_version,
+                        "metacells": options["metacells"],
+                        "genes": options["genes"],
+                        "rows": n_rows,
+                        "fc_min_type": fc_min_type,
+                        **result,
+                        "problems": problems,
+                    }
+                    with open(options["record"], "a") as f:
+                        f.write(json.dumps(record) + "\n")
+        finally:
+            # Also drops the partition of the dataset
+            dataset.species.delete()
+
+        if all_problems:
+            raise CommandError("Unexpected marker query plan:\n" + "\n".join(all_problems))
+        self.stdout.write(self.style.SUCCESS("Marker query plan OK"))
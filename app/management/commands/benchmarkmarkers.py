@@ -0,0 +1,105 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from app.models import (
+    Dataset,
+    Gene,
+    Metacell,
+    MetacellGeneExpression,
+    MetacellType,
+    Species,
+)
+from rest.filters import MetacellGeneExpressionFilter
+
+
+class Rollback(Exception):
+    """Raised to discard the synthetic dataset."""
+
+
+class Command(BaseCommand):
+    """
+    Benchmarks the top-N marker selection (`n_markers`) of metacell gene expression.
+
+    Creates a synthetic dataset with a long-tailed fold-change distribution in a transaction
+    that is rolled back afterwards, then times the filtered queries and counts the SQL statements.
+    """
+
+    help = "Benchmark metacell gene expression queries filtered by top genes (n_markers) on synthetic data."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--metacells", type=int, default=2000, help="Number of metacells (default: 2000)")
+        parser.add_argument("--genes", type=int, default=2000, help="Number of genes (default: 2000)")
+        parser.add_argument(
+            "--density", type=float, default=0.1, help="Fraction of expressed genes per metacell (default: 0.1)"
+        )
+        parser.add_argument("--n-markers", type=int, nargs="+", default=[1, 5, 20], help="Top genes per metacell")
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per query (default: 5)")
+        parser.add_argument("--seed", type=int, default=0, help="Random seed (default: 0)")
+
+    def create_dataset(self, n_metacells, n_genes, density, seed):
+        rng = np.random.default_rng(seed)
+        species = Species.objects.create(scientific_name="Benchmarkus markeri", common_name="benchmark")
+        dataset = Dataset.objects.create(species=species, name="benchmark")
+        types = MetacellType.objects.bulk_create(
+            [MetacellType(dataset=dataset, name=f"type{i}") for i in range(max(n_metacells // 50, 1))]
+        )
+        metacells = Metacell.objects.bulk_create(
+            [Metacell(dataset=dataset, name=str(i + 1), type=types[i % len(types)]) for i in range(n_metacells)]
+        )
+        genes = Gene.objects.bulk_create([Gene(species=species, name=f"gene{i}") for i in range(n_genes)])
+
+        n_expressed = max(int(n_genes * density), 1)
+        for metacell in metacells:
+            expressed = rng.choice(n_genes, size=n_expressed, replace=False)
+            fold_change = rng.lognormal(mean=0, sigma=1, size=n_expressed)
+            MetacellGeneExpression.objects.bulk_create(
+                [
+                    MetacellGeneExpression(
+                        dataset=dataset, gene=genes[g], metacell=metacell, umi_raw=fc, umifrac=fc, fold_change=fc
+                    )
+                    for g, fc in zip(expressed.tolist(), fold_change.tolist())
+                ]
+            )
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {MetacellGeneExpression._meta.db_table}")
+        return dataset
+
+    def benchmark(self, data, repeat):
+        queryset = MetacellGeneExpression.objects.all()
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            with CaptureQueriesContext(connection) as queries:
+                filterset = MetacellGeneExpressionFilter(data, queryset=queryset)
+                rows = len(filterset.qs.values_list("gene_id", "metacell_id", "fold_change"))
+            times.append(time.perf_counter() - start)
+        statements = sum(not query["sql"].startswith("SAVEPOINT") for query in queries.captured_queries)
+        return rows, statements, np.array(times) * 1000
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                start = time.perf_counter()
+                dataset = self.create_dataset(
+                    options["metacells"], options["genes"], options["density"], options["seed"]
+                )
+                n_rows = MetacellGeneExpression.objects.filter(dataset=dataset).count()
+                self.stdout.write(
+                    f"Synthetic dataset: {options['metacells']} metacells, {options['genes']} genes, "
+                    f"{n_rows} expression rows ({time.perf_counter() - start:.1f} s)"
+                )
+
+                for n_markers in options["n_markers"]:
+                    data = {"dataset": dataset.slug, "n_markers": n_markers}
+                    rows, statements, times = self.benchmark(data, options["repeat"])
+                    self.stdout.write(
+                        f"n_markers={n_markers}: {rows} rows, {statements} queries, "
+                        f"p50 {np.median(times):.1f} ms, max {times.max():.1f} ms"
+                    )
+                raise Rollback
+        except Rollback:
+            pass
@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import Dataset
+from app.utils import get_dataset
+from app.utils.expression_arrays import MetacellExpressionArrays
+
+
+class Command(BaseCommand):
+    """
+    Builds the array-per-gene metacell gene expression of datasets from their metacell gene expression rows.
+
+    Arrays already built for the current database version are skipped unless `--force` is given.
+    """
+
+    help = "Build the array-per-gene metacell gene expression (used if METACELL_EXPRESSION_BACKEND is 'arrays')."
+
+    def add_arguments(self, parser):
+        parser.add_argument("datasets", nargs="*", help="Dataset slugs (default: all datasets)")
+        parser.add_argument("--force", action="store_true", help="Rebuild arrays that are up to date")
+
+    def handle(self, *args, **options):
+        datasets = list(Dataset.objects.all())
+        if options["datasets"]:
+            datasets = [get_dataset(slug) for slug in options["datasets"]]
+            if None in datasets:
+                missing = [slug for slug, dataset in zip(options["datasets"], datasets) if dataset is None]
+                raise CommandError(f"Cannot find datasets: {', '.join(missing)}")
+
+        for dataset in datasets:
+            arrays = MetacellExpressionArrays(dataset)
+            if arrays.exists() and not options["force"]:
+                self.stdout.write(f"{dataset.slug}: up to date")
+                continue
+            genes = arrays.build()
+            self.stdout.write(self.style.SUCCESS(f"{dataset.slug}: {genes} genes"))
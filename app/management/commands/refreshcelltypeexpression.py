@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import Dataset
+from app.utils import get_dataset
+from app.utils.cell_type_expression import refresh_cell_type_expression
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the gene expression per metacell type of datasets from their metacell gene expression.
+    """
+
+    help = "Refresh the precomputed gene expression per metacell type."
+
+    def add_arguments(self, parser):
+        parser.add_argument("datasets", nargs="*", help="Dataset slugs (default: all datasets)")
+
+    def handle(self, *args, **options):
+        datasets = list(Dataset.objects.all())
+        if options["datasets"]:
+            datasets = [get_dataset(slug) for slug in options["datasets"]]
+            if None in datasets:
+                missing = [slug for slug, dataset in zip(options["datasets"], datasets) if dataset is None]
+                raise CommandError(f"Cannot find datasets: {', '.join(missing)}")
+
+        for dataset in datasets:
+            rows = refresh_cell_type_expression(dataset)
+            self.stdout.write(self.style.SUCCESS(f"{dataset.slug}: {rows} rows"))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from app.models import Dataset
+from app.utils import get_dataset
+from app.utils.expression_store import MetacellExpressionStore
+from rest.services import MetacellMarkerService
+
+
+class Command(BaseCommand):
+    """
+    Recomputes the markers of every metacell type of datasets (one-vs-rest) from their expression store.
+
+    Expression stores not built for the current database version are built first.
+    """
+
+    help = "Refresh the precomputed markers of all metacell types."
+
+    def add_arguments(self, parser):
+        parser.add_argument("datasets", nargs="*", help="Dataset slugs (default: all datasets)")
+
+    def handle(self, *args, **options):
+        datasets = list(Dataset.objects.all())
+        if options["datasets"]:
+            datasets = [get_dataset(slug) for slug in options["datasets"]]
+            if None in datasets:
+                missing = [slug for slug, dataset in zip(options["datasets"], datasets) if dataset is None]
+                raise CommandError(f"Cannot find datasets: {', '.join(missing)}")
+
+        for dataset in datasets:
+            service = MetacellMarkerService(dataset)
+            if not service.is_available():
+                MetacellExpressionStore(dataset).build()
+            rows = service.refresh_cell_type_markers()
+            self.stdout.write(self.style.SUCCESS(f"{dataset.slug}: {rows} markers"))
@@ -1,31 +1,65 @@
-from django.forms import model_to_dict
+import numpy as np
 from django.shortcuts import get_object_or_404
 
-from app.models import Dataset, Gene, DatasetFile, SingleCellGeneExpression
-from app.utils import get_dataset, read_hdf5
+from app.models import Dataset, Gene, DatasetFile
+from app.utils import align_expression, get_cell_names, get_dataset, read_hdf5_coo, read_hdf5_expression
 
 
 class ExpressionDataManager:
-    """Creates SingleCellExpression models from data in HDF5."""
+    """Creates SingleCellExpression models from data in HDF5.
 
-    def __init__(self, dataset: int, gene: int):
+    The (cell names, UMI fractions) of the gene can be passed as `expression`
+    when already read from HDF5, e.g. in a thread pool by an async view.
+    """
+
+    def __init__(self, dataset: int, gene: int, expression: tuple = None):
         dataset_id = get_dataset(dataset).id
         self.dataset = get_object_or_404(Dataset, pk=dataset_id)
         self.gene = get_object_or_404(Gene, name=gene)
-        dataset_file = get_object_or_404(DatasetFile, dataset_id=self.dataset.pk)
-        self.expression_dictionary = read_hdf5(dataset_file.file.path, self.gene.name)
+        if expression is None:
+            dataset_file = get_object_or_404(DatasetFile, dataset_id=self.dataset.pk, type="singlecell_umifrac")
+            expression = read_hdf5_expression(dataset_file.file.path, self.gene.name)
+        self.cell_names, self.umifrac = expression
 
     def get_expression_dictionary(self):
-        return self.expression_dictionary
+        return dict(zip(self.cell_names.tolist(), self.umifrac.tolist()))
+
+    def get_umifrac(self, cell_names) -> np.ndarray:
+        """Return UMI fractions aligned to the given cell names (NaN if not expressed)."""
+        return align_expression(self.cell_names, self.umifrac, cell_names)
 
     def create_singlecellexpression_models(self):
-        result = []
-        for row, key in enumerate(self.expression_dictionary, 1):
-            scge = SingleCellGeneExpression()
-            scge.id = row
-            scge.gene = self.gene.name
-            scge.dataset = self.dataset.slug
-            scge.single_cell = key
-            scge.umifrac = self.expression_dictionary[key]
-            result.append(model_to_dict(scge))
-        return result
+        gene = self.gene.name
+        dataset = self.dataset.slug
+        return [
+            {"id": row, "dataset": dataset, "gene": gene, "single_cell": name, "umifrac": value}
+            for row, (name, value) in enumerate(zip(self.cell_names.tolist(), self.umifrac.tolist()), 1)
+        ]
+
+
+class MultiGeneExpressionDataManager:
+    """Reads single-cell expression of multiple genes from HDF5 in a single pass."""
+
+    def __init__(self, dataset: str, genes: list):
+        dataset_id = get_dataset(dataset).id
+        self.dataset = get_object_or_404(Dataset, pk=dataset_id)
+        self.genes = list(dict.fromkeys(genes))
+        self.dataset_file = get_object_or_404(DatasetFile, dataset_id=self.dataset.pk, type="singlecell_umifrac")
+
+    def get_coo(self) -> dict:
+        """Return the expressing cells x genes block as COO arrays.
+
+        Rows index the returned cells (only cells expressing any of the genes)
+        and columns index the genes, in the requested order.
+        """
+        path = self.dataset_file.file.path
+        positions, columns, values = read_hdf5_coo(path, self.genes)
+        cells, rows = np.unique(positions, return_inverse=True)
+        return {
+            "dataset": self.dataset.slug,
+            "genes": self.genes,
+            "cells": get_cell_names(path)[cells].tolist(),
+            "row": rows.astype(np.int32),
+            "col": columns,
+            "umifrac": values,
+        }
@@ -0,0 +1,34 @@
+# Generated by Django 5.2.16 on 2026-10-16 23:40
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0018_cytotrace'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetacellTypeGeneExpression',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metacells', models.PositiveIntegerField(help_text='Number of metacells of the metacell type.')),
+                ('fold_change_mean', models.FloatField(help_text='Mean fold-change across metacells.', null=True)),
+                ('fold_change_max', models.FloatField(help_text='Maximum fold-change across metacells.', null=True)),
+                ('umi_raw_sum', models.FloatField(help_text='Total UMI count across metacells.', null=True)),
+                ('umifrac_mean', models.FloatField(help_text='Mean UMI fraction across metacells.', null=True)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mtge', to='app.dataset')),
+                ('gene', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mtge', to='app.gene')),
+                ('metacell_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mtge', to='app.metacelltype')),
+            ],
+            options={
+                'verbose_name': 'metacell type gene expression',
+                'verbose_name_plural': 'metacell type gene expression',
+                'indexes': [models.Index(fields=['dataset', 'gene'], name='app_mtge_dataset_gene')],
+                'unique_together': {('gene', 'metacell_type', 'dataset')},
+            },
+        ),
+    ]
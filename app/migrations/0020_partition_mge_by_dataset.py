@@ -0,0 +1,99 @@
+from django.db import migrations
+
+# Columns of app_metacellgeneexpression, in table order
+COLUMNS = "id, umi_raw, umifrac, fold_change, dataset_id, gene_id, metacell_id"
+
+# The identity column is declared on the parent table, so rows inserted through it (and copied
+# below) take their ids from a single sequence. This runs on PostgreSQL 16 and later.
+CREATE_TABLE = """
+    CREATE TABLE app_metacellgeneexpression (
+        id bigint GENERATED BY DEFAULT AS IDENTITY,
+        umi_raw double precision NULL,
+        umifrac double precision NULL,
+        fold_change double precision NULL,
+        dataset_id bigint NOT NULL,
+        gene_id bigint NOT NULL,
+        metacell_id bigint NOT NULL
+    ) {partition_by};
+"""
+
+# Constraints and indexes are added after copying the rows (faster than
+# maintaining them row by row). On the partitioned table, they are created in
+# each partition, including the covering index for the markers query.
+ADD_CONSTRAINTS = """
+    ALTER TABLE app_metacellgeneexpression
+        ADD CONSTRAINT app_metacellgeneexpression_pkey PRIMARY KEY ({primary_key}),
+        ADD CONSTRAINT app_metacellgeneexpression_gene_id_metacell_id_dataset_id_uniq
+            UNIQUE (gene_id, metacell_id, dataset_id),
+        ADD CONSTRAINT app_metacellgeneexpression_dataset_id_fk_app_dataset_id
+            FOREIGN KEY (dataset_id) REFERENCES app_dataset (id) DEFERRABLE INITIALLY DEFERRED,
+        ADD CONSTRAINT app_metacellgeneexpression_gene_id_fk_app_gene_id
+            FOREIGN KEY (gene_id) REFERENCES app_gene (id) DEFERRABLE INITIALLY DEFERRED,
+        ADD CONSTRAINT app_metacellgeneexpression_metacell_id_fk_app_metacell_id
+            FOREIGN KEY (metacell_id) REFERENCES app_metacell (id) DEFERRABLE INITIALLY DEFERRED;
+
+    CREATE INDEX app_mge_dataset_gene_covering
+        ON app_metacellgeneexpression (dataset_id, gene_id)
+        INCLUDE (metacell_id, umi_raw, fold_change);
+    CREATE INDEX app_metacellgeneexpression_gene_id ON app_metacellgeneexpression (gene_id);
+    CREATE INDEX app_metacellgeneexpression_metacell_id ON app_metacellgeneexpression (metacell_id);
+"""
+
+COPY_ROWS = f"""
+    INSERT INTO app_metacellgeneexpression ({COLUMNS})
+    SELECT {COLUMNS} FROM app_metacellgeneexpression_old;
+    DROP TABLE app_metacellgeneexpression_old;
+
+    SELECT setval(pg_get_serial_sequence('app_metacellgeneexpression', 'id'), COALESCE(MAX(id), 0) + 1, false)
+    FROM app_metacellgeneexpression;
+"""
+
+PARTITION = (
+    "ALTER TABLE app_metacellgeneexpression RENAME TO app_metacellgeneexpression_old;"
+    + CREATE_TABLE.format(partition_by="PARTITION BY LIST (dataset_id)")
+    + """
+    DO $$
+    DECLARE
+        dataset bigint;
+    BEGIN
+        FOR dataset IN SELECT id FROM app_dataset LOOP
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF app_metacellgeneexpression FOR VALUES IN (%s)',
+                'app_metacellgeneexpression_' || dataset,
+                dataset
+            );
+        END LOOP;
+    END $$;
+    """
+    + COPY_ROWS
+    # The primary key of a partitioned table must include the partition key
+    + ADD_CONSTRAINTS.format(primary_key="id, dataset_id")
+)
+
+UNPARTITION = (
+    "ALTER TABLE app_metacellgeneexpression RENAME TO app_metacellgeneexpression_old;"
+    + CREATE_TABLE.format(partition_by="")
+    + COPY_ROWS
+    + ADD_CONSTRAINTS.format(primary_key="id")
+)
+
+
+class Migration(migrations.Migration):
+    """
+    Partition app_metacellgeneexpression by dataset (one LIST partition per dataset).
+
+    Queries filter by dataset and only scan its partition, vacuum runs per partition,
+    and the data of a dataset can be removed by dropping its partition instead of
+    deleting its rows. Partitions of new datasets are created by `app.signals`.
+
+    The Django model state is unchanged: the table keeps its columns, unique
+    constraint and indexes (the primary key additionally includes dataset_id).
+    """
+
+    dependencies = [
+        ("app", "0019_metacelltypegeneexpression"),
+    ]
+
+    operations = [
+        migrations.RunSQL(sql=PARTITION, reverse_sql=UNPARTITION),
+    ]
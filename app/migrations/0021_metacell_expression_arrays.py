@@ -0,0 +1,40 @@
+# Generated by Django 5.2.16 on 2026-10-17 00:20
+
+import django.contrib.postgres.fields
+import django.db.models.deletion
+from django.db import migrations, models
+
+import app.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0020_partition_mge_by_dataset'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetacellExpressionLayout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('metacells', django.contrib.postgres.fields.ArrayField(base_field=models.BigIntegerField(), help_text='Metacell IDs in array order.', size=None)),
+                ('dataset', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='expression_layout', to='app.dataset')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='MetacellGeneExpressionArray',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('umi_raw', django.contrib.postgres.fields.ArrayField(base_field=app.models.RealField(null=True), help_text='Raw UMI count per metacell.', size=None)),
+                ('umifrac', django.contrib.postgres.fields.ArrayField(base_field=app.models.RealField(null=True), help_text='UMI fraction per metacell.', size=None)),
+                ('fold_change', django.contrib.postgres.fields.ArrayField(base_field=app.models.RealField(null=True), help_text='Fold-change per metacell.', size=None)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mge_arrays', to='app.dataset')),
+                ('gene', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mge_arrays', to='app.gene')),
+            ],
+            options={
+                'verbose_name': 'metacell gene expression array',
+                'unique_together': {('dataset', 'gene')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.16 on 2026-10-17 02:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0021_metacell_expression_arrays'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MetacellTypeMarker',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rank', models.PositiveIntegerField(help_text='Rank of the gene by mean fold-change in the metacell type.')),
+                ('bg_sum_umi', models.FloatField(help_text='Total UMI count in other metacells.', null=True)),
+                ('fg_sum_umi', models.FloatField(help_text='Total UMI count in metacells of the type.', null=True)),
+                ('umi_perc', models.FloatField(help_text='Percentage of UMIs in metacells of the type.', null=True)),
+                ('fg_mean_fc', models.FloatField(help_text='Mean fold-change in metacells of the type.', null=True)),
+                ('bg_mean_fc', models.FloatField(help_text='Mean fold-change in other metacells.', null=True)),
+                ('fg_median_fc', models.FloatField(help_text='Median fold-change in metacells of the type.', null=True)),
+                ('bg_median_fc', models.FloatField(help_text='Median fold-change in other metacells.', null=True)),
+                ('dataset', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metacell_type_markers', to='app.dataset')),
+                ('gene', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='metacell_type_markers', to='app.gene')),
+                ('metacell_type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='markers', to='app.metacelltype')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['dataset', 'metacell_type', 'rank'], name='app_mtm_dataset_type_rank')],
+                'unique_together': {('metacell_type', 'gene')},
+            },
+        ),
+    ]
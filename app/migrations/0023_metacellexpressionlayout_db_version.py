@@ -0,0 +1,18 @@
+# Generated by Django 5.2.16 on 2026-10-17 09:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0022_metacelltypemarker'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='metacellexpressionlayout',
+            name='db_version',
+            field=models.CharField(default=None, help_text='Database version the arrays were built for.', max_length=100, null=True),
+        ),
+    ]
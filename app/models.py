@@ -863,7 +863,11 @@ class GeneCorrelation(models.Model):
 
 
 class MetacellGeneExpression(models.Model):
-    """Metacell gene expression model per dataset."""
+    """
+    Metacell gene expression model per dataset.
+
+    The table is partitioned by dataset (see `app.utils.partitions`).
+    """
 
     dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name="mge")
     gene = models.ForeignKey(Gene, on_delete=models.CASCADE, related_name="mge")
@@ -881,7 +885,8 @@ class MetacellGeneExpression(models.Model):
         indexes = [
             # Covering index for the markers query (rest.views.MetacellMarkerViewSet):
             # an index-only scan of a dataset slice, pre-ordered by gene for a
-            # streaming GroupAggregate. Created concurrently in migration 0014.
+            # streaming GroupAggregate. Created concurrently in migration 0014, and
+            # in each dataset partition since migration 0020.
             models.Index(
                 fields=["dataset", "gene"],
                 include=["metacell", "umi_raw", "fold_change"],
@@ -894,6 +899,117 @@ class MetacellGeneExpression(models.Model):
         return f"{self.gene} {self.metacell}"
 
 
+class MetacellTypeGeneExpression(models.Model):
+    """
+    Gene expression aggregated per metacell type and dataset.
+
+    Precomputed from `MetacellGeneExpression` when loading data (see `app.utils.cell_type_expression`).
+    """
+
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name="mtge")
+    gene = models.ForeignKey(Gene, on_delete=models.CASCADE, related_name="mtge")
+    metacell_type = models.ForeignKey(MetacellType, on_delete=models.CASCADE, related_name="mtge")
+    metacells = models.PositiveIntegerField(help_text="Number of metacells of the metacell type.")
+    fold_change_mean = models.FloatField(null=True, help_text="Mean fold-change across metacells.")
+    fold_change_max = models.FloatField(null=True, help_text="Maximum fold-change across metacells.")
+    umi_raw_sum = models.FloatField(null=True, help_text="Total UMI count across metacells.")
+    umifrac_mean = models.FloatField(null=True, help_text="Mean UMI fraction across metacells.")
+
+    class Meta:
+        """Meta options."""
+
+        unique_together = ["gene", "metacell_type", "dataset"]
+        verbose_name = "metacell type gene expression"
+        verbose_name_plural = verbose_name
+        indexes = [models.Index(fields=["dataset", "gene"], name="app_mtge_dataset_gene")]
+
+    def __str__(self):
+        """String representation."""
+        return f"{self.gene} {self.metacell_type}"
+
+
+class MetacellTypeMarker(models.Model):
+    """
+    Marker genes of a metacell type against all other metacells of its dataset (one-vs-rest).
+
+    Precomputed for all metacell types of a dataset at once when loading data (see
+    `rest.services.MetacellMarkerService.refresh_cell_type_markers`), with the statistics of
+    the markers endpoint. Only genes with a mean or median fold-change of at least
+    `min_fold_change` across the metacells of the type are stored, ranked by mean fold-change.
+    """
+
+    min_fold_change = 1
+
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name="metacell_type_markers")
+    metacell_type = models.ForeignKey(MetacellType, on_delete=models.CASCADE, related_name="markers")
+    gene = models.ForeignKey(Gene, on_delete=models.CASCADE, related_name="metacell_type_markers")
+    rank = models.PositiveIntegerField(help_text="Rank of the gene by mean fold-change in the metacell type.")
+    bg_sum_umi = models.FloatField(null=True, help_text="Total UMI count in other metacells.")
+    fg_sum_umi = models.FloatField(null=True, help_text="Total UMI count in metacells of the type.")
+    umi_perc = models.FloatField(null=True, help_text="Percentage of UMIs in metacells of the type.")
+    fg_mean_fc = models.FloatField(null=True, help_text="Mean fold-change in metacells of the type.")
+    bg_mean_fc = models.FloatField(null=True, help_text="Mean fold-change in other metacells.")
+    fg_median_fc = models.FloatField(null=True, help_text="Median fold-change in metacells of the type.")
+    bg_median_fc = models.FloatField(null=True, help_text="Median fold-change in other metacells.")
+
+    class Meta:
+        """Meta options."""
+
+        unique_together = ["metacell_type", "gene"]
+        indexes = [models.Index(fields=["dataset", "metacell_type", "rank"], name="app_mtm_dataset_type_rank")]
+
+    def __str__(self):
+        """String representation."""
+        return f"{self.gene} {self.metacell_type} (#{self.rank})"
+
+
+class RealField(models.FloatField):
+    """Single-precision (4-byte) floating-point field."""
+
+    def db_type(self, connection):
+        """Return the PostgreSQL column type."""
+        return "real"
+
+
+class MetacellExpressionLayout(models.Model):
+    """Order of the metacells in the metacell gene expression arrays of a dataset."""
+
+    dataset = models.OneToOneField(Dataset, on_delete=models.CASCADE, related_name="expression_layout")
+    metacells = ArrayField(models.BigIntegerField(), help_text="Metacell IDs in array order.")
+    db_version = models.CharField(
+        max_length=100, null=True, default=None, help_text="Database version the arrays were built for."
+    )
+
+    def __str__(self):
+        """String representation."""
+        return f"{self.dataset} ({len(self.metacells)} metacells)"
+
+
+class MetacellGeneExpressionArray(models.Model):
+    """
+    Metacell gene expression of a gene per dataset, as arrays aligned to `MetacellExpressionLayout`.
+
+    Compact alternative to `MetacellGeneExpression` (one row per gene instead of one row
+    per gene and metacell), built from it by `app.utils.expression_arrays`. Missing values are null.
+    """
+
+    dataset = models.ForeignKey(Dataset, on_delete=models.CASCADE, related_name="mge_arrays")
+    gene = models.ForeignKey(Gene, on_delete=models.CASCADE, related_name="mge_arrays")
+    umi_raw = ArrayField(RealField(null=True), help_text="Raw UMI count per metacell.")
+    umifrac = ArrayField(RealField(null=True), help_text="UMI fraction per metacell.")
+    fold_change = ArrayField(RealField(null=True), help_text="Fold-change per metacell.")
+
+    class Meta:
+        """Meta options."""
+
+        unique_together = ["dataset", "gene"]
+        verbose_name = "metacell gene expression array"
+
+    def __str__(self):
+        """String representation."""
+        return f"{self.gene} ({self.dataset})"
+
+
 class SingleCellGeneExpression(models.Model):
     """Single cell gene expression model per dataset."""
 
@@ -0,0 +1,20 @@
+"""Signal handlers of app models."""
+
+from django.db.models.signals import post_save, pre_delete
+from django.dispatch import receiver
+
+from .models import Dataset
+from .utils.partitions import create_partition, drop_partition
+
+
+@receiver(post_save, sender=Dataset)
+def create_dataset_partition(sender, instance, created, **kwargs):
+    """Create the metacell gene expression partition of a new dataset."""
+    if created:
+        create_partition(instance.pk)
+
+
+@receiver(pre_delete, sender=Dataset)
+def drop_dataset_partition(sender, instance, **kwargs):
+    """Drop the metacell gene expression partition of a dataset before deleting it (instead of deleting rows)."""
+    drop_partition(instance.pk)
@@ -25,7 +25,6 @@ export function loadExpressionData(id, dataset, genes = null) {
         dataset,
         metacells: $("#metacells").val().join(","),
         fc_min: $("#fc_min").val(),
-        sort_genes: true,
         log2: true,
         clip_log2,
         limit: 0,
@@ -39,14 +38,17 @@ export function loadExpressionData(id, dataset, genes = null) {
 
     const apiURL = url + "?" + params.toString();
 
-    fetch(apiURL)
+    // Fetch matrices to avoid repeating gene and metacell strings per row. Genes are sorted
+    // by the heatmap: without `sort_genes`, selected genes are read from the expression store
+    fetch(apiURL + "&shape=matrix")
         .then((response) => response.json())
-        .then((data) => {
-            createExpressionHeatmap(`#${id}-plot`, data, [0, clip_log2]);
-        })
+        .then((matrix) =>
+            createExpressionHeatmap(`#${id}-plot`, matrix, [0, clip_log2]),
+        )
         .catch((error) => console.error("Error fetching data:", error));
 
-    appendDataMenu(id, apiURL, "Metacell gene expression");
+    // Exported rows in the order of the heatmap
+    appendDataMenu(id, apiURL + "&sort_genes=true", "Metacell gene expression");
 }
 
 /**
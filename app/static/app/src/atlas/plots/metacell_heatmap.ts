@@ -53,6 +53,7 @@ function createMetacellRugPlot(orient = "top") {
  * @param {string} valueLabel - Label for the color legend.
  * @param {string} [boundaryColor="black"] - Color for metacell boundary lines.
  * @param {Array} [clip=[null, null]] - Min/max clipping range for color scaling.
+ * @param {Array} [transform=[]] - Vega-Lite transforms turning the input records into one record per cell.
  *
  * @returns {Object} Vega-Lite specification for the heatmap.
  */
@@ -65,6 +66,7 @@ function createMetacellHeatmap(
     valueLabel,
     boundaryColor = "black",
     clip = [null, null],
+    transform = [],
 ) {
     const metacellBoundaryLines = {
         mark: "rule",
@@ -97,6 +99,7 @@ function createMetacellHeatmap(
         height: "container",
         data: { name: "exprData", values: data },
         transform: [
+            ...transform,
             { calculate: "toNumber(datum.metacell_name)", as: "metacell_name" },
             {
                 joinaggregate: [
@@ -163,14 +166,66 @@ function createMetacellHeatmap(
     return chart;
 }
 
+/**
+ * Order the genes of an expression matrix by the metacell where they peak (highest fold-change),
+ * from the last to the first metacell, as the `sort_genes` parameter of the expression endpoint.
+ *
+ * @param {Object} matrix - Gene and metacell axes and genes x metacells matrices of values.
+ *
+ * @returns {Array} Gene (row) indices in order; genes with the same peak keep their order.
+ */
+function sortGenesByPeak(matrix) {
+    const metacells = matrix.metacells.map((metacell) => Number(metacell.name));
+    const peaks = matrix.values.fold_change.map((row) => {
+        let peak = null;
+        row.forEach((value, j) => {
+            if (value === null) return;
+            if (
+                peak === null ||
+                value > row[peak] ||
+                (value === row[peak] && metacells[j] > metacells[peak])
+            ) {
+                peak = j;
+            }
+        });
+        return peak === null ? -Infinity : metacells[peak];
+    });
+    return matrix.genes.map((_, i) => i).sort((a, b) => peaks[b] - peaks[a]);
+}
+
 /**
  * Render heatmap of gene expression for a given species and dataset.
  *
+ * The expression matrices are passed to Vega-Lite as one record per gene, with its row of each
+ * matrix and the metacell axis as parallel arrays, and flattened into cells by Vega-Lite itself.
+ *
  * @param {string} id - DOM element ID where the heatmap will be embedded.
- * @param {Array} data - Array of objects containing metacell and gene expression data.
+ * @param {Object} matrix - Expression matrices (`shape=matrix`): `genes` and `metacells` axes
+ *                          and a genes x metacells matrix per field in `values` (null if missing).
  * @param {Array} clip - Array with min and max scores to clip gene expression.
  */
-export function createExpressionHeatmap(id, data, clip = [0, null]) {
+export function createExpressionHeatmap(id, matrix, clip = [0, null]) {
+    const fields = Object.keys(matrix.values);
+    const metacells = {
+        metacell_name: matrix.metacells.map((metacell) => metacell.name),
+        metacell_type: matrix.metacells.map((metacell) => metacell.type),
+        metacell_color: matrix.metacells.map((metacell) => metacell.color),
+    };
+    const data = sortGenesByPeak(matrix).map((i, index) => {
+        const gene = {
+            index,
+            gene_name: matrix.genes[i].name,
+            gene_description: matrix.genes[i].description,
+        };
+        for (const field of fields) gene[field] = matrix.values[field][i];
+        return Object.assign(gene, metacells);
+    });
+    const transform = [
+        { flatten: [...fields, ...Object.keys(metacells)] },
+        // Keep expressed cells
+        { filter: "datum.fold_change !== null" },
+    ];
+
     const chart = createMetacellHeatmap(
         id,
         data,
@@ -180,6 +235,7 @@ export function createExpressionHeatmap(id, data, clip = [0, null]) {
         "Log\u2082 FC",
         "gray",
         clip,
+        transform,
     );
 
     vegaEmbed(id, chart, { renderer: "canvas" })
@@ -1,10 +1,11 @@
 import pytest
-from django.db import IntegrityError
+from django.db import IntegrityError, connection
 from django.test import TestCase
 
 from datetime import datetime
 
-from app.models import Publication, Source, Species, DBVersion, GeneModule, Orthogroup
+from app.models import Publication, Source, Species, DBVersion, GeneModule, Orthogroup, MetacellGeneExpression
+from app.utils.partitions import get_partition_name, is_partitioned, reset_partition
 
 
 class TestSpeciesModel(TestCase):
@@ -247,3 +248,46 @@ class TestDBVersionModel(TestCase):
         """Using NULL for both version and commit should violate database constraint."""
         with pytest.raises(IntegrityError):
             DBVersion.objects.create(description="Invalid")
+
+
+class TestMetacellGeneExpressionPartitions(TestCase):
+    """Test partitions of metacell gene expression per dataset."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.species = Species.objects.create(scientific_name="Trichoplax adhaerens")
+        cls.dataset = cls.species.datasets.create(name="adult")
+        cls.other = cls.species.datasets.create(name="larva")
+        gene = cls.species.genes.create(name="gene1")
+        for dataset in (cls.dataset, cls.other):
+            metacell = dataset.metacells.create(name="1")
+            dataset.mge.create(gene=gene, metacell=metacell, umi_raw=1, umifrac=0.5, fold_change=2)
+
+    def count_partition_rows(self, dataset_id):
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT to_regclass(%s)", [get_partition_name(dataset_id)])
+            if cursor.fetchone()[0] is None:
+                return None
+            cursor.execute(f"SELECT COUNT(*) FROM {get_partition_name(dataset_id)}")
+            return cursor.fetchone()[0]
+
+    def test_partition_per_dataset(self):
+        assert is_partitioned()
+        assert self.count_partition_rows(self.dataset.pk) == 1
+        assert self.count_partition_rows(self.other.pk) == 1
+        assert MetacellGeneExpression.objects.filter(dataset=self.dataset).count() == 1
+
+    def test_reset_partition(self):
+        reset_partition(self.dataset.pk)
+        assert self.count_partition_rows(self.dataset.pk) == 0
+        assert self.count_partition_rows(self.other.pk) == 1
+
+        # The new partition accepts rows
+        self.dataset.mge.create(gene=self.species.genes.get(), metacell=self.dataset.metacells.get(), umi_raw=2)
+        assert self.count_partition_rows(self.dataset.pk) == 1
+
+    def test_drop_partition_with_dataset(self):
+        dataset_id = self.dataset.pk
+        self.dataset.delete()
+        assert self.count_partition_rows(dataset_id) is None
+        assert MetacellGeneExpression.objects.count() == 1
@@ -1,9 +1,42 @@
 """Test app utility functions."""
 
-from django.test import TestCase
+import asyncio
+import itertools
+import math
+import os
+import shutil
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import h5py
+import numpy as np
+import scipy.sparse
+from django.test import SimpleTestCase, TestCase, override_settings
 
 from app.models import Species
-from app.utils import get_dataset_dict, get_species_dict
+from app.utils import (
+    HDF5ExpressionFile,
+    HDF5HandlePool,
+    align_expression,
+    get_dataset_dict,
+    get_species_dict,
+    read_hdf5,
+    read_hdf5_columns,
+    read_hdf5_coo,
+    read_hdf5_expression,
+    run_hdf5_read,
+)
+from scripts.data.hdf5.hdf5_writer import (
+    CSR_LAYOUT,
+    FLOAT16_ENCODING,
+    FLOAT32_ENCODING,
+    GENE_LAYOUT,
+    UINT16_ENCODING,
+    compute_umifractions,
+    write_hdf5,
+)
 
 
 class SpeciesDictTest(TestCase):
@@ -28,3 +61,300 @@ class SpeciesDictTest(TestCase):
         assert "Chordata" in meta
         assert "Animalia" in meta
         assert "Mus musculus" not in meta
+
+
+class ReadHDF5Test(SimpleTestCase):
+    hdf_file = str(Path(__file__).parents[2] / "rest" / "tests" / "test_fixtures" / "gene_expression_test.hdf5")
+
+    def test_read_columns(self):
+        positions, values = read_hdf5_columns(self.hdf_file, "g1")
+        np.testing.assert_array_equal(positions, [2, 4])
+        np.testing.assert_allclose(values, [2142.857, 10000], rtol=0.001)
+
+    def test_read_missing_and_empty_gene(self):
+        for gene in ("g3", "missing"):
+            positions, values = read_hdf5_columns(self.hdf_file, gene)
+            assert positions.size == 0
+            assert values.size == 0
+
+    def test_read_expression_names(self):
+        cell_names, _ = read_hdf5_expression(self.hdf_file, "g4")
+        assert cell_names.tolist() == ["c2", "c3"]
+        assert read_hdf5(self.hdf_file, "g2").keys() == {"c3", "c4"}
+
+    def test_read_coo(self):
+        positions, genes, values = read_hdf5_coo(self.hdf_file, ["g4", "missing", "g1"])
+        np.testing.assert_array_equal(positions, [1, 2, 2, 4])
+        np.testing.assert_array_equal(genes, [0, 0, 2, 2])
+        np.testing.assert_allclose(values, [10000, 4285.714, 2142.857, 10000], rtol=0.001)
+
+        positions, genes, values = read_hdf5_coo(self.hdf_file, [])
+        assert positions.size == genes.size == values.size == 0
+
+    def test_align_expression(self):
+        cell_names, values = read_hdf5_expression(self.hdf_file, "g1")
+        aligned = align_expression(cell_names, values, ["c5", "c1", "c3"])
+        assert math.isclose(aligned[0], 10000, rel_tol=0.001)
+        assert np.isnan(aligned[1])
+        assert math.isclose(aligned[2], 2142.857, rel_tol=0.001)
+
+
+class RDS2HDF5Test(SimpleTestCase):
+    """Round trip of synthetic UMI counts through the HDF5 writer (scripts/data/hdf5/hdf5_writer.py) and reader"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+        counts = scipy.sparse.random(60, 40, density=0.2, format="lil", random_state=0, dtype=np.float32)
+        counts[0, :] = 0  # Gene not expressed
+        counts = counts.tocsc()
+        counts.data = np.ceil(counts.data * 10)
+        counts.eliminate_zeros()
+        self.counts = counts.toarray()
+        compute_umifractions(counts)
+        self.matrix = counts.tocsr()
+        self.genes = [f"gene{i}" for i in range(60)]
+        self.cells = [f"cell{j}" for j in range(40)]
+
+    def test_umifractions(self):
+        expected = 10000.0 * self.counts / np.maximum(self.counts.sum(axis=0), 1e-12)
+        np.testing.assert_allclose(self.matrix.toarray(), expected)
+
+    def test_round_trip(self):
+        encodings = ((FLOAT32_ENCODING, 1e-6), (FLOAT16_ENCODING, 5e-4), (UINT16_ENCODING, 1e-4))
+        for layout, (encoding, rtol), matrix_format in itertools.product(
+            (GENE_LAYOUT, CSR_LAYOUT), encodings, ("csr", "csc")
+        ):
+            with self.subTest(layout=layout, encoding=encoding, matrix_format=matrix_format):
+                path = os.path.join(self.tmpdir, f"{layout}-{encoding}-{matrix_format}.hdf5")
+                matrix = self.matrix.asformat(matrix_format)
+                # Low memory ceiling, to write the genes in several batches
+                write_hdf5(path, self.genes, self.cells, matrix, layout, max_memory=0.001, encoding=encoding)
+
+                f = HDF5ExpressionFile(path)
+                self.addCleanup(f.close)
+                assert f.layout == layout and f.encoding == encoding
+                assert f.cell_names.tolist() == self.cells
+                for i, gene in enumerate(self.genes):
+                    positions, values = f.read(gene)
+                    row = self.matrix.getrow(i)
+                    np.testing.assert_array_equal(positions, row.indices)
+                    assert values.dtype == np.float32
+                    assert np.all(np.abs(values - row.data) <= rtol * row.data)
+                assert f.read("gene0")[0].size == 0
+                assert f.read("missing")[0].size == 0
+
+    def test_store_quantization_once_per_file(self):
+        path = os.path.join(self.tmpdir, "genes-uint16.hdf5")
+        write_hdf5(path, self.genes, self.cells, self.matrix, GENE_LAYOUT, encoding=UINT16_ENCODING)
+        with h5py.File(path, "r") as root:
+            assert root["gene_names"].asstr()[:].tolist() == self.genes
+            assert root["scale"].shape == root["offset"].shape == (len(self.genes),)
+            assert not any(root[gene].attrs for gene in self.genes[1:])
+
+
+class HDF5HandlePoolTest(SimpleTestCase):
+    hdf_file = ReadHDF5Test.hdf_file
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.pool = HDF5HandlePool(maxsize=2)
+        self.addCleanup(self.pool.clear)
+
+    def copy_fixture(self, name):
+        path = os.path.join(self.tmpdir, name)
+        shutil.copy(self.hdf_file, path)
+        return path
+
+    def test_reuse_open_handle(self):
+        with self.pool.open(self.hdf_file) as f1:
+            pass
+        with self.pool.open(self.hdf_file) as f2:
+            assert f2 is f1
+            assert f2.cell_names.tolist() == ["c1", "c2", "c3", "c4", "c5"]
+        assert len(self.pool) == 1
+
+    def test_close_on_evict(self):
+        paths = [self.copy_fixture(f"{i}.hdf5") for i in range(3)]
+        handles = []
+        for path in paths:
+            with self.pool.open(path) as f:
+                handles.append(f)
+        assert len(self.pool) == 2
+        assert not handles[0]
+        assert handles[1] and handles[2]
+
+    def test_close_evicted_handle_after_use(self):
+        paths = [self.copy_fixture(f"{i}.hdf5") for i in range(3)]
+        with self.pool.open(paths[0]) as f0:
+            for path in paths[1:]:
+                with self.pool.open(path):
+                    pass
+            # Evicted from the pool, but still open for its reader
+            assert len(self.pool) == 2
+            assert f0.read("g1")[0].tolist() == [2, 4]
+        assert not f0
+
+    def test_concurrent_readers(self):
+        path = self.copy_fixture("data.hdf5")
+        done = threading.Event()
+
+        def read():
+            with self.pool.open(path) as f:
+                f.read("g1")
+            done.set()
+
+        with self.pool.open(self.hdf_file):
+            thread = threading.Thread(target=read)
+            thread.start()
+            # Not blocked by the handle in use
+            assert done.wait(5)
+        thread.join()
+
+    def test_reopen_modified_file(self):
+        path = self.copy_fixture("data.hdf5")
+        with self.pool.open(path) as f1:
+            pass
+        stat = os.stat(path)
+        os.utime(path, (stat.st_atime, stat.st_mtime + 10))
+        with self.pool.open(path) as f2:
+            assert f2 is not f1
+        assert not f1
+        assert len(self.pool) == 1
+
+
+@override_settings(HDF5_READS_PER_DATASET=1)
+class RunHDF5ReadTest(SimpleTestCase):
+    hdf_file = ReadHDF5Test.hdf_file
+
+    def test_read_in_thread_pool(self):
+        cell_names, values = asyncio.run(run_hdf5_read(1, read_hdf5_expression, self.hdf_file, "g1"))
+        assert cell_names.tolist() == ["c3", "c5"]
+        assert math.isclose(values[1], 10000)
+
+    def test_limit_concurrent_reads_per_dataset(self):
+        lock = threading.Lock()
+        running, peak = {}, {}
+
+        def read(key):
+            with lock:
+                running[key] = running.get(key, 0) + 1
+                peak[key] = max(peak.get(key, 0), running[key])
+            time.sleep(0.02)
+            with lock:
+                running[key] -= 1
+
+        async def main():
+            await asyncio.gather(*(run_hdf5_read(key, read, key) for key in ("a", "a", "a", "b", "b")))
+
+        asyncio.run(main())
+        assert peak == {"a": 1, "b": 1}
+
+    def test_limit_concurrent_reads_across_event_loops(self):
+        lock = threading.Lock()
+        running, peak = [0], [0]
+
+        def read():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.02)
+            with lock:
+                running[0] -= 1
+
+        # As under WSGI, where each request runs in its own event loop
+        threads = [threading.Thread(target=asyncio.run, args=(run_hdf5_read("c", read),)) for _ in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert peak == [1]
+
+    def test_grant_reads_in_fifo_order(self):
+        order = []
+
+        async def main():
+            tasks = []
+            for i in range(5):
+                tasks.append(asyncio.create_task(run_hdf5_read("d", lambda i=i: (time.sleep(0.01), order.append(i)))))
+                # Let each task queue up before creating the next one
+                await asyncio.sleep(0)
+            await asyncio.gather(*tasks)
+
+        asyncio.run(main())
+        assert order == [0, 1, 2, 3, 4]
+
+    def test_cancelled_read_releases_semaphore(self):
+        async def main():
+            first = asyncio.create_task(run_hdf5_read("e", time.sleep, 0.05))
+            await asyncio.sleep(0)
+            waiting = asyncio.create_task(run_hdf5_read("e", time.sleep, 0))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            await first
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            return await asyncio.wait_for(run_hdf5_read("e", lambda: "read"), timeout=1)
+
+        assert asyncio.run(main()) == "read"
+
+
+class CSRLayoutTest(SimpleTestCase):
+    hdf_file = ReadHDF5Test.hdf_file
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+        self.csr_file = os.path.join(self.tmpdir, "csr.hdf5")
+
+        # Same matrix as the per-gene fixture
+        with h5py.File(self.csr_file, "w") as root:
+            root.attrs["layout"] = "csr"
+            root.create_dataset("cell_names", data=["c1", "c2", "c3", "c4", "c5"], dtype=h5py.string_dtype())
+            root.create_dataset("gene_names", data=["g1", "g2", "g3", "g4"], dtype=h5py.string_dtype())
+            root.create_dataset("indptr", data=[0, 2, 4, 4, 6])
+            root.create_dataset("indices", data=np.array([2, 4, 2, 3, 1, 2], dtype=np.int32), chunks=(4,))
+            root.create_dataset(
+                "data",
+                data=np.array([2142.857, 10000, 3571.428, 10000, 10000, 4285.714], dtype=np.float32),
+                chunks=(4,),
+                compression="gzip",
+            )
+
+    def test_detect_layout(self):
+        for path, layout in ((self.csr_file, "csr"), (self.hdf_file, "genes")):
+            f = HDF5ExpressionFile(path)
+            self.addCleanup(f.close)
+            assert f.layout == layout
+
+    def test_same_values_as_gene_layout(self):
+        for gene in ("g1", "g2", "g3", "g4", "missing"):
+            csr_positions, csr_values = read_hdf5_columns(self.csr_file, gene)
+            positions, values = read_hdf5_columns(self.hdf_file, gene)
+            np.testing.assert_array_equal(csr_positions, positions)
+            np.testing.assert_allclose(csr_values, values, rtol=0.001)
+
+    def test_decode_quantized_values(self):
+        values = np.array([2142.857, 10000, 3571.428, 10000, 10000, 4285.714])
+        logs = np.log(values)
+        offset = np.array([logs[0], logs[2], 0, logs[5]])
+        scale = np.array([logs[1] - logs[0], logs[3] - logs[2], 1, logs[4] - logs[5]]) / 65534
+        rows = np.repeat(np.arange(4), [2, 2, 0, 2])
+        codes = np.rint((logs - offset[rows]) / scale[rows]) + 1
+
+        for encoding, data, rtol in (("float16", values, 5e-4), ("uint16", codes, 1e-4)):
+            path = os.path.join(self.tmpdir, f"{encoding}.hdf5")
+            shutil.copy(self.csr_file, path)
+            with h5py.File(path, "a") as root:
+                root.attrs["encoding"] = encoding
+                del root["data"]
+                root.create_dataset("data", data=data.astype(encoding))
+                root.create_dataset("scale", data=scale)
+                root.create_dataset("offset", data=offset)
+
+            for gene, expected in (("g1", values[:2]), ("g2", values[2:4]), ("g3", []), ("g4", values[4:])):
+                _, decoded = read_hdf5_columns(path, gene)
+                assert decoded.dtype == np.float32
+                np.testing.assert_allclose(decoded, expected, rtol=rtol)
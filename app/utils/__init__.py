@@ -1,5 +1,6 @@
 """Utils module imports utility functions."""
 
 from .utils import *
+from .hdf5 import *
 from .markdown import *
 from .blog import *
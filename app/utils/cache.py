@@ -2,6 +2,8 @@
 
 from django.core.cache import cache
 
+from ..models import DBVersion
+
 
 def get_validated_cache(key, validation):
     """Get cache for a given key and check validation string."""
@@ -16,3 +18,9 @@ def get_validated_cache(key, validation):
 def set_validated_cache(key, validation, data, timeout=24 * 60 * 60):
     """Set cache for a given key with a validation string."""
     cache.set(key, (data, validation), timeout=timeout)
+
+
+def get_db_version():
+    """Get a string identifying the latest database version (to validate cached data)."""
+    latest = DBVersion.objects.values_list("pk", "populated_at").first()
+    return None if latest is None else f"{latest[0]}:{latest[1].isoformat()}"
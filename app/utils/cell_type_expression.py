@@ -0,0 +1,41 @@
+"""Precomputed gene expression per metacell type."""
+
+from django.db import connection, transaction
+
+from ..models import MetacellTypeGeneExpression
+
+_AGGREGATE_SQL = """
+    INSERT INTO app_metacelltypegeneexpression (
+        dataset_id, gene_id, metacell_type_id, metacells,
+        fold_change_mean, fold_change_max, umi_raw_sum, umifrac_mean
+    )
+    SELECT
+        mge.dataset_id, mge.gene_id, mc.type_id, COUNT(*),
+        AVG(mge.fold_change), MAX(mge.fold_change), SUM(mge.umi_raw), AVG(mge.umifrac)
+    FROM app_metacellgeneexpression mge
+    JOIN app_metacell mc ON mc.id = mge.metacell_id
+    WHERE mge.dataset_id = %s AND mc.type_id IS NOT NULL
+    GROUP BY mge.dataset_id, mge.gene_id, mc.type_id
+"""
+
+
+def refresh_cell_type_expression(dataset):
+    """
+    Recompute the gene expression per metacell type of a dataset.
+
+    Replaces the `MetacellTypeGeneExpression` rows of the dataset with aggregates of its
+    `MetacellGeneExpression` rows (metacells without a type are ignored). The aggregation
+    runs in a single `INSERT ... SELECT` statement within a transaction, so readers see
+    either the previous or the new rows.
+
+    Args:
+        dataset (Dataset): Dataset to refresh.
+
+    Returns:
+        int: Number of rows created.
+    """
+    with transaction.atomic():
+        MetacellTypeGeneExpression.objects.filter(dataset=dataset).delete()
+        with connection.cursor() as cursor:
+            cursor.execute(_AGGREGATE_SQL, [dataset.pk])
+            return cursor.rowcount
@@ -0,0 +1,121 @@
+"""Array-per-gene storage of metacell gene expression per dataset."""
+
+import numpy as np
+from django.db import connection, transaction
+
+from ..models import Metacell, MetacellExpressionLayout, MetacellGeneExpressionArray
+from .cache import get_db_version
+
+_BUILD_SQL = """
+    INSERT INTO app_metacellgeneexpressionarray (dataset_id, gene_id, umi_raw, umifrac, fold_change)
+    SELECT
+        l.dataset_id, g.gene_id,
+        array_agg(mge.umi_raw::real ORDER BY o.pos),
+        array_agg(mge.umifrac::real ORDER BY o.pos),
+        array_agg(mge.fold_change::real ORDER BY o.pos)
+    FROM app_metacellexpressionlayout l
+    CROSS JOIN unnest(l.metacells) WITH ORDINALITY AS o(metacell_id, pos)
+    CROSS JOIN (SELECT DISTINCT gene_id FROM app_metacellgeneexpression WHERE dataset_id = %(dataset_id)s) g
+    LEFT JOIN app_metacellgeneexpression mge
+        ON mge.dataset_id = l.dataset_id AND mge.gene_id = g.gene_id AND mge.metacell_id = o.metacell_id
+    WHERE l.dataset_id = %(dataset_id)s
+    GROUP BY l.dataset_id, g.gene_id
+"""
+
+
+class MetacellExpressionArrays:
+    """
+    Metacell gene expression of a dataset stored as one row of `real[]` arrays per gene.
+
+    Postgres `MetacellGeneExpression` rows remain the source of truth: `MetacellGeneExpressionArray`
+    rows are built from them, with values aligned to the metacell order of the dataset's
+    `MetacellExpressionLayout` (metacells by primary key) and null for missing rows. Compared to
+    one row per gene and metacell, this drops the three foreign keys and the tuple overhead of
+    each value, and gene-centric queries read one (compressed) row per gene.
+
+    `lookup` has the same interface as `MetacellExpressionStore.lookup`. A (gene, metacell)
+    pair is considered present if any of its values is not null.
+
+    As stores, arrays are versioned by the latest `DBVersion`: once a new version is logged
+    (e.g. after reloading the dataset), arrays of the previous version are ignored until rebuilt
+    (e.g. with `python manage.py buildexpressionarrays`).
+    """
+
+    fields = ("umi_raw", "umifrac", "fold_change")
+
+    def __init__(self, dataset, version=None):
+        self.dataset = dataset
+        self.version = get_db_version() if version is None else version
+
+    def get_layouts(self):
+        """Return the layout of the dataset (as a queryset) if built for the current database version."""
+        return MetacellExpressionLayout.objects.filter(dataset=self.dataset, db_version=self.version)
+
+    def exists(self):
+        """Return whether the arrays of the dataset are built for the current database version."""
+        return self.get_layouts().exists()
+
+    def build(self):
+        """
+        Build the arrays of the dataset from its metacell gene expression rows, replacing previous arrays.
+
+        Runs within a transaction, so readers see either the previous or the new arrays.
+
+        Returns:
+            int: Number of genes (array rows) created.
+        """
+        metacells = Metacell.objects.filter(dataset=self.dataset).order_by("pk").values_list("pk", flat=True)
+        with transaction.atomic():
+            MetacellGeneExpressionArray.objects.filter(dataset=self.dataset).delete()
+            MetacellExpressionLayout.objects.update_or_create(
+                dataset=self.dataset, defaults={"metacells": list(metacells), "db_version": self.version}
+            )
+            with connection.cursor() as cursor:
+                cursor.execute(_BUILD_SQL, {"dataset_id": self.dataset.pk})
+                return cursor.rowcount
+
+    def get_layout(self):
+        """Return the metacell primary keys in array order, or None if not built for the current database version."""
+        layout = self.get_layouts().values_list("metacells", flat=True).first()
+        return None if layout is None else np.array(layout, dtype=np.int64)
+
+    def lookup(self, gene_ids=None, metacell_ids=None):
+        """
+        Return the expression of a set of genes in a set of metacells.
+
+        Args:
+            gene_ids (iterable, optional): Gene primary keys (default: all genes).
+            metacell_ids (iterable, optional): Metacell primary keys (default: all metacells).
+
+        Returns:
+            dict: Arrays of gene and metacell primary keys and of each field for the existing
+                  rows, ordered by gene and metacell; None if the arrays are not built for the
+                  current database version.
+        """
+        layout = self.get_layout()
+        if layout is None:
+            return None
+
+        queryset = MetacellGeneExpressionArray.objects.filter(dataset=self.dataset).order_by("gene_id")
+        if gene_ids is not None:
+            queryset = queryset.filter(gene_id__in=list(gene_ids))
+        rows = list(queryset.values_list("gene_id", *self.fields))
+
+        if metacell_ids is None:
+            cols = np.arange(layout.size)
+        else:
+            cols = np.flatnonzero(np.isin(layout, np.asarray(list(metacell_ids), dtype=np.int64)))
+
+        # None (null) values become NaN
+        data = {}
+        for i, field in enumerate(self.fields, 1):
+            values = np.array([row[i] for row in rows], dtype=np.float32).reshape(len(rows), layout.size)
+            data[field] = values[:, cols]
+        present = ~np.all([np.isnan(values) for values in data.values()], axis=0)
+        genes, metacells = np.nonzero(present)
+
+        gene_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        result = {"gene": gene_ids[genes], "metacell": layout[cols][metacells]}
+        for field in self.fields:
+            result[field] = data[field][genes, metacells]
+        return result
@@ -0,0 +1,165 @@
+"""Memory-mapped dense store of metacell gene expression per dataset."""
+
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+from django.conf import settings
+from numpy.lib.format import open_memmap
+
+from ..models import Metacell, MetacellGeneExpression
+from .cache import get_db_version
+
+
+class MetacellExpressionStore:
+    """
+    Dense genes x metacells matrices of the metacell gene expression of a dataset.
+
+    Postgres remains the source of truth: the store is built from the
+    `MetacellGeneExpression` rows of a dataset and saved as float32 `.npy`
+    files (NaN for null values) that worker processes memory-map. The sorted
+    gene and metacell primary keys index the rows and columns of the matrices,
+    and a boolean matrix marks which (gene, metacell) rows exist.
+
+    Stores are versioned by the latest `DBVersion`: once a new version is
+    logged, the store of the previous version is ignored until rebuilt
+    (e.g. with `python manage.py buildexpressionstore`).
+    """
+
+    fields = ("umi_raw", "umifrac", "fold_change")
+    arrays = ("genes", "metacells", "present", *fields)
+
+    # Memory-mapped arrays of the loaded store of each dataset in this process
+    _loaded = {}
+    _lock = threading.Lock()
+
+    def __init__(self, dataset, version=None):
+        self.dataset = dataset
+        self.version = get_db_version() if version is None else version
+        digest = hashlib.sha1(str(self.version).encode()).hexdigest()[:12]
+        self.root = os.path.join(settings.EXPRESSION_STORE_DIR, str(dataset.pk))
+        self.path = os.path.join(self.root, digest)
+
+    def exists(self):
+        """Return whether the store is built for the current database version."""
+        return os.path.isdir(self.path)
+
+    def build(self, chunk_size=100000):
+        """
+        Build the store from the database, replacing stores of previous versions.
+
+        The matrices are written to memory-mapped files one chunk of genes at a
+        time, so memory use is bounded by the chunk size rather than by the size
+        of the dataset.
+
+        Args:
+            chunk_size (int): Approximate number of (gene, metacell) cells filled at a time.
+        """
+        queryset = MetacellGeneExpression.objects.filter(dataset=self.dataset)
+        genes = queryset.order_by("gene_id").values_list("gene_id", flat=True).distinct()
+        genes = np.array(list(genes), dtype=np.int64)
+        metacells = Metacell.objects.filter(dataset=self.dataset).order_by("pk").values_list("pk", flat=True)
+        metacells = np.array(list(metacells), dtype=np.int64)
+        genes_per_chunk = max(chunk_size // max(metacells.size, 1), 1)
+
+        os.makedirs(self.root, exist_ok=True)
+        tmpdir = tempfile.mkdtemp(prefix=".build-", dir=self.root)
+        try:
+            np.save(os.path.join(tmpdir, "genes.npy"), genes)
+            np.save(os.path.join(tmpdir, "metacells.npy"), metacells)
+            shape = (genes.size, metacells.size)
+            arrays = {"present": open_memmap(os.path.join(tmpdir, "present.npy"), mode="w+", dtype=bool, shape=shape)}
+            for field in self.fields:
+                filename = os.path.join(tmpdir, f"{field}.npy")
+                arrays[field] = open_memmap(filename, mode="w+", dtype=np.float32, shape=shape)
+            for start in range(0, genes.size, genes_per_chunk):
+                chunk_genes = genes[start : start + genes_per_chunk]
+                rows = (
+                    queryset.filter(gene_id__gte=chunk_genes[0], gene_id__lte=chunk_genes[-1])
+                    .order_by()
+                    .values_list("gene_id", "metacell_id", *self.fields)
+                )
+                block = {name: array[start : start + chunk_genes.size] for name, array in arrays.items()}
+                self._fill(list(rows), chunk_genes, metacells, block)
+            for array in arrays.values():
+                array.flush()
+            del arrays
+            os.rename(tmpdir, self.path)
+        except OSError:
+            # Built concurrently by another process
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            if not self.exists():
+                raise
+        except BaseException:
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            raise
+
+        for name in os.listdir(self.root):
+            if name != os.path.basename(self.path) and not name.startswith(".build-"):
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+    @staticmethod
+    def _fill(chunk, genes, metacells, arrays):
+        """Fill the rows of a chunk of genes into the (memory-mapped) rows of the matrices."""
+        # Missing rows are NaN
+        for field in MetacellExpressionStore.fields:
+            arrays[field][:] = np.nan
+        if not chunk:
+            return
+        # None (null) values become NaN
+        chunk = np.array(chunk, dtype=np.float64)
+        rows = np.searchsorted(genes, chunk[:, 0])
+        cols = np.searchsorted(metacells, chunk[:, 1])
+        arrays["present"][rows, cols] = True
+        for i, field in enumerate(MetacellExpressionStore.fields, 2):
+            arrays[field][rows, cols] = chunk[:, i]
+
+    def load(self):
+        """Return the memory-mapped arrays of the store, or None if not built for the current version."""
+        with self._lock:
+            path, arrays = self._loaded.get(self.dataset.pk, (None, None))
+            if path != self.path:
+                if not self.exists():
+                    return None
+                arrays = {name: np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r") for name in self.arrays}
+                self._loaded[self.dataset.pk] = (self.path, arrays)
+            return arrays
+
+    @staticmethod
+    def _positions(index, ids):
+        """Return the sorted positions of the given ids in a sorted index (ignoring missing ids)."""
+        if ids is None:
+            return np.arange(index.size)
+        ids = np.asarray(list(ids), dtype=np.int64)
+        positions = np.minimum(np.searchsorted(index, ids), max(index.size - 1, 0))
+        found = index[positions] == ids if index.size else np.zeros(ids.size, dtype=bool)
+        return np.unique(positions[found])
+
+    def lookup(self, gene_ids=None, metacell_ids=None):
+        """
+        Return the expression of a set of genes in a set of metacells.
+
+        Args:
+            gene_ids (iterable, optional): Gene primary keys (default: all genes).
+            metacell_ids (iterable, optional): Metacell primary keys (default: all metacells).
+
+        Returns:
+            dict: Arrays of gene and metacell primary keys and of each field for the existing
+                  rows, ordered by gene and metacell; None if the store is not built.
+        """
+        arrays = self.load()
+        if arrays is None:
+            return None
+
+        rows = self._positions(arrays["genes"], gene_ids)
+        cols = self._positions(arrays["metacells"], metacell_ids)
+        block = np.ix_(rows, cols)
+        genes, metacells = np.nonzero(arrays["present"][block])
+
+        result = {"gene": arrays["genes"][rows][genes], "metacell": arrays["metacells"][cols][metacells]}
+        for field in self.fields:
+            result[field] = arrays[field][block][genes, metacells]
+        return result
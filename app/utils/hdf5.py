@@ -0,0 +1,417 @@
+"""Functions to read single-cell gene expression from HDF5 files."""
+
+import asyncio
+import functools
+import os
+import threading
+from collections import OrderedDict, defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import h5py
+import numpy as np
+from django.conf import settings
+from prometheus_client import Counter
+
+hdf5_handle_pool_lookups = Counter(
+    "bca_hdf5_handle_pool_lookups",
+    "Lookups of open HDF5 file handles in the per-process pool.",
+    ["result"],
+)
+
+
+# Layouts of HDF5 expression files, stored in the "layout" root attribute:
+# - "genes": one dataset per gene with (cell position, value) records
+# - "csr": global indptr/indices/data arrays with one row per gene
+GENE_LAYOUT = "genes"
+CSR_LAYOUT = "csr"
+
+# Encodings of the UMI fractions, stored in the "encoding" root attribute:
+# - "float32": exact values
+# - "float16": half precision values
+# - "uint16": log-scaled codes with a per-gene scale and offset (stored in
+#   the scale and offset datasets, indexed like gene_names)
+FLOAT32_ENCODING = "float32"
+FLOAT16_ENCODING = "float16"
+UINT16_ENCODING = "uint16"
+
+
+def dequantize(codes: np.ndarray, scale: float, offset: float) -> np.ndarray:
+    """Decodes log-scaled uint16 codes as exp(offset + (code - 1) * scale), code 0 being zero"""
+    values = np.exp(offset + (codes.astype(np.float64) - 1) * scale).astype(np.float32)
+    values[codes == 0] = 0
+    return values
+
+
+class HDF5ExpressionFile:
+    """Read-only HDF5 expression file in either on-disk layout and encoding
+
+    Opening the file loads the metadata needed to read genes: the cell names,
+    the row pointers of the CSR layout and, for the uint16 encoding (in either
+    layout), the scale and offset of each gene. Both need the gene index, read
+    from gene_names. Values are always returned decoded as float32.
+    """
+
+    def __init__(self, hdf_file: str):
+        self.file = h5py.File(hdf_file, "r")
+        self.layout = self.file.attrs.get("layout", GENE_LAYOUT)
+        self.encoding = self.file.attrs.get("encoding", FLOAT32_ENCODING)
+
+        self.cell_names = self.file["/cell_names"].asstr()[:].astype(str)
+        self.cell_names.flags.writeable = False
+
+        if self.layout == CSR_LAYOUT or self.encoding == UINT16_ENCODING:
+            self.gene_index = {}
+            for row, gene in enumerate(self.file["/gene_names"].asstr()[:]):
+                self.gene_index.setdefault(gene, row)
+        if self.layout == CSR_LAYOUT:
+            self.indptr = self.file["/indptr"][:]
+        if self.encoding == UINT16_ENCODING:
+            self.scale = self.file["/scale"][:]
+            self.offset = self.file["/offset"][:]
+
+    def __bool__(self):
+        return bool(self.file)
+
+    def read(self, gene: str) -> tuple[np.ndarray, np.ndarray]:
+        """Reads (cell positions, values) of a gene; empty arrays if not expressed."""
+        empty = np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+        if self.layout == CSR_LAYOUT:
+            row = self.gene_index.get(gene)
+            if row is None:
+                return empty
+            start, end = self.indptr[row], self.indptr[row + 1]
+            if start == end:
+                return empty
+            values = self.file["/data"][start:end]
+            if self.encoding == UINT16_ENCODING:
+                return self.file["/indices"][start:end], dequantize(values, self.scale[row], self.offset[row])
+            return self.file["/indices"][start:end], values.astype(np.float32, copy=False)
+
+        dataset = self.file.get(f"/{gene}")
+        if dataset is None or dataset.size == 0:
+            return empty
+        data = dataset[:]
+        if self.encoding == UINT16_ENCODING:
+            row = self.gene_index[gene]
+            return data["c"], dequantize(data["e"], self.scale[row], self.offset[row])
+        return data["c"], data["e"].astype(np.float32, copy=False)
+
+    def close(self):
+        self.file.close()
+
+
+class HDF5HandlePool:
+    """Process-local LRU pool of read-only HDF5 file handles
+
+    Handles are keyed by file path and modification time, so replacing a file
+    on disk opens a fresh handle. The decoded cell names are cached alongside
+    each handle. Evicted and stale handles are closed explicitly, once no
+    longer in use.
+    """
+
+    def __init__(self, maxsize: int | None = None):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        # Number of readers of each handle, and evicted handles to close after their last reader
+        self._readers = defaultdict(int)
+        self._evicted = set()
+        self._lock = threading.Lock()
+
+    @property
+    def maxsize(self) -> int:
+        if self._maxsize is None:
+            return settings.HDF5_HANDLE_POOL_SIZE
+        return self._maxsize
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _open(self, key: tuple[str, float]) -> HDF5ExpressionFile:
+        entry = self._entries.get(key)
+        if entry is not None:
+            hdf5_handle_pool_lookups.labels(result="hit").inc()
+            self._entries.move_to_end(key)
+            return entry
+
+        hdf5_handle_pool_lookups.labels(result="miss").inc()
+        path = key[0]
+        for stale in [k for k in self._entries if k[0] == path]:
+            self._close(stale)
+
+        entry = HDF5ExpressionFile(path)
+        self._entries[key] = entry
+        while len(self._entries) > max(self.maxsize, 1):
+            self._close(next(iter(self._entries)))
+        return entry
+
+    def _close(self, key: tuple[str, float]):
+        entry = self._entries.pop(key)
+        if self._readers[entry]:
+            self._evicted.add(entry)
+        else:
+            entry.close()
+
+    @contextmanager
+    def open(self, hdf_file: str):
+        """Yields the pooled handle of a HDF5 file
+
+        The pool lock is only held to look up (or open) the handle, so reads of
+        different files run concurrently. A handle evicted while in use is
+        closed when its last reader is done.
+
+        Args:
+            hdf_file: path to the HDF5 file
+        Yields:
+            HDF5ExpressionFile with the open file and its cell names
+        """
+        key = (os.path.abspath(hdf_file), os.path.getmtime(hdf_file))
+        with self._lock:
+            entry = self._open(key)
+            self._readers[entry] += 1
+        try:
+            yield entry
+        finally:
+            with self._lock:
+                self._readers[entry] -= 1
+                if not self._readers[entry]:
+                    del self._readers[entry]
+                    if entry in self._evicted:
+                        self._evicted.discard(entry)
+                        entry.close()
+
+    def clear(self):
+        """Closes all pooled handles (handles in use are closed by their last reader)."""
+        with self._lock:
+            for key in list(self._entries):
+                self._close(key)
+
+
+hdf5_pool = HDF5HandlePool()
+
+
+class ReadSemaphore:
+    """Semaphore shared by the event loops of all threads of the process, granted in FIFO order
+
+    Under WSGI, each request runs its async view in a new event loop, so an
+    `asyncio.Semaphore` (bound to one loop) cannot limit reads across requests,
+    and a `threading.Semaphore` would block the loop (or a pool thread) while
+    waiting. Waiters await a future of their own loop instead, and a released
+    slot is handed to the oldest waiter through `call_soon_threadsafe`.
+    """
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    async def acquire(self):
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._value > 0 and not self._waiters:
+                self._value -= 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter not in self._waiters
+                if not granted:
+                    self._waiters.remove(waiter)
+            # A cancelled request never holds a slot, even if it was handed one meanwhile
+            if granted:
+                self.release()
+            raise
+
+    def release(self):
+        while True:
+            with self._lock:
+                if not self._waiters:
+                    self._value += 1
+                    return
+                loop, future = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(_grant, future)
+                return
+            except RuntimeError:
+                # Event loop closed: hand the slot to the next waiter
+                continue
+
+
+def _grant(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+_read_executor = None
+_read_executor_lock = threading.Lock()
+# Per-dataset semaphores, shared by all threads and event loops of the process
+_read_semaphores = {}
+_read_semaphores_lock = threading.Lock()
+
+
+def get_read_executor() -> ThreadPoolExecutor:
+    """Returns the process-wide thread pool used to run blocking HDF5 reads."""
+    global _read_executor
+    with _read_executor_lock:
+        if _read_executor is None:
+            _read_executor = ThreadPoolExecutor(max_workers=settings.HDF5_READ_THREADS, thread_name_prefix="hdf5")
+        return _read_executor
+
+
+def get_read_semaphore(key) -> ReadSemaphore:
+    """Returns the process-wide semaphore limiting concurrent HDF5 reads with a key."""
+    with _read_semaphores_lock:
+        semaphore = _read_semaphores.get(key)
+        if semaphore is None:
+            semaphore = _read_semaphores[key] = ReadSemaphore(max(settings.HDF5_READS_PER_DATASET, 1))
+        return semaphore
+
+
+async def run_hdf5_read(key, func, *args, **kwargs):
+    """Runs a blocking HDF5 read in the bounded thread pool without blocking the event loop
+
+    At most `settings.HDF5_READS_PER_DATASET` reads with the same key run at
+    once in the process, whether requests are served by ASGI (one event loop)
+    or WSGI (one event loop per request), so requests for a single popular
+    dataset wait in their event loop, in arrival order, instead of taking
+    every thread of the pool.
+
+    Args:
+        key: concurrency key, e.g. the dataset primary key
+        func: blocking function to call, e.g. read_hdf5_expression
+        *args, **kwargs: arguments passed to the function
+    Returns:
+        The return value of the function
+    """
+    loop = asyncio.get_running_loop()
+    semaphore = get_read_semaphore(key)
+    await semaphore.acquire()
+    try:
+        return await loop.run_in_executor(get_read_executor(), functools.partial(func, *args, **kwargs))
+    finally:
+        semaphore.release()
+
+
+def get_cell_names(hdf_file: str) -> np.ndarray:
+    """Returns the decoded cell names stored in a HDF5 file
+
+    Args:
+        hdf_file: path to the HDF5 file
+    Returns:
+        NumPy array of cell names, e.g. ["AACTC-1", "ACCG-1"]
+    """
+    with hdf5_pool.open(hdf_file) as f:
+        return f.cell_names
+
+
+def read_hdf5_columns(hdf_file: str, gene: str) -> tuple[np.ndarray, np.ndarray]:
+    """Reads the expression values for a given gene from HDF5 file as columns
+
+    Both the per-gene and the CSR layouts are supported.
+
+    Args:
+        hdf_file: path to the HDF5 file
+        gene: a gene, e.g ("Spolac_c99997_g1")
+    Returns:
+        Tuple with (cell positions, UMI frac expression values), e.g.
+        ([0, 3], [1.462, 1.235]); cell positions index the array of cell names
+
+    """
+    with hdf5_pool.open(hdf_file) as f:
+        return f.read(gene)
+
+
+def read_hdf5_expression(hdf_file: str, gene: str) -> tuple[np.ndarray, np.ndarray]:
+    """Reads the expression values for a given gene from HDF5 file
+
+    Args:
+        hdf_file: path to the HDF5 file
+        gene: a gene, e.g ("Spolac_c99997_g1")
+    Returns:
+        Tuple with (cell names, UMI frac expression values), e.g.
+        (["AACTC-1", "ACCG-1"], [1.462, 1.235])
+    """
+    with hdf5_pool.open(hdf_file) as f:
+        positions, values = f.read(gene)
+        return f.cell_names[positions], values
+
+
+def read_hdf5_coo(hdf_file: str, genes: list[str]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Reads the expression values for multiple genes from HDF5 file in a single open
+
+    Args:
+        hdf_file: path to the HDF5 file
+        genes: list of genes, e.g. ["Spolac_c99997_g1", "Spolac_c99998_g1"]
+    Returns:
+        Tuple with COO arrays (cell positions, gene indices, UMI frac expression values);
+        cell positions index the array of cell names and gene indices the list of genes
+    """
+    positions, values = [], []
+    with hdf5_pool.open(hdf_file) as f:
+        for gene in genes:
+            gene_positions, gene_values = f.read(gene)
+            positions.append(gene_positions)
+            values.append(gene_values)
+
+    counts = [p.size for p in positions]
+    gene_indices = np.repeat(np.arange(len(genes), dtype=np.int32), counts)
+    if not genes:
+        return np.empty(0, dtype=np.int32), gene_indices, np.empty(0, dtype=np.float32)
+    return np.concatenate(positions).astype(np.int32), gene_indices, np.concatenate(values).astype(np.float32)
+
+
+def read_hdf5(hdf_file: str, gene: str) -> dict[str, float]:
+    """Reads the expression values for a given gene from HDF5 file
+
+    Args:
+        hdf_file: path to the HDF5 file
+        gene: a gene, e.g ("Spolac_c99997_g1")
+    Returns:
+        A dictionary of cell names to UMI frac expression values, e.g.
+        {"AACTC-1": 1.462, "ACCG-1": 1.235}
+
+    """
+    cell_names, values = read_hdf5_expression(hdf_file, gene)
+    return dict(zip(cell_names.tolist(), values.tolist()))
+
+
+def align_names(names: np.ndarray, query) -> np.ndarray:
+    """Finds the position of each queried name in an array of names
+
+    Args:
+        names: array of unique names
+        query: names to look up
+    Returns:
+        NumPy array with the position of each queried name (-1 if not found)
+    """
+    names = np.asarray(names, dtype=str)
+    query = np.asarray(query, dtype=str)
+    if names.size == 0 or query.size == 0:
+        return np.full(query.shape[0], -1, dtype=np.int64)
+
+    order = np.argsort(names)
+    positions = np.searchsorted(names, query, sorter=order)
+    matches = order[np.minimum(positions, order.size - 1)]
+    return np.where(names[matches] == query, matches, -1)
+
+
+def align_expression(cell_names: np.ndarray, values: np.ndarray, query: list) -> np.ndarray:
+    """Aligns sparse expression values to a list of cell names
+
+    Args:
+        cell_names: names of the cells expressing the gene
+        values: expression values of those cells
+        query: cell names to align expression values to
+    Returns:
+        NumPy array with one value per queried cell (NaN if not expressed)
+    """
+    matches = align_names(cell_names, query)
+    result = np.full(matches.shape[0], np.nan, dtype=np.float32)
+    found = matches >= 0
+    result[found] = values[matches[found]]
+    return result
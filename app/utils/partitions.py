@@ -0,0 +1,81 @@
+"""Partitions of the metacell gene expression table per dataset.
+
+`app_metacellgeneexpression` is LIST-partitioned by `dataset_id` (migration 0020),
+with one partition per dataset named `app_metacellgeneexpression_<dataset id>`.
+Partitions are created and dropped along with datasets (see `app.signals`);
+indexes and constraints of the parent table, such as the covering index
+`app_mge_dataset_gene_covering`, are created in each partition automatically.
+
+Detaching or dropping a partition takes an ACCESS EXCLUSIVE lock on the parent table until the
+end of the transaction, blocking all reads of metacell gene expression (of every dataset) meanwhile.
+
+Foreign keys of the table are `DEFERRABLE INITIALLY DEFERRED` (as created by Django), and
+PostgreSQL refuses to drop or detach a partition with pending foreign key checks ("pending
+trigger events") from rows written earlier in the transaction. These checks are run first.
+"""
+
+from django.db import connection, transaction
+
+from ..models import MetacellGeneExpression
+
+MGE_TABLE = "app_metacellgeneexpression"
+
+
+def get_partition_name(dataset_id):
+    """Return the name of the partition of a dataset."""
+    return f"{MGE_TABLE}_{int(dataset_id)}"
+
+
+def is_partitioned():
+    """Return whether the metacell gene expression table is partitioned (i.e. migration 0020 is applied)."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s))", [MGE_TABLE]
+        )
+        return cursor.fetchone()[0]
+
+
+def create_partition(dataset_id):
+    """Create the partition of a dataset, if missing."""
+    if not is_partitioned():
+        return
+    name = connection.ops.quote_name(get_partition_name(dataset_id))
+    with connection.cursor() as cursor:
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {MGE_TABLE} FOR VALUES IN ({int(dataset_id)})")
+
+
+def _check_deferred_constraints(cursor):
+    """Run the pending (deferred) constraint checks of the transaction, keeping constraints deferred afterwards."""
+    cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+    cursor.execute("SET CONSTRAINTS ALL DEFERRED")
+
+
+def drop_partition(dataset_id):
+    """Drop the partition of a dataset (and its metacell gene expression), if it exists."""
+    if not is_partitioned():
+        return
+    name = connection.ops.quote_name(get_partition_name(dataset_id))
+    with transaction.atomic(), connection.cursor() as cursor:
+        _check_deferred_constraints(cursor)
+        cursor.execute(f"DROP TABLE IF EXISTS {name}")
+
+
+def reset_partition(dataset_id):
+    """
+    Remove all metacell gene expression of a dataset by replacing its partition with an empty one.
+
+    Detaching and dropping the partition is much faster than deleting millions of rows, and leaves
+    no dead tuples to vacuum. Falls back to a regular delete if the table is not partitioned.
+    """
+    if not is_partitioned():
+        MetacellGeneExpression.objects.filter(dataset_id=dataset_id).delete()
+        return
+
+    name = connection.ops.quote_name(get_partition_name(dataset_id))
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [get_partition_name(dataset_id)])
+        if cursor.fetchone()[0]:
+            _check_deferred_constraints(cursor)
+            cursor.execute(f"ALTER TABLE {MGE_TABLE} DETACH PARTITION {name}")
+            cursor.execute(f"DROP TABLE {name}")
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF {MGE_TABLE} FOR VALUES IN ({int(dataset_id)})")
@@ -0,0 +1,91 @@
+"""Inspect PostgreSQL query plans (`EXPLAIN ... FORMAT JSON`)."""
+
+import json
+
+from django.db import connection
+
+
+def explain(sql, params=None, analyze=True):
+    """
+    Return the JSON plan of a query.
+
+    Args:
+        sql (str): Query.
+        params (list or dict, optional): Query parameters.
+        analyze (bool): Whether to run the query to report actual times and buffer usage.
+
+    Returns:
+        dict: Plan with its planning and execution times (`Plan`, `Planning Time`, ...).
+    """
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    with connection.cursor() as cursor:
+        cursor.execute(f"EXPLAIN ({options}) {sql}", params)
+        plan = cursor.fetchone()[0]
+    return (json.loads(plan) if isinstance(plan, str) else plan)[0]
+
+
+def iter_nodes(node):
+    """Yield a plan node and all its descendants (including sub-plans and CTEs)."""
+    yield node
+    for child in node.get("Plans", []):
+        yield from iter_nodes(child)
+
+
+def get_index_names(index):
+    """Return the name of an index and of its partition indexes (if the index is partitioned)."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = to_regclass(%s)
+            """,
+            [index],
+        )
+        return {index, *(name for (name,) in cursor.fetchall())}
+
+
+def summarize(explained):
+    """Return the timing (ms) and buffer counts (blocks) of an analyzed plan."""
+    plan = explained["Plan"]
+    return {
+        "planning_ms": explained.get("Planning Time"),
+        "execution_ms": explained.get("Execution Time"),
+        "shared_hit_blocks": plan.get("Shared Hit Blocks"),
+        "shared_read_blocks": plan.get("Shared Read Blocks"),
+        "temp_written_blocks": plan.get("Temp Written Blocks"),
+    }
+
+
+def check_plan(explained, index_only_scan=None, max_subplans=None):
+    """
+    Check the shape of a plan.
+
+    Args:
+        explained (dict): Plan returned by `explain`.
+        index_only_scan (set, optional): Names of indexes of which one must be read by an index-only scan.
+        max_subplans (int, optional): Maximum number of SubPlans (subqueries evaluated per row).
+
+    Returns:
+        list: Descriptions of the problems found (empty if none). External (on-disk) sorts are always problems.
+    """
+    nodes = list(iter_nodes(explained["Plan"]))
+    problems = []
+
+    if index_only_scan is not None:
+        scans = [n for n in nodes if n["Node Type"] == "Index Only Scan" and n.get("Index Name") in index_only_scan]
+        if not scans:
+            relations = [n for n in nodes if "Relation Name" in n]
+            used = {f"{n['Node Type']} on {n.get('Index Name') or n['Relation Name']}" for n in relations}
+            problems.append(f"No index-only scan on {', '.join(sorted(index_only_scan))} ({', '.join(sorted(used))})")
+
+    subplans = [n for n in nodes if n.get("Parent Relationship") == "SubPlan"]
+    if max_subplans is not None and len(subplans) > max_subplans:
+        names = ", ".join(n.get("Subplan Name", "?") for n in subplans)
+        problems.append(f"{len(subplans)} SubPlans, expected at most {max_subplans} ({names})")
+
+    for node in nodes:
+        if node.get("Sort Space Type") == "Disk" or "external" in node.get("Sort Method", ""):
+            problems.append(f"External sort ({node.get('Sort Method')}, {node.get('Sort Space Used')} kB on disk)")
+    return problems
@@ -1,10 +1,6 @@
 """Misc utility functions."""
 
 import json
-from typing import Dict
-
-import h5py
-import numpy as np
 
 from django.urls import reverse
 
@@ -207,38 +203,3 @@ def get_cell_atlas_links(url_name, dataset=None):
             link["href"] = "#"
     return links
 
-
-def read_hdf5(hdf_file: str, gene: str) -> Dict[str, float]:
-    """Reads the expression values for a given gene from HDF5 file
-
-    Args:
-        hdf_file: path to the HDF5 file
-        gene: a gene, e.g ("Spolac_c99997_g1")
-    Returns:
-        A dictionary of cell names to UMI frac expression values, e.g.
-        {"AACTC-1": 1.462, "ACCG-1": 1.235}
-
-    """
-    with h5py.File(hdf_file, "r") as f:
-        expression_values = f.get(f"/{gene}", default=np.empty(0))[:]
-        cell_names = f.get("/cell_names")[:]
-        cell_positions_dict = create_positions_dictionary(cell_names)
-        result = {}
-        for elem in np.nditer(expression_values, flags=["zerosize_ok"]):
-            position = int(elem["c"])
-            result[cell_positions_dict[position]] = float(elem["e"])
-        return result
-
-
-def create_positions_dictionary(a_list: np.typing.ArrayLike) -> Dict[int, str]:
-    """Creates a dictionary from positions to elements in the array
-
-    Args:
-        a_list: numpy array of strings (cell names)
-    Returns:
-        dictionary e.g: { 0: "AAACG-1", 3:"CCTG-3"}
-    """
-    dictionary = {}
-    for pos, value in enumerate(a_list):
-        dictionary[pos] = str(value, encoding="ascii")
-    return dictionary
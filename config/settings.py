@@ -38,9 +38,26 @@ GOATOOLS_VERSION = get_goatools_version()
 # Max sequences for alignment
 MAX_ALIGNMENT_SEQS = get_env("BCA_APP_MAX_ALIGNMENT_SEQS", 100, type="int")
 
+# Max genes per single-cell expression request
+MAX_EXPRESSION_GENES = get_env("BCA_APP_MAX_EXPRESSION_GENES", 50, type="int")
+
 # Max file upload size in MB
 MAX_FILE_SIZE = get_env("BCA_APP_MAX_FILE_SIZE", 10, type="int")
 
+# Max HDF5 file handles kept open per worker process
+HDF5_HANDLE_POOL_SIZE = get_env("BCA_APP_HDF5_HANDLE_POOL_SIZE", 8, type="int")
+
+# Threads per worker process running HDF5 reads of async (ASGI) requests,
+# and max concurrent reads of a single dataset
+HDF5_READ_THREADS = get_env("BCA_APP_HDF5_READ_THREADS", 4, type="int")
+HDF5_READS_PER_DATASET = get_env("BCA_APP_HDF5_READS_PER_DATASET", 2, type="int")
+
+# Max genes per cached cell type markers result (larger results are not cached)
+MARKER_CACHE_MAX_ROWS = get_env("BCA_APP_MARKER_CACHE_MAX_ROWS", 20000, type="int")
+
+# Default backend computing cell type markers: "sql" or "numpy" (from the expression store; see rest.services.markers)
+MARKER_BACKEND = get_env("BCA_APP_MARKER_BACKEND", "sql")
+
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -203,6 +220,16 @@ STATIC_ROOT = os.path.join(BASE_DIR, "static")
 MEDIA_URL = "/data/"
 MEDIA_ROOT = os.path.join(BASE_DIR, "data")
 
+# Memory-mapped metacell gene expression stores (see app.utils.expression_store)
+EXPRESSION_STORE_DIR = get_env("BCA_APP_EXPRESSION_STORE_DIR", os.path.join(BASE_DIR, "expression_store"))
+
+# Storage of metacell gene expression read by the markers and expression endpoints:
+# "rows" (one row per gene and metacell) or "arrays" (one row of arrays per gene; see app.utils.expression_arrays)
+METACELL_EXPRESSION_BACKEND = get_env("BCA_APP_METACELL_EXPRESSION_BACKEND", "rows")
+
+# Parse the Gene Ontology of GO enrichment when WSGI workers start (see rest.services.go_enrichment)
+GO_DAG_PRELOAD = get_env("BCA_APP_GO_DAG_PRELOAD", "True", type="bool")
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
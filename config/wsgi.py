@@ -9,8 +9,15 @@ https://docs.djangoproject.com/en/5.1/howto/deployment/wsgi/
 
 import os
 
+from django.conf import settings
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
 
 application = get_wsgi_application()
+
+if settings.GO_DAG_PRELOAD:
+    # Parse the Gene Ontology in each worker before serving enrichment requests
+    from rest.services.go_enrichment import warm_godag_cache
+
+    warm_godag_cache()
@@ -29,6 +29,12 @@ python manage.py collectstatic --noinput
 
 # Deploy Django app
 if [ "${ENVIRONMENT:-}" = "prod" ]; then
+    # Build metacell gene expression stores missing for the current database version
+    # (up-to-date stores are skipped; set BCA_APP_BUILD_EXPRESSION_STORES=False to build them separately)
+    if [ "${BCA_APP_BUILD_EXPRESSION_STORES:-True}" = "True" ]; then
+        python manage.py buildexpressionstore
+    fi
+
     # Serve Django apps using gunicorn
     gunicorn -w 4 config.wsgi --bind 0.0.0.0:8000
 else
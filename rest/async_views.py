@@ -0,0 +1,68 @@
+"""Async entry points of REST API views reading single-cell expression from HDF5.
+
+Under ASGI (`config.asgi`), Django runs sync views in a single thread per
+worker process, so a slow h5py read would stall every other sync request.
+These wrappers read the expression of the requested gene in the bounded HDF5
+thread pool (see `app.utils.run_hdf5_read`) while the event loop keeps serving
+requests, then run the DRF view with the prefetched expression as usual.
+
+Under WSGI (`gunicorn config.wsgi`, as deployed), each request runs its async
+view in its own event loop and worker thread: reads still go through the same
+thread pool and per-dataset limit of the process, but sync requests are not
+served while waiting.
+"""
+
+import logging
+
+from asgiref.sync import sync_to_async
+from django.views.decorators.csrf import csrf_exempt
+
+from app import models
+from app.utils import get_dataset, read_hdf5_expression, run_hdf5_read
+
+logger = logging.getLogger(__name__)
+
+
+async def prefetch_expression(dataset, gene):
+    """
+    Read the single-cell expression of a gene in the HDF5 thread pool.
+
+    Args:
+        dataset (str): Dataset slug.
+        gene (str): Gene name.
+
+    Returns:
+        tuple: (cell names, UMI fractions), or None if the dataset, gene or HDF5 file
+               cannot be found (the view then reports the error as usual).
+    """
+    dataset = await sync_to_async(get_dataset)(dataset)
+    if dataset is None or not await models.Gene.objects.filter(name=gene).aexists():
+        return None
+
+    dataset_file = await models.DatasetFile.objects.filter(dataset_id=dataset.pk, type="singlecell_umifrac").afirst()
+    if dataset_file is None:
+        return None
+
+    try:
+        return await run_hdf5_read(dataset.pk, read_hdf5_expression, dataset_file.file.path, gene)
+    except OSError:
+        logger.exception("Error reading expression data for %s in %s", gene, dataset)
+        return None
+
+
+def offload_hdf5_reads(view):
+    """
+    Wrap a DRF view to prefetch the expression of the `gene` query parameter off the event loop.
+
+    The prefetched expression is available to the view as `request.expression`.
+    """
+    sync_view = sync_to_async(view)
+
+    async def async_view(request, *args, **kwargs):
+        dataset = request.GET.get("dataset")
+        gene = request.GET.get("gene")
+        if dataset and gene:
+            request.expression = await prefetch_expression(dataset, gene)
+        return await sync_view(request, *args, **kwargs)
+
+    return csrf_exempt(async_view)
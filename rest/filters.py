@@ -16,7 +16,7 @@ from django.db.models import (
     When,
     Window,
 )
-from django.db.models.functions import Cast, Greatest, Log, Rank
+from django.db.models.functions import Cast, FirstValue, Greatest, Log, Rank
 from django.forms import ChoiceField
 from django_filters.rest_framework import (
     BooleanFilter,
@@ -30,7 +30,7 @@ from django_filters.rest_framework import (
 from app import models
 
 from .aggregates import Median
-from .functions import ArrayPosition
+from .services import GeneSetResolver
 from .utils import check_model_exists, parse_species_dataset
 
 
@@ -260,10 +260,11 @@ class GeneFilter(QueryFilterSet):
         """Filter queryset by a list of gene names, domains, or gene lists."""
 
         if value:
-            genes = value.split(",")
-            queryset = queryset.filter(
-                Q(name__in=genes) | Q(domains__name__in=genes) | Q(genelists__name__in=genes)
-            ).distinct()
+            species = self.form.cleaned_data.get("species")
+            species = models.Species.objects.filter(scientific_name=species).first() if species else None
+            kinds = (GeneSetResolver.NAME, GeneSetResolver.DOMAIN, GeneSetResolver.GENE_LIST)
+            genes = GeneSetResolver(species, kinds=kinds).resolve(value.split(","))
+            queryset = queryset.filter(pk__any=genes)
         return queryset
 
     class Meta:
@@ -402,11 +403,18 @@ class GeneModuleSimilarityGenesFilter(GeneModuleSimilarityFilter):
 
 
 class SortAcrossMetacellFilter(BooleanFilter):
-    """Filter to sort a queryset across metacells based on a specified field."""
+    """
+    Filter to sort a queryset across metacells based on a specified field.
+
+    Groups (e.g. genes) are ordered by the metacell where they peak, i.e. where
+    `order_field` is highest, from the last to the first metacell. The peak is
+    computed with a window function in the same query, so the whole sort runs
+    in the database without building a list of IDs in Python.
+    """
 
     def __init__(self, field_name, order_field, partition_field=None, *args, **kwargs):
         self.sort_field = field_name
-        self.partition_field = partition_field or f"{field_name}__name"
+        self.partition_field = partition_field or field_name
         self.order_field = order_field
         super().__init__(*args, **kwargs)
 
@@ -414,21 +422,15 @@ class SortAcrossMetacellFilter(BooleanFilter):
         if not value:
             return queryset
 
-        sorted_field = (
-            queryset.annotate(
-                rank=Window(
-                    expression=Rank(),
-                    partition_by=self.partition_field,
-                    order_by=F(self.order_field).desc(),
-                )
-            )
-            .filter(rank=1)
-            .order_by(-Cast("metacell__name", IntegerField()))
-            .values_list(self.sort_field, flat=True)
+        metacell = Cast("metacell__name", IntegerField())
+        peak_metacell = Window(
+            expression=FirstValue(metacell),
+            partition_by=self.partition_field,
+            order_by=[F(self.order_field).desc(), metacell.desc()],
+        )
+        return queryset.annotate(peak_metacell=peak_metacell).order_by(
+            F("peak_metacell").desc(), self.sort_field, metacell
         )
-
-        sorted_field = list(sorted_field)
-        return queryset.order_by(ArrayPosition(self.sort_field, array=sorted_field))
 
 
 class GeneModuleEigengeneFilter(FilterSet):
@@ -547,6 +549,28 @@ class SingleCellFilter(FilterSet):
         fields = ["dataset"]
 
 
+class SingleCellBinFilter(FilterSet):
+    """Filter set for binned single-cell embeddings."""
+
+    dataset = DatasetChoiceFilter(required=True)
+    gene = CharFilter(
+        method=skip_param,
+        label="Retrieve mean expression per bin for a given <a href='#/operations/genes_list'>gene</a>.",
+    )
+    zoom = NumberFilter(method=skip_param, label="Zoom level: each level doubles the bins per axis (default: 0).")
+    resolution = NumberFilter(method=skip_param, label="Number of bins per axis at zoom level 0 (default: 128).")
+    xmin = NumberFilter(method=skip_param, label="Minimum X coordinate of the viewport.")
+    xmax = NumberFilter(method=skip_param, label="Maximum X coordinate of the viewport.")
+    ymin = NumberFilter(method=skip_param, label="Minimum Y coordinate of the viewport.")
+    ymax = NumberFilter(method=skip_param, label="Maximum Y coordinate of the viewport.")
+
+    class Meta:
+        """Configuration for model and filterable fields."""
+
+        model = models.SingleCell
+        fields = ["dataset"]
+
+
 class MetacellFilter(FilterSet):
     """Filter set for metacells."""
 
@@ -599,10 +623,10 @@ class SingleCellGeneExpressionFilter(FilterSet):
         """Filter queryset by gene names, domains or gene lists."""
 
         if value:
-            genes = value.split(",")
-            queryset = queryset.filter(
-                Q(gene__name__in=genes) | Q(gene__domains__name__in=genes) | Q(gene__genelists__name__in=genes)
-            ).distinct()
+            dataset = parse_species_dataset(self.form.cleaned_data["dataset"])
+            kinds = (GeneSetResolver.NAME, GeneSetResolver.DOMAIN, GeneSetResolver.GENE_LIST)
+            genes = GeneSetResolver(dataset.species, kinds=kinds).resolve_names(value.split(","))
+            queryset = queryset.filter(gene__any=genes)
         return queryset
 
     class Meta:
@@ -660,14 +684,9 @@ class MetacellGeneExpressionFilter(FilterSet):
         """Filter queryset by gene names, domains, gene lists and gene modules."""
 
         if value:
-            genes = value.split(",")
-
-            queryset = queryset.filter(
-                Q(gene__name__in=genes)
-                | Q(gene__domains__name__in=genes)
-                | Q(gene__genelists__name__in=genes)
-                | Q(gene__modules__module__name__in=genes)
-            ).distinct()
+            dataset = parse_species_dataset(self.form.cleaned_data["dataset"])
+            genes = GeneSetResolver(dataset.species).resolve(value.split(","))
+            queryset = queryset.filter(gene_id__any=genes)
         return queryset
 
     def filter_metacells(self, queryset, name, value):
@@ -681,10 +700,15 @@ class MetacellGeneExpressionFilter(FilterSet):
         return queryset
 
     def filter_markers(self, queryset, name, value):
-        """Filter data based on top genes."""
+        """
+        Filter data based on top genes.
+
+        The top genes of each metacell are ranked in a subquery of the same statement
+        and semi-joined by gene ID, so no list of genes is fetched in Python.
+        """
 
         if value:
-            top_genes = list(
+            top_genes = (
                 queryset.annotate(
                     rank=Window(
                         expression=Rank(),
@@ -693,10 +717,10 @@ class MetacellGeneExpressionFilter(FilterSet):
                     )
                 )
                 .filter(rank__lte=value)
-                .values_list("gene__name", flat=True)
+                .order_by()
+                .values("gene_id")
             )
-            top_genes = list(set(top_genes))  # get unique top genes
-            queryset = queryset.filter(gene__name__in=top_genes)
+            queryset = queryset.filter(gene_id__in=top_genes)
         return queryset
 
     def log2_transform(self, queryset, name, value):
@@ -731,6 +755,53 @@ class MetacellGeneExpressionFilter(FilterSet):
         fields = ["dataset"]
 
 
+class MetacellTypeGeneExpressionFilter(FilterSet):
+    """Filter set for gene expression per metacell type."""
+
+    dataset = DatasetChoiceFilter(required=True)
+    genes = CharFilter(
+        label=(
+            "Comma-separated list of [genes](#/operations/genes_list), "
+            "[gene lists](#/operations/gene_lists_list), "
+            "[gene modules](#/operations/modules_list), "
+            "[domains](#/operations/domains_list) to retrieve data for. "
+            "If not provided, data is returned for all genes."
+        ),
+        method="filter_genes",
+    )
+    metacell_types = CharFilter(
+        label="Comma-separated list of cell types.",
+        method="filter_metacell_types",
+    )
+    fc_min = NumberFilter(
+        label="Filter expression data by minimum of the maximum fold-change per cell type (default: `0`).",
+        field_name="fold_change_max",
+        lookup_expr="gte",
+    )
+
+    def filter_genes(self, queryset, name, value):
+        """Filter queryset by gene names, domains, gene lists and gene modules."""
+
+        if value:
+            dataset = parse_species_dataset(self.form.cleaned_data["dataset"])
+            genes = GeneSetResolver(dataset.species).resolve(value.split(","))
+            queryset = queryset.filter(gene_id__any=genes)
+        return queryset
+
+    def filter_metacell_types(self, queryset, name, value):
+        """Filter queryset by cell type names."""
+
+        if value:
+            queryset = queryset.filter(metacell_type__name__in=value.split(","))
+        return queryset
+
+    class Meta:
+        """Configuration for model and filterable fields."""
+
+        model = models.MetacellTypeGeneExpression
+        fields = ["dataset"]
+
+
 class CorrelatedGenesFilter(QueryFilterSet):
     """Filter set for correlated genes."""
 
@@ -779,6 +850,56 @@ class CorrelatedGenesFilter(QueryFilterSet):
         fields = ["dataset", "gene"]
 
 
+class MetacellTypeMarkerFilter(FilterSet):
+    """Filter set for precomputed markers of metacell types."""
+
+    dataset = DatasetChoiceFilter(required=True)
+    metacell_types = CharFilter(
+        label="Comma-separated list of cell types (default: all cell types).",
+        method="filter_metacell_types",
+    )
+    fc_min = NumberFilter(
+        label=(
+            "Filter genes by their minimum fold-change across the metacells of the cell type "
+            f"(default: <kbd>2</kbd>; markers are only stored for fold-changes ≥ "
+            f"<kbd>{models.MetacellTypeMarker.min_fold_change}</kbd>)."
+        ),
+        method=skip_param,
+    )
+    fc_min_type = ChoiceFilter(
+        choices=[
+            ["mean", "Keep and rank genes by their mean fold-change in the cell type ≥ <kbd>fc_min</kbd>"],
+            ["median", "Keep and rank genes by their median fold-change in the cell type ≥ <kbd>fc_min</kbd>"],
+        ],
+        label="Type of filtering to use for the minimum fold-change threshold (default: <kbd>mean</kbd>).",
+        method=skip_param,
+    )
+
+    def filter_metacell_types(self, queryset, name, value):
+        """Filter queryset by cell type names."""
+
+        if value:
+            queryset = queryset.filter(metacell_type__name__in=value.split(","))
+        return queryset
+
+    def filter_queryset(self, queryset):
+        """Filter and rank genes by mean (using the stored rank) or median fold-change."""
+        queryset = super().filter_queryset(queryset)
+
+        fc_min = self.form.cleaned_data.get("fc_min")
+        fc_min = 2 if fc_min is None else fc_min
+        if self.form.cleaned_data.get("fc_min_type") == "median":
+            queryset = queryset.filter(fg_median_fc__gte=fc_min)
+            return queryset.order_by("metacell_type__name", "-fg_median_fc", "gene_id")
+        return queryset.filter(fg_mean_fc__gte=fc_min).order_by("metacell_type__name", "rank")
+
+    class Meta:
+        """Configuration for model and filterable fields."""
+
+        model = models.MetacellTypeMarker
+        fields = ["dataset"]
+
+
 def create_fc_type_choice_filter(mode, ignore_mode=False):
     """
     Build a ChoiceFilter for fold-change filtering.
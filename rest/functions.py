@@ -1,4 +1,4 @@
-from django.db.models import CharField, Func, IntegerField
+from django.db.models import CharField, Field, ForeignObject, Func, IntegerField, Lookup
 
 
 class ArrayToString(Func):
@@ -56,3 +56,29 @@ class ArrayPosition(Func):
 class Correlation(Func):
     function = "CORR"
     template = "%(function)s(%(expressions)s)"
+
+
+@ForeignObject.register_lookup
+@Field.register_lookup
+class Any(Lookup):
+    """
+    Match any element of a Python list passed as a single array parameter.
+
+    Unlike `__in`, which expands to one placeholder per value, the list is sent
+    as one array, so the query text does not grow with the number of values.
+
+    Example:
+        # WHERE gene_id = ANY(%s)
+        MetacellGeneExpression.objects.filter(gene_id__any=[1, 2, 3])
+    """
+
+    lookup_name = "any"
+    prepare_rhs = False
+
+    def get_db_prep_lookup(self, value, connection):
+        return "%s", [list(value)]
+
+    def as_sql(self, compiler, connection):
+        lhs, lhs_params = self.process_lhs(compiler, connection)
+        rhs, rhs_params = self.process_rhs(compiler, connection)
+        return f"{lhs} = ANY({rhs})", (*lhs_params, *rhs_params)
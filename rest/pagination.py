@@ -12,3 +12,25 @@ class StandardPagination(LimitOffsetPagination):
         if request.query_params.get("limit") == "0":
             return None
         return super().get_limit(request)
+
+    def paginate_rows(self, fetch, request):
+        """
+        Paginate rows fetched along with their total count, e.g. by a raw SQL query with `count(*) OVER ()`.
+
+        Args:
+            fetch (callable): Function of `limit` and `offset` returning the rows of the page and the total count.
+            request (Request): Request with pagination parameters.
+
+        Returns:
+            list: Rows of the page, or None if pagination is disabled (as `paginate_queryset`).
+        """
+        self.request = request
+        self.limit = self.get_limit(request)
+        if self.limit is None:
+            return None
+
+        self.offset = self.get_offset(request)
+        rows, self.count = fetch(self.limit, self.offset)
+        if self.count > self.limit and self.template is not None:
+            self.display_page_controls = True
+        return rows
@@ -1,6 +1,11 @@
 import csv
+import struct
 from io import StringIO
+from typing import NamedTuple
 
+import numpy as np
+import orjson
+from drf_orjson_renderer.renderers import ORJSONRenderer
 from rest_framework.renderers import BaseRenderer
 
 
@@ -68,3 +73,94 @@ class TSVRenderer(CSVRenderer):
     media_type = "text/tab-separated-values"
     format = "tsv"
     quoting = csv.QUOTE_NONE
+
+
+class DictionaryColumn(NamedTuple):
+    """Dictionary-encoded column: integer codes indexing a list of values (-1 for null)."""
+
+    codes: np.ndarray
+    dictionary: list
+
+
+def dictionary_encode(values) -> DictionaryColumn:
+    """Dictionary-encode a sequence of hashable values (None is encoded as -1).
+
+    Codes are int16 if the dictionary is small enough, int32 otherwise.
+    """
+    lookup = {}
+    codes = np.fromiter(
+        (-1 if v is None else lookup.setdefault(v, len(lookup)) for v in values),
+        dtype=np.int32,
+        count=len(values),
+    )
+    if len(lookup) <= np.iinfo(np.int16).max:
+        codes = codes.astype(np.int16)
+    return DictionaryColumn(codes, list(lookup))
+
+
+class ColumnarRenderer(BaseRenderer):
+    """Render columns as typed little-endian arrays after a JSON header.
+
+    Expects a dictionary with the total ``count`` and ``columns``, mapping
+    column names to NumPy arrays (numeric or strings) or DictionaryColumn.
+
+    Binary layout:
+
+    * uint32: length of the JSON header in bytes
+    * JSON header: ``{"count": ..., "length": ..., "columns": [...]}``, padded
+      with spaces so the body starts at a multiple of 8 bytes
+    * body: column buffers, each starting at a multiple of 8 bytes
+
+    Each header column lists its ``name``, ``type`` (NumPy dtype name,
+    ``utf8`` or ``dictionary``) and ``buffers`` (``offset`` and ``length`` in
+    bytes, relative to the body). String columns have two buffers (uint32
+    offsets and UTF-8 data) and dictionary columns have one buffer of codes
+    with the ``dictionary`` values in the header. Missing floats are NaN.
+    """
+
+    media_type = "application/vnd.bca.columnar"
+    format = "columnar"
+    charset = None
+    render_style = "binary"
+    alignment = 8
+
+    def encode(self, name, column):
+        """Return the header entry and the buffers of a column."""
+        if isinstance(column, DictionaryColumn):
+            codes = column.codes.astype(column.codes.dtype.newbyteorder("<"), copy=False)
+            header = {"name": name, "type": "dictionary", "index_type": codes.dtype.name}
+            header["dictionary"] = column.dictionary
+            return header, [codes.tobytes()]
+
+        column = np.asarray(column)
+        if column.dtype.kind in "OUS":
+            data = [str(v).encode() for v in column.tolist()]
+            offsets = np.zeros(len(data) + 1, dtype="<u4")
+            np.cumsum([len(v) for v in data], out=offsets[1:])
+            return {"name": name, "type": "utf8"}, [offsets.tobytes(), b"".join(data)]
+
+        column = column.astype(column.dtype.newbyteorder("<"), copy=False)
+        return {"name": name, "type": column.dtype.name}, [column.tobytes()]
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        # Errors and other non-columnar responses are rendered as JSON
+        if not isinstance(data, dict) or "columns" not in data:
+            return ORJSONRenderer().render(data, accepted_media_type, renderer_context)
+
+        first = next(iter(data["columns"].values()), [])
+        length = len(first.codes if isinstance(first, DictionaryColumn) else first)
+
+        body = bytearray()
+        header = {"count": data.get("count", length), "length": length, "columns": []}
+        for name, column in data["columns"].items():
+            entry, buffers = self.encode(name, column)
+            entry["buffers"] = []
+            for buffer in buffers:
+                body.extend(b"\0" * (-len(body) % self.alignment))
+                entry["buffers"].append({"offset": len(body), "length": len(buffer)})
+                body.extend(buffer)
+            header["columns"].append(entry)
+
+        header = orjson.dumps(header, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS)
+        header += b" " * (-(len(header) + 4) % self.alignment)
+        return struct.pack("<I", len(header)) + header + bytes(body)
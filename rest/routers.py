@@ -27,12 +27,21 @@ router.register("expression_conservation", views.ExpressionConservationViewSet,
 router.register("metacells", views.MetacellViewSet)
 router.register("metacell_links", views.MetacellLinkViewSet, basename="metacelllink")
 router.register("metacell_expression", views.MetacellGeneExpressionViewSet)
+router.register("metacell_type_expression", views.MetacellTypeGeneExpressionViewSet)
 router.register("markers", views.MetacellMarkerViewSet, basename="metacellmarker")
+router.register("cell_type_markers", views.MetacellTypeMarkerViewSet)
 router.register("metacell_counts", views.MetacellCountViewSet, basename="metacellcount")
 router.register("metacell_type_similarity", views.MetacellTypeSimilarityViewSet)
 
 router.register("single_cells", views.SingleCellViewSet)
+router.register("single_cell_bins", views.SingleCellBinViewSet, basename="singlecellbin")
 router.register("single_cell_expression", views.SingleCellGeneExpressionViewSet)
+router.register(
+    "single_cell_expression_matrix",
+    views.SingleCellGeneExpressionMatrixViewSet,
+    basename="singlecellexpressionmatrix",
+)
+router.register("single_cell_dot_plot", views.SingleCellDotPlotViewSet, basename="singlecelldotplot")
 
 router.register("align", views.AlignViewSet, basename="align")
 router.register("enrichment", views.EnrichmentAnalysisViewSet, basename="enrichment")
@@ -4,8 +4,9 @@ REST API serializers.
 
 from operator import attrgetter
 
+import numpy as np
 from django.conf import settings
-from django.db.models import Avg, Max, Min, StdDev, Sum
+from django.db.models import Avg, Manager, Max, Min, StdDev, Sum
 from drf_spectacular.utils import extend_schema_field, extend_schema_serializer, OpenApiExample
 
 from rest_framework import serializers
@@ -495,6 +496,23 @@ class BaseExpressionSerializer(serializers.ModelSerializer):
         return self.get_expression_value(obj, "fold_change")
 
 
+class SingleCellListSerializer(serializers.ListSerializer):
+    """List serializer that aligns single-cell expression to all cells at once."""
+
+    def to_representation(self, data):
+        """Annotate each cell with its UMI fraction before serializing."""
+        cells = list(data.all() if isinstance(data, Manager) else data)
+
+        expression = self.context.get("expression")
+        if expression is not None:
+            umifrac = expression.get_umifrac([cell.name for cell in cells])
+            values = umifrac.astype(object)
+            values[np.isnan(umifrac)] = None
+            for cell, value in zip(cells, values.tolist()):
+                cell.umifrac = value
+        return super().to_representation(cells)
+
+
 class SingleCellSerializer(BaseExpressionSerializer):
     """Single cell serializer."""
 
@@ -509,6 +527,7 @@ class SingleCellSerializer(BaseExpressionSerializer):
         """Meta configuration."""
 
         model = models.SingleCell
+        list_serializer_class = SingleCellListSerializer
         fields = [
             "name",
             "x",
@@ -540,10 +559,31 @@ class SingleCellSerializer(BaseExpressionSerializer):
         }
 
     def get_umifrac(self, obj):
-        """Return UMI fraction."""
-        cell_name = obj.name
-        expression_dictionary = self.context["expression_dictionary"]
-        return expression_dictionary.get(cell_name, None)
+        """Return UMI fraction (annotated by SingleCellListSerializer)."""
+        if hasattr(obj, "umifrac"):
+            return obj.umifrac
+
+        expression = self.context.get("expression")
+        if expression is None:
+            return None
+        value = expression.get_umifrac([obj.name])[0]
+        return None if np.isnan(value) else float(value)
+
+
+class SingleCellBinSerializer(serializers.Serializer):
+    """Binned single-cell embedding serializer."""
+
+    x = serializers.FloatField(help_text="X coordinate of the bin centre.")
+    y = serializers.FloatField(help_text="Y coordinate of the bin centre.")
+    width = serializers.FloatField(help_text="Bin width.")
+    height = serializers.FloatField(help_text="Bin height.")
+    count = serializers.IntegerField(help_text="Number of single cells in the bin.")
+    metacell_type = serializers.CharField(allow_null=True, help_text="Most frequent cell type in the bin.")
+    metacell_color = serializers.CharField(allow_null=True, help_text="Color associated with the cell type.")
+    gene_name = serializers.CharField(allow_null=True, help_text="Name of the queried gene.")
+    umifrac = serializers.FloatField(
+        allow_null=True, help_text="Mean UMI fraction of the queried gene across single cells in the bin."
+    )
 
 
 class MetacellSerializer(BaseExpressionSerializer):
@@ -648,6 +688,33 @@ class SingleCellGeneExpressionSerializer(serializers.ModelSerializer):
         exclude = ["id", "dataset"]
 
 
+class SingleCellGeneExpressionMatrixSerializer(serializers.Serializer):
+    """Serializer for a sparse single cells x genes expression block (COO format)."""
+
+    dataset = serializers.CharField(help_text="Dataset slug.")
+    genes = serializers.ListField(child=serializers.CharField(), help_text="Gene names (columns).")
+    cells = serializers.ListField(
+        child=serializers.CharField(), help_text="Names of single cells expressing any of the genes (rows)."
+    )
+    row = serializers.ListField(child=serializers.IntegerField(), help_text="Row index of each value in `cells`.")
+    col = serializers.ListField(child=serializers.IntegerField(), help_text="Column index of each value in `genes`.")
+    umifrac = serializers.ListField(
+        child=serializers.FloatField(), help_text="Gene expression values (UMI fraction)."
+    )
+
+
+class SingleCellDotPlotSerializer(serializers.Serializer):
+    """Serializer for single-cell expression statistics per group of cells (dot plot)."""
+
+    gene = serializers.CharField(help_text="Gene name.")
+    group = serializers.CharField(help_text="Metacell or cell type name.")
+    metacell_type = serializers.CharField(allow_null=True, help_text="Cell type.")
+    metacell_color = serializers.CharField(allow_null=True, help_text="Color associated with cell type.")
+    cells = serializers.IntegerField(help_text="Number of single cells in the group.")
+    fraction = serializers.FloatField(help_text="Fraction of single cells expressing the gene.")
+    umifrac = serializers.FloatField(help_text="Mean UMI fraction across single cells in the group.")
+
+
 class MetacellGeneExpressionSerializer(serializers.ModelSerializer):
     """Serializer for gene expression for each metacell."""
 
@@ -684,6 +751,37 @@ class DatasetMetacellGeneExpressionSerializer(MetacellGeneExpressionSerializer):
         exclude = ["id", "gene", "metacell"]
 
 
+class MetacellTypeGeneExpressionSerializer(serializers.ModelSerializer):
+    """Serializer for gene expression aggregated per metacell type."""
+
+    gene_name = serializers.CharField(source="gene.name")
+    gene_description = serializers.CharField(source="gene.description")
+    metacell_type = serializers.CharField(source="metacell_type.name")
+    metacell_color = serializers.CharField(source="metacell_type.color")
+
+    class Meta:
+        """Meta configuration."""
+
+        model = models.MetacellTypeGeneExpression
+        exclude = ["dataset", "id", "gene"]
+
+
+class MetacellTypeMarkerSerializer(serializers.ModelSerializer):
+    """Serializer for precomputed markers of metacell types."""
+
+    gene_name = serializers.CharField(source="gene.name")
+    gene_description = serializers.CharField(source="gene.description")
+    gene_domains = serializers.StringRelatedField(source="gene.domains", many=True)
+    metacell_type = serializers.CharField(source="metacell_type.name")
+    metacell_color = serializers.CharField(source="metacell_type.color")
+
+    class Meta:
+        """Meta configuration."""
+
+        model = models.MetacellTypeMarker
+        exclude = ["dataset", "id", "gene"]
+
+
 class CorrelatedGenesSerializer(serializers.ModelSerializer):
     """Serializer for correlated genes."""
 
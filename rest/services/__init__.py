@@ -2,3 +2,18 @@
 
 from .module_similarity import GeneModuleSimilarityService
 from .go_enrichment import GeneOntologyEnrichmentService
+from .embedding_bins import EmbeddingBinningService
+from .dot_plot import SingleCellDotPlotService
+from .metacell_expression import MetacellExpressionService
+from .markers import MetacellMarkerService
+from .gene_sets import GeneSetResolver
+
+__all__ = [
+    "EmbeddingBinningService",
+    "GeneModuleSimilarityService",
+    "GeneOntologyEnrichmentService",
+    "GeneSetResolver",
+    "MetacellExpressionService",
+    "MetacellMarkerService",
+    "SingleCellDotPlotService",
+]
@@ -0,0 +1,124 @@
+"""Aggregate single-cell gene expression for dot plots."""
+
+import os
+
+import numpy as np
+from django.shortcuts import get_object_or_404
+
+from app import models
+from app.utils import align_names, get_cell_names, read_hdf5_coo
+from app.utils.cache import get_db_version, get_validated_cache, set_validated_cache
+
+
+class SingleCellDotPlotService:
+    """
+    Compute dot plot statistics of genes per metacell or cell type from single-cell HDF5 data.
+
+    For each gene and group of single cells, reports the fraction of cells expressing the gene
+    and the mean UMI fraction across all cells of the group (non-expressing cells count as zero).
+
+    The index mapping HDF5 cells to metacells is derived from `SingleCell.metacell_id` and cached
+    per dataset, invalidated when the database version or the HDF5 expression file change.
+    """
+
+    group_choices = {"metacell": "Metacell", "type": "Cell type"}
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.hdf5_file = get_object_or_404(models.DatasetFile, dataset=dataset, type="singlecell_umifrac")
+        self.path = self.hdf5_file.file.path
+        self.validation = (get_db_version(), os.path.getmtime(self.path))
+
+    def _build_index(self):
+        cells = models.SingleCell.objects.filter(dataset=self.dataset).order_by("pk")
+        cells = list(cells.values_list("name", "metacell_id"))
+        names, metacell_ids = zip(*cells) if cells else [()] * 2
+
+        types = models.MetacellType.objects.filter(dataset=self.dataset).order_by("pk")
+        types = {pk: (name, color) for pk, name, color in types.values_list("pk", "name", "color")}
+        type_index = {pk: code for code, pk in enumerate(types)}
+
+        metacells = models.Metacell.objects.filter(dataset=self.dataset).order_by("pk")
+        metacells = {pk: (name, type_id) for pk, name, type_id in metacells.values_list("pk", "name", "type_id")}
+        metacell_index = {pk: code for code, pk in enumerate(metacells)}
+
+        # Metacell code of each database cell, then of each HDF5 cell (-1 if unassigned or missing)
+        cell_metacell = np.array([metacell_index.get(pk, -1) for pk in metacell_ids], dtype=np.int32)
+        rows = align_names(names, get_cell_names(self.path))
+        hdf5_metacell = np.append(cell_metacell, -1)[rows].astype(np.int32)
+
+        return {
+            "hdf5_metacell": hdf5_metacell,
+            "metacell_cells": np.bincount(cell_metacell[cell_metacell >= 0], minlength=len(metacells)),
+            "metacells": [name for name, _ in metacells.values()],
+            "metacell_type": np.array([type_index.get(t, -1) for _, t in metacells.values()], dtype=np.int32),
+            "types": list(types.values()),
+        }
+
+    def get_index(self):
+        """Return the cached index of HDF5 cells to metacells, with metacell and cell type information."""
+        key = f"dot_plot_index:{self.dataset.pk}"
+        index = get_validated_cache(key, self.validation)
+        if index is None:
+            index = self._build_index()
+            set_validated_cache(key, self.validation, index)
+        return index
+
+    def aggregate(self, genes, group_by="metacell"):
+        """
+        Aggregate single-cell expression of genes per metacell or cell type.
+
+        Args:
+            genes (list): Gene names.
+            group_by (str): Either "metacell" or "type".
+
+        Returns:
+            list: Dictionaries with gene, group, cell type, color, number of cells, fraction of cells
+                  expressing the gene and mean UMI fraction (for groups with cells).
+        """
+        index = self.get_index()
+        cell_group = index["hdf5_metacell"]
+        group_cells = index["metacell_cells"]
+        metacell_type = index["metacell_type"]
+
+        if group_by == "type":
+            # Re-map metacells to cell types
+            n_types = len(index["types"])
+            cell_group = np.append(metacell_type, -1)[cell_group]
+            valid = metacell_type >= 0
+            group_cells = np.bincount(metacell_type[valid], weights=group_cells[valid], minlength=n_types)
+            groups = [(name, name, color) for name, color in index["types"]]
+        else:
+            types = index["types"]
+            groups = [
+                (name, *(types[t] if t >= 0 else (None, None))) for name, t in zip(index["metacells"], metacell_type)
+            ]
+
+        positions, gene_codes, values = read_hdf5_coo(self.path, genes)
+        group_codes = cell_group[positions]
+        expressed = group_codes >= 0
+
+        n_groups = len(groups)
+        keys = gene_codes[expressed].astype(np.int64) * n_groups + group_codes[expressed]
+        size = len(genes) * n_groups
+        counts = np.bincount(keys, minlength=size).reshape(len(genes), n_groups)
+        sums = np.bincount(keys, weights=values[expressed], minlength=size).reshape(len(genes), n_groups)
+
+        results = []
+        for g, gene in enumerate(genes):
+            for i, (group, type_name, color) in enumerate(groups):
+                n_cells = int(group_cells[i])
+                if n_cells == 0:
+                    continue
+                results.append(
+                    {
+                        "gene": gene,
+                        "group": group,
+                        "metacell_type": type_name,
+                        "metacell_color": color,
+                        "cells": n_cells,
+                        "fraction": float(counts[g, i] / n_cells),
+                        "umifrac": float(sums[g, i] / n_cells),
+                    }
+                )
+        return results
@@ -0,0 +1,171 @@
+"""Bin single-cell embeddings at different levels of detail."""
+
+import os
+
+import numpy as np
+
+from app import models
+from app.utils import align_names, get_cell_names, read_hdf5_columns
+from app.utils.cache import get_db_version, get_validated_cache, set_validated_cache
+
+
+class EmbeddingBinningService:
+    """
+    Aggregate the single-cell embedding of a dataset in grids of bins.
+
+    At zoom level ``z``, the embedding extent is split in ``resolution * 2**z``
+    bins per axis. Each non-empty bin reports its number of cells, the dominant
+    cell type and, optionally, the mean UMI fraction of a gene (cells not
+    expressing the gene count as zero).
+
+    The embedding and the grid of each zoom level are cached per dataset and
+    invalidated when the database version or the HDF5 expression file change.
+    """
+
+    DEFAULT_RESOLUTION = 128
+    MAX_RESOLUTION = 512
+    MAX_ZOOM = 8
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.hdf5_file = (
+            models.DatasetFile.objects.filter(dataset=dataset, type="singlecell_umifrac").only("file").first()
+        )
+
+        mtime = None
+        if self.hdf5_file is not None and os.path.exists(self.hdf5_file.file.path):
+            mtime = os.path.getmtime(self.hdf5_file.file.path)
+        self.validation = (get_db_version(), mtime)
+        self._embedding = None
+
+    def _cached(self, key, build):
+        key = f"embedding_bins:{self.dataset.pk}:{key}"
+        data = get_validated_cache(key, self.validation)
+        if data is None:
+            data = build()
+            set_validated_cache(key, self.validation, data)
+        return data
+
+    def _build_embedding(self):
+        cells = models.SingleCell.objects.filter(dataset=self.dataset, x__isnull=False, y__isnull=False)
+        cells = list(cells.order_by("pk").values_list("name", "x", "y", "metacell__type_id"))
+        names, x, y, type_ids = zip(*cells) if cells else [()] * 4
+
+        types = models.MetacellType.objects.filter(dataset=self.dataset).order_by("pk")
+        types = {pk: (name, color) for pk, name, color in types.values_list("pk", "name", "color")}
+        type_index = {pk: code for code, pk in enumerate(types)}
+
+        # Map HDF5 cell positions to embedding rows (-1 if missing)
+        hdf5_rows = np.empty(0, dtype=np.int64)
+        if self.validation[1] is not None:
+            hdf5_rows = align_names(names, get_cell_names(self.hdf5_file.file.path))
+
+        return {
+            "x": np.array(x, dtype=np.float32),
+            "y": np.array(y, dtype=np.float32),
+            "type": np.array([type_index.get(pk, -1) for pk in type_ids], dtype=np.int32),
+            "types": list(types.values()),
+            "hdf5_rows": hdf5_rows,
+        }
+
+    def get_embedding(self):
+        """Return the cached embedding coordinates, cell type codes and HDF5 row mapping."""
+        if self._embedding is None:
+            self._embedding = self._cached("embedding", self._build_embedding)
+        return self._embedding
+
+    def _build_grid(self, embedding, zoom, resolution):
+        x, y = embedding["x"], embedding["y"]
+        n = resolution * 2**zoom
+        extent = (
+            (float(x.min()), float(x.max()), float(y.min()), float(y.max())) if x.size else (0.0, 1.0, 0.0, 1.0)
+        )
+        width = (extent[1] - extent[0]) / n or 1.0
+        height = (extent[3] - extent[2]) / n or 1.0
+
+        ix = np.minimum(((x - extent[0]) / width).astype(np.int64), n - 1)
+        iy = np.minimum(((y - extent[2]) / height).astype(np.int64), n - 1)
+        bins, cell_bin = np.unique(ix * n + iy, return_inverse=True)
+        counts = np.bincount(cell_bin, minlength=bins.size)
+
+        # Dominant cell type: most frequent (bin, type) pair per bin
+        n_types = len(embedding["types"]) + 1
+        pairs, pair_counts = np.unique(cell_bin * n_types + embedding["type"] + 1, return_counts=True)
+        order = np.lexsort((-pair_counts, pairs // n_types))
+        pairs = pairs[order]
+        first = np.diff(pairs // n_types, prepend=-1) != 0
+        dominant = (pairs[first] % n_types - 1).astype(np.int32)
+
+        return {
+            "n": n,
+            "extent": extent,
+            "width": width,
+            "height": height,
+            "bins": bins,
+            "counts": counts,
+            "dominant": dominant,
+            "cell_bin": cell_bin.astype(np.int32),
+        }
+
+    def get_grid(self, zoom, resolution):
+        """Return the cached grid of non-empty bins for a zoom level and resolution."""
+        return self._cached(
+            f"grid:{zoom}:{resolution}", lambda: self._build_grid(self.get_embedding(), zoom, resolution)
+        )
+
+    def get_mean_expression(self, grid, gene):
+        """Return the mean UMI fraction of a gene per bin of a grid."""
+        if self.validation[1] is None:
+            return np.zeros(grid["bins"].size)
+        positions, values = read_hdf5_columns(self.hdf5_file.file.path, gene)
+        rows = self.get_embedding()["hdf5_rows"][positions]
+        expressed = rows >= 0
+        sums = np.bincount(
+            grid["cell_bin"][rows[expressed]], weights=values[expressed], minlength=grid["bins"].size
+        )
+        return sums / grid["counts"]
+
+    def bin(self, zoom=0, resolution=DEFAULT_RESOLUTION, viewport=None, gene=None):
+        """
+        Bin the embedding at a given zoom level.
+
+        Args:
+            zoom (int): Zoom level (0 to MAX_ZOOM).
+            resolution (int): Number of bins per axis at zoom level 0.
+            viewport (tuple, optional): (xmin, xmax, ymin, ymax) to return only overlapping bins.
+            gene (str, optional): Gene name to compute its mean UMI fraction per bin.
+
+        Returns:
+            list: Dictionaries with bin centre and size, cell count, dominant type and mean UMI fraction.
+        """
+        grid = self.get_grid(zoom, resolution)
+        ix, iy = np.divmod(grid["bins"], grid["n"])
+        x0 = grid["extent"][0] + ix * grid["width"]
+        y0 = grid["extent"][2] + iy * grid["height"]
+
+        mask = np.ones(grid["bins"].size, dtype=bool)
+        if viewport is not None:
+            xmin, xmax, ymin, ymax = viewport
+            mask = (x0 + grid["width"] >= xmin) & (x0 <= xmax) & (y0 + grid["height"] >= ymin) & (y0 <= ymax)
+
+        umifrac = self.get_mean_expression(grid, gene) if gene is not None else None
+
+        types = self.get_embedding()["types"]
+        results = []
+        for i in np.flatnonzero(mask).tolist():
+            dominant = grid["dominant"][i]
+            name, color = types[dominant] if dominant >= 0 else (None, None)
+            results.append(
+                {
+                    "x": float(x0[i] + grid["width"] / 2),
+                    "y": float(y0[i] + grid["height"] / 2),
+                    "width": grid["width"],
+                    "height": grid["height"],
+                    "count": int(grid["counts"][i]),
+                    "metacell_type": name,
+                    "metacell_color": color,
+                    "gene_name": gene,
+                    "umifrac": None if umifrac is None else float(umifrac[i]),
+                }
+            )
+        return results
@@ -1,8 +1,11 @@
 """GO enrichment analysis."""
 
 import gzip
+import os
 import random
 import math
+import threading
+from collections import OrderedDict
 from sklearn.manifold import MDS
 
 from goatools.obo_parser import GODag
@@ -13,6 +16,84 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Parsed GO DAGs per (OBO path, modification time, load_obsolete); see `load_godag`
+_godags = {}
+_godags_lock = threading.Lock()
+
+# (file version, gene-to-GO annotations) per eggNOG-mapper file path, least recently used first; see `load_gene2go`
+_gene2gos = OrderedDict()
+_GENE2GOS_MAX_SIZE = 8
+_gene2gos_lock = threading.Lock()
+
+
+def load_godag(obo_path, load_obsolete=False):
+    """
+    Return the GO DAG parsed from an OBO file, cached for the lifetime of the process.
+
+    Parsing the full ontology takes seconds and over 100MB, so each worker keeps one `GODag` per
+    file and `load_obsolete` flag. A file modified since (e.g. an updated `GlobalFile`) is parsed
+    again and replaces the previous DAG. The DAG is shared between requests and must not be modified.
+    """
+    obo_path = str(obo_path)
+    key = (obo_path, os.path.getmtime(obo_path), load_obsolete)
+    with _godags_lock:
+        godag = _godags.get(key)
+        if godag is None:
+            for previous in [k for k in _godags if k[0] == obo_path and k[2] == load_obsolete]:
+                del _godags[previous]
+            godag = _godags[key] = GODag(obo_path, load_obsolete=load_obsolete, prt=None)
+    return godag
+
+
+def read_emapper(path):
+    """Read the GO terms of each gene from an eggNOG-mapper output file (gzipped)."""
+    gene2go = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("#") or not line.strip():
+                continue
+
+            # Only split up to the GOs column (10th of 21) and ignore the rest of the line
+            fields = line.rstrip("\n").split("\t", 10)
+            if len(fields) <= 10:
+                raise ValueError(f"Expected at least 11 tab-separated columns in {path}, got {len(fields)}: {line!r}")
+            gene2go[fields[0]] = frozenset(fields[9].split(","))
+    return gene2go
+
+
+def load_gene2go(annotation_path, checksum=None):
+    """
+    Return the GO terms of each gene of an eggNOG-mapper file, cached in the process.
+
+    The annotations of a species are read once per worker and read again only when the file
+    changes, as identified by its checksum (`SpeciesFile.checksum`) or else its modification time.
+    Only the `_GENE2GOS_MAX_SIZE` most recently used files are kept, to bound the memory of workers
+    serving many species. GO terms are frozensets shared between requests.
+    """
+    annotation_path = str(annotation_path)
+    version = checksum or os.path.getmtime(annotation_path)
+    with _gene2gos_lock:
+        cached = _gene2gos.get(annotation_path)
+        if cached is None or cached[0] != version:
+            cached = _gene2gos[annotation_path] = (version, read_emapper(annotation_path))
+        _gene2gos.move_to_end(annotation_path)
+        while len(_gene2gos) > _GENE2GOS_MAX_SIZE:
+            _gene2gos.popitem(last=False)
+    return cached[1]
+
+
+def warm_godag_cache():
+    """Parse the GO DAG of the `go-basic-obo` global file (without obsolete terms), if any."""
+    from app.models import GlobalFile
+
+    try:
+        go_obo = GlobalFile.objects.filter(type="go-basic-obo").first()
+        if go_obo is not None:
+            load_godag(go_obo.file.path)
+    except Exception:
+        # Do not prevent the server from starting (e.g. database not migrated yet)
+        logger.exception("Could not warm the GO DAG cache")
+
 
 class GeneOntologyEnrichmentService:
     """Analyze GO enrichment."""
@@ -27,10 +108,12 @@ class GeneOntologyEnrichmentService:
         qvalue=0.05,
         methods=["bonferroni"],
         load_obsolete=False,
+        annotation_checksum=None,
     ):
         """Load input files (allows to run GO enrichment analysis multiple times)."""
-        self.obodag = GODag(obo_path, load_obsolete=load_obsolete, prt=None)
-        gene2go = self.read_emapper(annotation_path)
+        self.obodag = load_godag(obo_path, load_obsolete=load_obsolete)
+        # GOATOOLS adds ancestor terms to the annotation sets in place, so copy the cached ones
+        gene2go = {gene: set(gos) for gene, gos in load_gene2go(annotation_path, annotation_checksum).items()}
 
         if background_genes is None:
             background_genes = gene2go.keys()
@@ -65,40 +148,6 @@ class GeneOntologyEnrichmentService:
             results = sorted(results, key=lambda x: x.get_pvalue())
         return results
 
-    def read_emapper(self, f):
-        """Read eggnog-mapper output."""
-        gene2go = {}
-        with gzip.open(f, "rt", encoding="utf-8") as f:
-            for line in f:
-                if line.startswith("#"):
-                    continue
-
-                (
-                    gene,
-                    seed_ortholog,
-                    evalue,
-                    score,
-                    eggnog_ogs,
-                    max_annot_lvl,
-                    cog_category,
-                    description,
-                    name,
-                    gos,
-                    ec,
-                    kegg_ko,
-                    kegg_pathway,
-                    kegg_module,
-                    kegg_reaction,
-                    kegg_rclass,
-                    kegg_brite,
-                    kegg_tc,
-                    cazy,
-                    bigg_reaction,
-                    pfams,
-                ) = line.rstrip().split("\t")
-                gene2go[gene] = set(gos.split(","))
-        return gene2go
-
     def calculate_semantic_similarity_coords(self, results, semantic_dict):
         """Calculate semantic similarity coordinates using MDS."""
         n = len(results)
@@ -0,0 +1,185 @@
+"""Compute cell type markers from the dense expression store with NumPy."""
+
+import warnings
+
+import numpy as np
+from django.db import transaction
+from django.db.models import Q
+
+from app import models
+from app.utils.expression_store import MetacellExpressionStore
+
+
+class MetacellMarkerService:
+    """
+    Compute gene markers of a set of metacells from the memory-mapped expression store of a dataset.
+
+    NumPy alternative to the SQL query of `MetacellMarkerViewSet`: the genes x metacells matrices
+    are split into foreground (selected) and background metacell columns and reduced per gene into
+    the same statistics (sum of UMIs, mean and median fold-change, ignoring missing values).
+    Genes are processed in chunks to bound the memory used by the copied column subsets.
+    Background sums and means are derived from totals over all metacells (see `_stats`).
+
+    The markers of all metacell types of a dataset are also computed in a single read of the
+    store and saved as `MetacellTypeMarker` rows (`refresh_cell_type_markers`).
+    """
+
+    backend_choices = {
+        "sql": "Aggregate expression rows in PostgreSQL",
+        "numpy": "Reduce the memory-mapped expression store with NumPy (falls back to `sql` if not built)",
+    }
+    fields = ("bg_sum_umi", "fg_sum_umi", "umi_perc", "fg_mean_fc", "bg_mean_fc", "fg_median_fc", "bg_median_fc")
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        self.store = MetacellExpressionStore(dataset)
+
+    def is_available(self):
+        """Return whether the store is built for the current database version."""
+        return self.store.exists()
+
+    def get_metacell_ids(self, names):
+        """Return sorted primary keys of metacells matching names or cell types."""
+        queryset = models.Metacell.objects.filter(dataset=self.dataset)
+        queryset = queryset.filter(Q(name__in=names) | Q(type__name__in=names))
+        return list(queryset.order_by("pk").values_list("pk", flat=True))
+
+    @staticmethod
+    def _totals(umi_raw, fold_change):
+        """Return the sum and number of non-NaN UMIs and fold-changes per gene."""
+        return (
+            np.nansum(umi_raw, axis=1),
+            np.count_nonzero(~np.isnan(umi_raw), axis=1),
+            np.nansum(fold_change, axis=1),
+            np.count_nonzero(~np.isnan(fold_change), axis=1),
+        )
+
+    @staticmethod
+    def _median(fold_change):
+        """Return the median fold-change per gene, ignoring NaN (NaN if all NaN)."""
+        with warnings.catch_warnings():
+            # Genes without values (or no metacells) in the subset
+            warnings.simplefilter("ignore", RuntimeWarning)
+            return np.nanmedian(fold_change, axis=1)
+
+    def _stats(self, arrays, masks, chunk_size):
+        """
+        Return the statistics per gene of each foreground mask of metacells, reading the store once.
+
+        Sums and means are reduced over the foreground columns only: background values are the
+        totals over all metacells minus the foreground ones, so all metacell types of a dataset
+        are reduced in about one pass. Medians cannot be derived this way, and background medians
+        still copy and partition the background columns of each mask (the main cost with many masks).
+        """
+        n_genes = arrays["genes"].size
+        subsets = [(np.flatnonzero(mask), np.flatnonzero(~mask)) for mask in masks]
+        stats = [{field: np.full(n_genes, np.nan) for field in self.fields} for _ in masks]
+
+        for start in range(0, n_genes, chunk_size):
+            rows = slice(start, start + chunk_size)
+            umi_raw = arrays["umi_raw"][rows].astype(np.float64)
+            fold_change = arrays["fold_change"][rows].astype(np.float64)
+            totals = self._totals(umi_raw, fold_change)
+            for (fg, bg), group_stats in zip(subsets, stats):
+                fg_totals = self._totals(umi_raw[:, fg], fold_change[:, fg])
+                bg_totals = tuple(total - fg_total for total, fg_total in zip(totals, fg_totals))
+                for prefix, (sum_umi, n_umi, sum_fc, n_fc) in (("fg", fg_totals), ("bg", bg_totals)):
+                    group_stats[f"{prefix}_sum_umi"][rows] = np.where(n_umi == 0, np.nan, sum_umi)
+                    with np.errstate(divide="ignore", invalid="ignore"):
+                        group_stats[f"{prefix}_mean_fc"][rows] = np.where(n_fc == 0, np.nan, sum_fc / n_fc)
+                group_stats["fg_median_fc"][rows] = self._median(fold_change[:, fg])
+                group_stats["bg_median_fc"][rows] = self._median(fold_change[:, bg])
+
+        for group_stats in stats:
+            total = group_stats["fg_sum_umi"] + group_stats["bg_sum_umi"]
+            with np.errstate(divide="ignore", invalid="ignore"):
+                group_stats["umi_perc"] = np.where(total == 0, np.nan, group_stats["fg_sum_umi"] / total * 100)
+        return stats
+
+    def _rows(self, genes, stats, keep, order_by):
+        """Return (gene ID, *statistics) tuples of the kept genes, by descending `order_by` statistic and gene ID."""
+        keep = np.flatnonzero(keep)
+        order = keep[np.lexsort((genes[keep], -stats[order_by][keep]))]
+
+        # NaN (no values) becomes None, as NULL in the SQL query
+        columns = [[None if np.isnan(v) else v for v in stats[field][order].tolist()] for field in self.fields]
+        return list(zip(genes[order].tolist(), *columns))
+
+    def compute(self, metacell_ids, fc_min=2, fc_min_type="mean", chunk_size=1024):
+        """
+        Compute the markers of a set of metacells against all other metacells of the dataset.
+
+        Args:
+            metacell_ids (iterable): Primary keys of the foreground metacells.
+            fc_min (float): Minimum foreground fold-change (mean or median) of markers.
+            fc_min_type (str): Foreground fold-change compared to `fc_min` (`mean` or `median`).
+            chunk_size (int): Number of genes reduced at a time.
+
+        Returns:
+            list: (gene ID, *statistics in the order of `fields`) tuples ordered by the selected
+                  foreground fold-change (descending) and gene ID, or None if the store is not built.
+        """
+        arrays = self.store.load()
+        if arrays is None:
+            return None
+
+        fg = np.isin(arrays["metacells"], np.asarray(list(metacell_ids), dtype=np.int64))
+        stats = self._stats(arrays, [fg], chunk_size)[0]
+        having = "fg_median_fc" if fc_min_type == "median" else "fg_mean_fc"
+        return self._rows(np.asarray(arrays["genes"]), stats, stats[having] >= float(fc_min), having)
+
+    def compute_cell_types(self, chunk_size=1024):
+        """
+        Compute the markers of every metacell type of the dataset against all other metacells.
+
+        All types are computed in a single read of the store. Markers are genes with a mean or
+        median fold-change of at least `MetacellTypeMarker.min_fold_change` in the type.
+
+        Returns:
+            dict: Rows (as returned by `compute`, ordered by mean fold-change) per metacell type
+                  primary key, or None if the store is not built.
+        """
+        arrays = self.store.load()
+        if arrays is None:
+            return None
+
+        types = {}
+        metacells = models.Metacell.objects.filter(dataset=self.dataset, type__isnull=False)
+        for pk, type_id in metacells.values_list("pk", "type_id"):
+            types.setdefault(type_id, []).append(pk)
+        masks = [np.isin(arrays["metacells"], np.asarray(ids, dtype=np.int64)) for ids in types.values()]
+
+        genes = np.asarray(arrays["genes"])
+        fc_min = models.MetacellTypeMarker.min_fold_change
+        markers = {}
+        for type_id, stats in zip(types, self._stats(arrays, masks, chunk_size)):
+            keep = (stats["fg_mean_fc"] >= fc_min) | (stats["fg_median_fc"] >= fc_min)
+            markers[type_id] = self._rows(genes, stats, keep, "fg_mean_fc")
+        return markers
+
+    def refresh_cell_type_markers(self, chunk_size=1024):
+        """
+        Replace the `MetacellTypeMarker` rows of the dataset with the markers of every metacell type.
+
+        Returns:
+            int: Number of rows created, or None if the store is not built.
+        """
+        markers = self.compute_cell_types(chunk_size)
+        if markers is None:
+            return None
+
+        rows = [
+            models.MetacellTypeMarker(
+                dataset=self.dataset,
+                metacell_type_id=type_id,
+                gene_id=gene_id,
+                rank=rank,
+                **dict(zip(self.fields, stats)),
+            )
+            for type_id, type_rows in markers.items()
+            for rank, (gene_id, *stats) in enumerate(type_rows, 1)
+        ]
+        with transaction.atomic():
+            models.MetacellTypeMarker.objects.filter(dataset=self.dataset).delete()
+            models.MetacellTypeMarker.objects.bulk_create(rows, batch_size=10000)
+        return len(rows)
@@ -0,0 +1,195 @@
+"""Metacell gene expression lookups backed by the dense expression store."""
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Q
+
+from app import models
+from app.utils.expression_arrays import MetacellExpressionArrays
+from app.utils.expression_store import MetacellExpressionStore
+
+from .gene_sets import GeneSetResolver
+
+
+class MetacellExpressionService:
+    """
+    List metacell gene expression of a dataset from its memory-mapped store.
+
+    Produces the same rows as `MetacellGeneExpressionSerializer` for lookups by
+    gene set and metacell set, without fetching long-format rows through the ORM.
+    Rows are ordered by gene and metacell.
+
+    Expression can also be returned as dense genes x metacells matrices (`matrix`),
+    which avoids repeating gene and metacell strings in each row for heatmaps.
+
+    If `METACELL_EXPRESSION_BACKEND` is "arrays", expression is read from the
+    array-per-gene rows of the dataset (`MetacellExpressionArrays`) instead.
+    """
+
+    shape_choices = {"long": "One row per gene and metacell", "matrix": "Genes x metacells matrices"}
+
+    def __init__(self, dataset):
+        self.dataset = dataset
+        if settings.METACELL_EXPRESSION_BACKEND == "arrays":
+            self.store = MetacellExpressionArrays(dataset)
+        else:
+            self.store = MetacellExpressionStore(dataset)
+
+    def is_available(self):
+        """Return whether the store is built for the current database version."""
+        return self.store.exists()
+
+    def get_gene_ids(self, genes):
+        """Return primary keys of genes matching names, domains, gene lists or gene modules."""
+        return GeneSetResolver(self.dataset.species).resolve(genes)
+
+    def get_metacell_ids(self, metacells):
+        """Return primary keys of metacells matching names or cell types."""
+        queryset = models.Metacell.objects.filter(dataset=self.dataset)
+        queryset = queryset.filter(Q(name__in=metacells) | Q(type__name__in=metacells))
+        return queryset.values_list("pk", flat=True)
+
+    @staticmethod
+    def _values(array):
+        """Return array values as NumPy scalars (serialised in their shortest form), or None if NaN."""
+        return [None if np.isnan(value) else value for value in array]
+
+    def lookup(self, genes=None, metacells=None, fc_min=None):
+        """Return store arrays of the existing rows for genes and metacells, or None if the store is not built."""
+        gene_ids = None if not genes else self.get_gene_ids(genes)
+        metacell_ids = None if not metacells else self.get_metacell_ids(metacells)
+        data = self.store.lookup(gene_ids, metacell_ids)
+        if data is not None and fc_min is not None:
+            keep = data["fold_change"] >= float(fc_min)
+            data = {key: values[keep] for key, values in data.items()}
+        return data
+
+    @staticmethod
+    def log2_fold_change(fold_change, fc_min=None, clip_log2=None):
+        """Return the float32 log2 fold-change (NaN if not positive), capped at `clip_log2` (at least `fc_min`)."""
+        fold_change = np.asarray(fold_change, dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            log2_fold_change = np.where(fold_change > 0, np.log2(fold_change), np.nan)
+        if clip_log2:
+            log2_fold_change = np.minimum(log2_fold_change, max(float(fc_min or 0), float(clip_log2)))
+        return log2_fold_change.astype(np.float32)
+
+    @staticmethod
+    def get_gene_info(gene_ids):
+        """Return name, description and sorted domain names of each gene by primary key."""
+        genes = models.Gene.objects.filter(pk__in=list(gene_ids))
+        genes = {pk: (name, desc, []) for pk, name, desc in genes.values_list("pk", "name", "description")}
+        domains = models.Gene.domains.through.objects.filter(gene_id__in=genes.keys())
+        for gene_id, domain in domains.order_by("domain__name").values_list("gene_id", "domain__name"):
+            genes[gene_id][2].append(domain)
+        return genes
+
+    @staticmethod
+    def get_metacell_info(metacell_ids):
+        """Return name, cell type and color of each metacell by primary key."""
+        metacells = models.Metacell.objects.filter(pk__in=list(metacell_ids))
+        return {pk: info for pk, *info in metacells.values_list("pk", "name", "type__name", "type__color")}
+
+    def list(self, genes=None, metacells=None, fc_min=None, log2=False, clip_log2=None):
+        """
+        List metacell gene expression from the store.
+
+        Args:
+            genes (list, optional): Gene names, domains, gene lists or gene modules.
+            metacells (list, optional): Metacell names or cell types.
+            fc_min (float, optional): Minimum fold-change.
+            log2 (bool): Whether to add the log2-transformed fold-change.
+            clip_log2 (float, optional): Maximum log2 fold-change (at least `fc_min`).
+
+        Returns:
+            list: Dictionaries in the format of `MetacellGeneExpressionSerializer`, or None
+                  if the store is not built for the current database version.
+        """
+        data = self.lookup(genes, metacells, fc_min)
+        if data is None:
+            return None
+
+        gene_info = self.get_gene_info(np.unique(data["gene"]).tolist())
+        metacell_info = self.get_metacell_info(np.unique(data["metacell"]).tolist())
+
+        columns = {field: self._values(data[field]) for field in self.store.fields}
+        if log2:
+            columns["log2_fold_change"] = self._values(self.log2_fold_change(data["fold_change"], fc_min, clip_log2))
+
+        results = []
+        for i, (gene_id, metacell_id) in enumerate(zip(data["gene"].tolist(), data["metacell"].tolist())):
+            name, description, gene_domains = gene_info[gene_id]
+            metacell_name, metacell_type, metacell_color = metacell_info[metacell_id]
+            row = {"log2_fold_change": columns["log2_fold_change"][i]} if log2 else {}
+            row.update(
+                {
+                    "gene_name": name,
+                    "gene_description": description,
+                    "gene_domains": gene_domains,
+                    "metacell_name": metacell_name,
+                    "metacell_type": metacell_type,
+                    "metacell_color": metacell_color,
+                    "umi_raw": columns["umi_raw"][i],
+                    "umifrac": columns["umifrac"][i],
+                    "fold_change": columns["fold_change"][i],
+                }
+            )
+            results.append(row)
+        return results
+
+    def matrix(self, genes=None, metacells=None, fc_min=None, log2=False, clip_log2=None):
+        """
+        Return metacell gene expression from the store as genes x metacells matrices.
+
+        Takes the same arguments as `list`. Returns the output of `build_matrix`, or None
+        if the store is not built for the current database version.
+        """
+        data = self.lookup(genes, metacells, fc_min)
+        if data is None:
+            return None
+
+        columns = {field: data[field] for field in self.store.fields}
+        if log2:
+            columns["log2_fold_change"] = self.log2_fold_change(data["fold_change"], fc_min, clip_log2)
+        return self.build_matrix(data["gene"], data["metacell"], columns)
+
+    @classmethod
+    def build_matrix(cls, gene_ids, metacell_ids, columns):
+        """
+        Pivot long-format expression rows into dense genes x metacells matrices.
+
+        Genes are ordered by their first row (keeping the order of sorted queries) and
+        metacells by primary key. Missing (gene, metacell) pairs are NaN, serialised as null.
+
+        Args:
+            gene_ids (array-like): Gene primary key of each row.
+            metacell_ids (array-like): Metacell primary key of each row.
+            columns (dict): Values of each row per field.
+
+        Returns:
+            dict: Gene (name, description, domains) and metacell (name, type, color) axes,
+                  and a float32 matrix per field in `values`.
+        """
+        gene_ids = np.asarray(gene_ids, dtype=np.int64)
+        metacell_ids = np.asarray(metacell_ids, dtype=np.int64)
+
+        genes, first, gene_codes = np.unique(gene_ids, return_index=True, return_inverse=True)
+        order = np.argsort(first, kind="stable")
+        rank = np.empty_like(order)
+        rank[order] = np.arange(order.size)
+        genes, rows = genes[order], rank[gene_codes]
+        metacells, cols = np.unique(metacell_ids, return_inverse=True)
+
+        values = {}
+        for field, column in columns.items():
+            matrix = np.full((genes.size, metacells.size), np.nan, dtype=np.float32)
+            matrix[rows, cols] = np.asarray(column, dtype=np.float32)
+            values[field] = matrix
+
+        gene_info = cls.get_gene_info(genes.tolist())
+        metacell_info = cls.get_metacell_info(metacells.tolist())
+        return {
+            "genes": [dict(zip(("name", "description", "domains"), gene_info[pk])) for pk in genes.tolist()],
+            "metacells": [dict(zip(("name", "type", "color"), metacell_info[pk])) for pk in metacells.tolist()],
+            "values": values,
+        }
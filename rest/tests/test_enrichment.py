@@ -1,6 +1,8 @@
+import os
 import tempfile
 import gzip
 from pathlib import Path
+from unittest import mock
 
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.test import override_settings
@@ -14,6 +16,8 @@ from app.models import (
     GlobalFile,
     GeneList,
 )
+from rest.services import go_enrichment
+from rest.services.go_enrichment import load_gene2go, load_godag, read_emapper, warm_godag_cache
 
 
 @override_settings(MEDIA_ROOT=tempfile.mkdtemp())
@@ -132,6 +136,57 @@ class EnrichmentAnalysisTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.check_enrichment_response(response, dataset, valid_genes)
 
+    def test_godag_cache(self):
+        """Test that GO DAGs are parsed once per file version and load_obsolete flag."""
+        path = self.go_obo.file.path
+        warm_godag_cache()
+        godag = load_godag(path)
+        self.assertIs(load_godag(path), godag)
+
+        obsolete_godag = load_godag(path, load_obsolete=True)
+        self.assertIsNot(obsolete_godag, godag)
+        self.assertIs(load_godag(path, load_obsolete=True), obsolete_godag)
+
+        # Parsed again when the file is modified
+        mtime = os.path.getmtime(path) + 1
+        os.utime(path, (mtime, mtime))
+        self.assertIsNot(load_godag(path), godag)
+
+    def test_gene2go_cache(self):
+        """Test that gene-to-GO annotations are read once per file checksum."""
+        path = self.emapper.file.path
+        gene2go = load_gene2go(path, self.emapper.checksum)
+        self.assertEqual(set(gene2go), set(self.genes))
+        self.assertIs(load_gene2go(path, self.emapper.checksum), gene2go)
+        self.assertIsNot(load_gene2go(path, "new checksum"), gene2go)
+
+    def test_gene2go_cache_size(self):
+        """Test that only the most recently used annotation files are kept."""
+        paths = []
+        for i in range(3):
+            path = os.path.join(tempfile.mkdtemp(), "emapper.txt.gz")
+            with gzip.open(path, "wt") as f:
+                f.write("\t".join([f"gene{i}", *["-"] * 8, "GO:0006412", "-"]) + "\n")
+            paths.append(path)
+
+        with mock.patch.object(go_enrichment, "_GENE2GOS_MAX_SIZE", 2):
+            first = load_gene2go(paths[0])
+            load_gene2go(paths[1])
+            self.assertIs(load_gene2go(paths[0]), first)
+            load_gene2go(paths[2])
+            self.assertIn(paths[0], go_enrichment._gene2gos)
+            self.assertNotIn(paths[1], go_enrichment._gene2gos)
+        self.assertEqual(first, {"gene0": frozenset({"GO:0006412"})})
+
+    def test_read_emapper_missing_columns(self):
+        """Test that lines without the GOs column are rejected."""
+        path = os.path.join(tempfile.mkdtemp(), "emapper.txt.gz")
+        with gzip.open(path, "wt") as f:
+            f.write("#query\tseed_ortholog\n")
+            f.write("gene1\tseed\t1e-10\t100\tGO:0006412\n")
+        with self.assertRaises(ValueError):
+            read_emapper(path)
+
     def test_post_obsolete(self):
         """Test if obsolete terms are included."""
         url = "/api/v1/enrichment/"
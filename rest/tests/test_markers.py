@@ -0,0 +1,159 @@
+import tempfile
+
+import numpy as np
+from django.core.cache import cache
+from django.db import connection
+from django.test import override_settings
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from app.models import Species
+from app.utils.expression_store import MetacellExpressionStore
+from app.utils.query_plans import check_plan, explain, get_index_names, iter_nodes
+from rest.services import MetacellMarkerService
+
+
+class MetacellMarkerData(APITestCase):
+    """Data to test the marker backends"""
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = np.random.default_rng(0)
+        species = Species.objects.create(scientific_name="markeri", common_name="markeri")
+        cls.dataset = species.datasets.create(name="markers")
+        cls.slug = "markeri-markers"
+
+        types = [cls.dataset.metacell_types.create(name=f"type{i}") for i in range(3)]
+        metacells = [cls.dataset.metacells.create(name=f"mc{i}", type=types[i % 3], x=i, y=i) for i in range(12)]
+        for i in range(20):
+            gene = species.genes.create(name=f"gene{i}")
+            for metacell in metacells:
+                # Missing rows and null values are ignored by both backends
+                if rng.random() < 0.2:
+                    continue
+                # Multiples of 1/8 are exact in the float32 store, so both backends rank genes identically
+                fold_change = None if rng.random() < 0.1 else int(rng.integers(1, 40)) / 8
+                umi_raw = float(rng.integers(0, 20))
+                cls.dataset.mge.create(
+                    gene=gene, metacell=metacell, umi_raw=umi_raw, umifrac=umi_raw / 100, fold_change=fold_change
+                )
+
+    def setUp(self):
+        cache.clear()
+        # Expression stores are built per test
+        self.enterContext(override_settings(EXPRESSION_STORE_DIR=self.enterContext(tempfile.TemporaryDirectory())))
+
+
+class MetacellMarkerBackendTests(MetacellMarkerData):
+    """Tests the NumPy marker backend against the SQL query"""
+
+    def get_markers(self, **params):
+        response = self.client.get("/api/v1/markers/", data={"dataset": self.slug, "limit": 0, **params})
+        assert response.status_code == status.HTTP_200_OK
+        cache.clear()
+        return response.json()
+
+    def test_fields(self):
+        from rest.views import MetacellMarkerViewSet
+
+        assert MetacellMarkerService.fields == MetacellMarkerViewSet._ANNOTATION_FIELDS
+
+    def test_parity(self):
+        MetacellExpressionStore(self.dataset).build()
+        selections = ["type0", "mc1", "mc1,mc2,type2", "type0,type1,type2", "missing"]
+        for metacells in selections:
+            for fc_min_type in ("mean", "median"):
+                params = {"metacells": metacells, "fc_min": 1, "fc_min_type": fc_min_type}
+                expected = self.get_markers(backend="sql", **params)
+                markers = self.get_markers(backend="numpy", **params)
+
+                assert [m["name"] for m in markers] == [m["name"] for m in expected], params
+                for marker, expected_marker in zip(markers, expected):
+                    assert marker.keys() == expected_marker.keys()
+                    for field, value in expected_marker.items():
+                        if isinstance(value, float):
+                            assert np.isclose(marker[field], value, rtol=1e-5), (params, field)
+                        else:
+                            assert marker[field] == value, (params, field)
+
+    def test_setting(self):
+        MetacellExpressionStore(self.dataset).build()
+        params = {"metacells": "type1", "fc_min": 1}
+        expected = self.get_markers(**params)
+        with override_settings(MARKER_BACKEND="numpy"):
+            assert [m["name"] for m in self.get_markers(**params)] == [m["name"] for m in expected]
+
+    def test_fallback_without_store(self):
+        assert MetacellMarkerService(self.dataset).compute([1]) is None
+        params = {"metacells": "type1", "fc_min": 1}
+        assert self.get_markers(backend="numpy", **params) == self.get_markers(backend="sql", **params)
+
+    def test_invalid_backend(self):
+        params = {"dataset": self.slug, "metacells": "type0", "backend": "invalid"}
+        response = self.client.get("/api/v1/markers/", data=params)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+
+class MetacellTypeMarkerTests(MetacellMarkerData):
+    """Tests precomputed markers of all cell types"""
+
+    def test_refresh(self):
+        service = MetacellMarkerService(self.dataset)
+        assert service.refresh_cell_type_markers() is None
+
+        MetacellExpressionStore(self.dataset).build()
+        rows = service.refresh_cell_type_markers()
+        assert rows == self.dataset.metacell_type_markers.count() > 0
+        # Refreshing replaces previous rows
+        assert service.refresh_cell_type_markers() == rows
+
+    def test_retrieve_cell_type_markers(self):
+        MetacellExpressionStore(self.dataset).build()
+        MetacellMarkerService(self.dataset).refresh_cell_type_markers()
+
+        url = "/api/v1/cell_type_markers/"
+        for fc_min_type in ("mean", "median"):
+            params = {"dataset": self.slug, "fc_min": 1.5, "fc_min_type": fc_min_type, "limit": 0}
+            response = self.client.get(url, data=params)
+            assert response.status_code == status.HTTP_200_OK
+            markers = response.json()
+            assert len({m["metacell_type"] for m in markers}) == 3
+
+            # Same markers as selecting each cell type in the markers endpoint
+            for metacell_type in ("type0", "type1", "type2"):
+                type_markers = [m for m in markers if m["metacell_type"] == metacell_type]
+                response = self.client.get(url, data={**params, "metacell_types": metacell_type})
+                assert response.json() == type_markers
+
+                expected = self.client.get("/api/v1/markers/", data={**params, "metacells": metacell_type}).json()
+                assert [m["gene_name"] for m in type_markers] == [m["name"] for m in expected]
+                for marker, expected_marker in zip(type_markers, expected):
+                    for field in ("fg_sum_umi", "bg_sum_umi", "umi_perc", "fg_mean_fc", "fg_median_fc"):
+                        if expected_marker[field] is None:
+                            assert marker[field] is None
+                        else:
+                            assert np.isclose(marker[field], expected_marker[field], rtol=1e-5)
+
+
+class MetacellMarkerPlanTests(MetacellMarkerData):
+    """Tests the plan shape of the marker query (see the `benchmarkmarkerplan` command for large datasets)"""
+
+    def test_plan_shape(self):
+        """
+        Check the marker query can use the covering index, with no repeated subplans.
+
+        On these toy tables and with `enable_seqscan = off`, this only shows that
+        the index can be used, not that the planner picks it on cost: run the
+        `benchmarkmarkerplan` command on a real dataset for that.
+        """
+        from rest.views import MetacellMarkerViewSet
+
+        indexes = get_index_names("app_mge_dataset_gene_covering")
+        with connection.cursor() as cursor:
+            # Tables are too small for index scans to be chosen on cost (reverted with the test transaction)
+            cursor.execute("SET LOCAL enable_seqscan = off")
+        for fc_min_type in ("mean", "median"):
+            queryset = MetacellMarkerViewSet().get_raw_queryset(self.dataset, ["type0"], 1, fc_min_type)
+            explained = explain(queryset.raw_query, queryset.params, analyze=False)
+            assert check_plan(explained, max_subplans=1) == [], fc_min_type
+            assert {node.get("Index Name") for node in iter_nodes(explained["Plan"])} & indexes, fc_min_type
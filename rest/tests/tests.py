@@ -1,9 +1,18 @@
+import asyncio
+import json
 import math
+import struct
 import tempfile
 import os.path
+from unittest import mock
 
+import numpy as np
+from django.core.cache import cache
 from django.core.files import File as DjangoFile
+from django.db import connection
 from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import resolve
 from rest_framework import status
 from rest_framework.test import APITestCase
 
@@ -23,7 +32,35 @@ from app.models import (
     MetacellTypeSimilarity,
     ExpressionConservation,
     SpeciesFile,
+    DBVersion,
+    GeneModule,
 )
+from app.utils.cell_type_expression import refresh_cell_type_expression
+from app.utils.expression_arrays import MetacellExpressionArrays
+from app.utils.expression_store import MetacellExpressionStore
+from rest.services import GeneSetResolver
+
+
+def decode_columnar(content):
+    """Decode a response of the columnar renderer into a dictionary of lists."""
+    (size,) = struct.unpack_from("<I", content)
+    header = json.loads(content[4 : 4 + size])
+    body = memoryview(content)[4 + size :]
+
+    columns = {}
+    for column in header["columns"]:
+        buffers = [body[b["offset"] : b["offset"] + b["length"]] for b in column["buffers"]]
+        if column["type"] == "utf8":
+            offsets = np.frombuffer(buffers[0], dtype="<u4")
+            data = bytes(buffers[1])
+            values = [data[i:j].decode() for i, j in zip(offsets[:-1], offsets[1:])]
+        elif column["type"] == "dictionary":
+            codes = np.frombuffer(buffers[0], dtype=np.dtype(column["index_type"]).newbyteorder("<"))
+            values = [None if c < 0 else column["dictionary"][c] for c in codes]
+        else:
+            values = np.frombuffer(buffers[0], dtype=np.dtype(column["type"]).newbyteorder("<")).tolist()
+        columns[column["name"]] = values
+    return header, columns
 
 
 class SchemaTests(APITestCase):
@@ -158,6 +195,58 @@ class GeneTests(APITestCase):
         assert {s["gene"] for s in genes} == payload["genes"]
 
 
+class GeneSetResolverTests(APITestCase):
+    """Test resolution of gene names, domains, gene lists and gene modules into gene IDs"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.mouse = Species.objects.create(scientific_name="Mus musculus")
+        cls.rat = Species.objects.create(scientific_name="Rattus norvegicus")
+        cls.dataset = cls.mouse.datasets.create(name="adult")
+        other_dataset = cls.mouse.datasets.create(name="embryo")
+
+        cls.genes = {name: cls.mouse.genes.create(name=name) for name in ("Gene1", "Gene2", "Gene3", "Gene4")}
+        rat_gene = cls.rat.genes.create(name="Gene1")
+
+        domain = Domain.objects.create(name="Kinase")
+        cls.genes["Gene2"].domains.add(domain)
+        rat_gene.domains.add(domain)
+        GeneList.objects.create(name="TFs").genes.add(cls.genes["Gene3"])
+        GeneModule.objects.create(name="module1", dataset=cls.dataset).genes.add(cls.genes["Gene4"])
+        GeneModule.objects.create(name="module1", dataset=other_dataset).genes.add(cls.genes["Gene1"])
+
+    def setUp(self):
+        cache.clear()
+
+    def ids(self, *names):
+        return sorted(self.genes[name].pk for name in names)
+
+    def test_resolve_all_kinds(self):
+        resolver = GeneSetResolver(self.mouse)
+        terms = ["Gene1", "Kinase", "TFs", "module1", "missing"]
+        assert resolver.resolve(terms) == self.ids("Gene1", "Gene2", "Gene3", "Gene4")
+
+    def test_resolve_kinds_and_dataset(self):
+        kinds = (GeneSetResolver.DOMAIN, GeneSetResolver.MODULE)
+        resolver = GeneSetResolver(self.mouse, self.dataset, kinds=kinds)
+        assert resolver.resolve(["Gene1", "Kinase", "TFs", "module1"]) == self.ids("Gene2", "Gene4")
+        assert sorted(resolver.resolve_names(["module1"])) == ["Gene4"]
+
+    def test_resolve_across_species(self):
+        assert len(GeneSetResolver(kinds=(GeneSetResolver.NAME,)).resolve(["Gene1"])) == 2
+        assert GeneSetResolver(self.mouse).resolve([]) == []
+
+    def test_cached_until_new_db_version(self):
+        resolver = GeneSetResolver(self.mouse)
+        assert resolver.resolve(["TFs"]) == self.ids("Gene3")
+
+        GeneList.objects.get(name="TFs").genes.add(self.genes["Gene1"])
+        assert resolver.resolve(["TFs"]) == self.ids("Gene3")
+
+        DBVersion.objects.create(version="new", description="new gene list")
+        assert resolver.resolve(["TFs"]) == self.ids("Gene1", "Gene3")
+
+
 class GeneSearchTests(APITestCase):
     """Test GeneSearch Endpoint"""
 
@@ -287,6 +376,139 @@ class SingleCellGeneExpressionTests(APITestCase):
             if entry["single_cell"] == "c5":
                 assert math.isclose(float(entry["umifrac"]), 10000, rel_tol=0.001)
 
+    def test_format_suffix_routes_read_off_event_loop(self):
+        for url in ("/api/v1/single_cell_expression/", "/api/v1/single_cell_expression.json"):
+            assert asyncio.iscoroutinefunction(resolve(url).func)
+        response = self.client.get("/api/v1/single_cell_expression.json?dataset=rat-drat&gene=g1")
+        assert response.status_code == status.HTTP_200_OK
+        assert {s["single_cell"] for s in response.json()} == {"c3", "c5"}
+
+    def test_retrieve_multiple_genes(self):
+        url = "/api/v1/single_cell_expression_matrix/?dataset=rat-drat&genes=g1,g4,g3,g1"
+        response = self.client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+
+        data = response.json()
+        assert data["genes"] == ["g1", "g4", "g3"]
+        assert data["cells"] == ["c2", "c3", "c5"]
+        values = {
+            (data["cells"][r], data["genes"][c]): v for r, c, v in zip(data["row"], data["col"], data["umifrac"])
+        }
+        assert values.keys() == {("c3", "g1"), ("c5", "g1"), ("c2", "g4"), ("c3", "g4")}
+        assert math.isclose(values[("c3", "g1")], 2142.857, rel_tol=0.001)
+        assert math.isclose(values[("c3", "g4")], 4285.714, rel_tol=0.001)
+
+    def test_retrieve_multiple_genes_limit(self):
+        from rest.views import SingleCellGeneExpressionMatrixViewSet
+
+        with mock.patch.object(SingleCellGeneExpressionMatrixViewSet, "limit", 2):
+            url = "/api/v1/single_cell_expression_matrix/?dataset=rat-drat&genes=g1,g2,g3"
+            response = self.client.get(url)
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        response = self.client.get("/api/v1/single_cell_expression_matrix/?dataset=rat-drat")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_dot_plot(self):
+        cache.clear()
+        for group_by in ("metacell", "type"):
+            url = f"/api/v1/single_cell_dot_plot/?dataset=rat-drat&genes=g1,g3&group_by={group_by}"
+            response = self.client.get(url)
+            assert response.status_code == status.HTTP_200_OK
+
+            stats = {s["gene"]: s for s in response.data}
+            assert stats["g1"]["group"] == ("meta1" if group_by == "metacell" else "type1")
+            assert stats["g1"]["metacell_type"] == "type1"
+            assert stats["g1"]["cells"] == 5
+            assert math.isclose(stats["g1"]["fraction"], 2 / 5)
+            assert math.isclose(stats["g1"]["umifrac"], (2142.857 + 10000) / 5, rel_tol=0.001)
+            assert stats["g3"]["fraction"] == stats["g3"]["umifrac"] == 0
+
+        response = self.client.get("/api/v1/single_cell_dot_plot/?dataset=rat-drat&genes=g1&group_by=cell")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_retrieve_single_cells_with_gene(self):
+        url = "/api/v1/single_cells/?dataset=rat-drat&gene=g1&limit=0"
+        response = self.client.get(url, format="json")
+        assert response.status_code == status.HTTP_200_OK
+        umifrac = {s["name"]: s["umifrac"] for s in response.data}
+        assert umifrac["c1"] is None
+        assert math.isclose(umifrac["c3"], 2142.857, rel_tol=0.001)
+        assert math.isclose(umifrac["c5"], 10000, rel_tol=0.001)
+
+    def test_retrieve_single_cells_columnar(self):
+        url = "/api/v1/single_cells/?dataset=rat-drat&gene=g1&limit=0&format=columnar"
+        response = self.client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        assert response["Content-Type"] == "application/vnd.bca.columnar"
+
+        header, columns = decode_columnar(response.content)
+        assert header["count"] == header["length"] == 5
+        assert sorted(columns["name"]) == ["c1", "c2", "c3", "c4", "c5"]
+        assert set(columns["metacell_name"]) == {"meta1"}
+        assert set(columns["metacell_type"]) == {"type1"}
+        assert next(c for c in header["columns"] if c["name"] == "x")["type"] == "float32"
+
+        umifrac = dict(zip(columns["name"], columns["umifrac"]))
+        assert math.isnan(umifrac["c1"])
+        assert math.isclose(umifrac["c3"], 2142.857, rel_tol=0.001)
+        assert math.isclose(umifrac["c5"], 10000, rel_tol=0.001)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class SingleCellBinTests(APITestCase):
+    """Tests binned single-cell embedding endpoint"""
+
+    @classmethod
+    def setUpTestData(cls):
+        species = Species.objects.create(common_name="mouse", scientific_name="Mouse", description="mouse")
+        dataset = Dataset.objects.create(species=species, name="DMouse", description="mouse dataset")
+        type1 = MetacellType.objects.create(name="type1", dataset=dataset, color="#111111")
+        type2 = MetacellType.objects.create(name="type2", dataset=dataset, color="#222222")
+        meta1 = Metacell.objects.create(name="meta1", dataset=dataset, type=type1)
+        meta2 = Metacell.objects.create(name="meta2", dataset=dataset, type=type2)
+        Gene.objects.create(name="g1", species=species)
+
+        cells = [("c1", 0, 0, meta1), ("c2", 1, 1, meta1), ("c3", 2, 0, meta2), ("c4", 10, 10, meta2)]
+        cells.append(("c5", 9, 9, meta2))
+        for name, x, y, metacell in cells:
+            SingleCell.objects.create(name=name, dataset=dataset, metacell=metacell, x=x, y=y)
+
+        test_file = os.path.join(os.path.dirname(__file__), "test_fixtures", "gene_expression_test.hdf5")
+        with open(test_file, "rb") as f:
+            django_file = DjangoFile(f, name=os.path.basename(test_file))
+            DatasetFile.objects.create(dataset=dataset, type="singlecell_umifrac", file=django_file)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_bins(self):
+        url = "/api/v1/single_cell_bins/?dataset=mouse-dmouse&resolution=2&gene=g1"
+        response = self.client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+
+        bins = sorted(response.data, key=lambda b: b["x"])
+        assert [b["count"] for b in bins] == [3, 2]
+        assert [b["metacell_type"] for b in bins] == ["type1", "type2"]
+        assert [b["metacell_color"] for b in bins] == ["#111111", "#222222"]
+        assert [(b["x"], b["y"], b["width"]) for b in bins] == [(2.5, 2.5, 5), (7.5, 7.5, 5)]
+        assert math.isclose(bins[0]["umifrac"], 2142.857 / 3, rel_tol=0.001)
+        assert math.isclose(bins[1]["umifrac"], 10000 / 2, rel_tol=0.001)
+
+    def test_zoom_and_viewport(self):
+        url = "/api/v1/single_cell_bins/?dataset=mouse-dmouse&resolution=2&zoom=1&xmax=4&ymax=4"
+        response = self.client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+        assert [(b["x"], b["count"], b["umifrac"]) for b in response.data] == [(1.25, 3, None)]
+
+    def test_invalid_params(self):
+        for params in ("zoom=99", "resolution=0", "zoom=a", "xmin=a"):
+            response = self.client.get(f"/api/v1/single_cell_bins/?dataset=mouse-dmouse&{params}")
+            assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+        response = self.client.get("/api/v1/single_cell_bins/?dataset=mouse-dmouse&gene=missing")
+        assert response.status_code == status.HTTP_404_NOT_FOUND
+
 
 class SingleCellTests(APITestCase):
     """Tests SingleCell endpoint"""
@@ -307,6 +529,25 @@ class SingleCellTests(APITestCase):
         assert len(single_cells) == 1
         assert [s["name"] for s in single_cells] == ["singleCell"]
 
+    def test_retrieve_columnar(self):
+        SingleCell.objects.create(name="noMetacell", dataset=Dataset.objects.get(name="dataset1"), x=2.5, y=-1)
+        url = "/api/v1/single_cells/?dataset=species1-dataset1&format=columnar"
+        response = self.client.get(url)
+        assert response.status_code == status.HTTP_200_OK
+
+        _, columns = decode_columnar(response.content)
+        cells = {name: i for i, name in enumerate(columns["name"])}
+        assert columns["metacell_type"][cells["singleCell"]] == "type1"
+        assert columns["metacell_name"][cells["noMetacell"]] is None
+        assert columns["metacell_color"][cells["noMetacell"]] is None
+        assert columns["x"][cells["noMetacell"]] == 2.5
+        assert "umifrac" not in columns
+
+    def test_retrieve_columnar_error(self):
+        response = self.client.get("/api/v1/single_cells/?format=columnar")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+        assert "dataset" in json.loads(response.content)
+
 
 class MetacellTests(APITestCase):
     """Test Metacell endpoint"""
@@ -364,6 +605,138 @@ class MetacellTests(APITestCase):
         assert {s["gene_name"] for s in metacell_gene_expression} == {"gene2"}
         assert {s["metacell_name"] for s in metacell_gene_expression} == {"meta1", "meta2"}
 
+    def test_retrieve_gene_expression_markers(self):
+        url = "/api/v1/metacell_expression/?dataset=species3-dataset3&n_markers=1"
+        response = self.client.get(url, format="json")
+        metacell_gene_expression = response.data["results"]
+        assert response.status_code == status.HTTP_200_OK
+        assert len(metacell_gene_expression) == 2
+        assert {s["gene_name"] for s in metacell_gene_expression} == {"gene1"}
+
+        # Top genes are ranked among the filtered expression data
+        response = self.client.get(url + "&metacells=meta1&fc_min=0&genes=gene2", format="json")
+        metacell_gene_expression = response.data["results"]
+        assert len(metacell_gene_expression) == 1
+        assert metacell_gene_expression[0]["gene_name"] == "gene2"
+
+    def test_retrieve_gene_expression_from_store(self):
+        def rows(url):
+            response = self.client.get(url, format="json")
+            assert response.status_code == status.HTTP_200_OK
+            # Both backends order rows by gene and metacell
+            return response.json()
+
+        base = "/api/v1/metacell_expression/?dataset=species3-dataset3&limit=0"
+        urls = [base, base + "&genes=gene2&metacells=meta1", base + "&fc_min=2&log2=true&clip_log2=2"]
+        expected = [rows(url) for url in urls]
+
+        with tempfile.TemporaryDirectory() as tmpdir, override_settings(EXPRESSION_STORE_DIR=tmpdir):
+            MetacellExpressionStore(Dataset.objects.get(name="dataset3")).build()
+            for url, expected_rows in zip(urls, expected):
+                results = rows(url)
+                assert len(results) == len(expected_rows)
+                for row, expected_row in zip(results, expected_rows):
+                    assert row.keys() == expected_row.keys()
+                    for key, value in expected_row.items():
+                        if isinstance(value, float):
+                            assert math.isclose(row[key], value, rel_tol=1e-6)
+                        else:
+                            assert row[key] == value
+
+            # A new database version makes the store stale
+            DBVersion.objects.create(version="new", description="new data")
+            Gene.objects.get(name="gene2").mge.filter(metacell__name="meta1").update(umi_raw=7)
+            results = rows(base + "&genes=gene2&metacells=meta1")
+            assert results[0]["umi_raw"] == 7
+
+    def test_retrieve_gene_expression_from_arrays(self):
+        def rows(url):
+            response = self.client.get(url, format="json")
+            assert response.status_code == status.HTTP_200_OK
+            return response.json()
+
+        base = "/api/v1/metacell_expression/?dataset=species3-dataset3&limit=0"
+        urls = [base, base + "&genes=gene2&metacells=meta1", base + "&fc_min=2&log2=true&clip_log2=2"]
+        expected = [rows(url) for url in urls]
+
+        dataset = Dataset.objects.get(name="dataset3")
+        assert MetacellExpressionArrays(dataset).build() == 2
+        # Building replaces previous arrays
+        assert MetacellExpressionArrays(dataset).build() == 2
+
+        with override_settings(METACELL_EXPRESSION_BACKEND="arrays"):
+            for url, expected_rows in zip(urls, expected):
+                results = rows(url)
+                assert len(results) == len(expected_rows)
+                for row, expected_row in zip(results, expected_rows):
+                    assert row.keys() == expected_row.keys()
+                    for key, value in expected_row.items():
+                        if isinstance(value, float):
+                            assert math.isclose(row[key], value, rel_tol=1e-6)
+                        else:
+                            assert row[key] == value
+
+            # Arrays of a previous database version are ignored until rebuilt
+            DBVersion.objects.create(version="new", description="new data")
+            assert not MetacellExpressionArrays(dataset).exists()
+            assert MetacellExpressionArrays(dataset).lookup() is None
+            assert len(rows(urls[0])) == len(expected[0])
+
+    def test_retrieve_gene_expression_matrix(self):
+        base = "/api/v1/metacell_expression/?dataset=species3-dataset3&log2=true"
+
+        def check_matrix():
+            rows = self.client.get(base + "&limit=0", format="json").json()
+            response = self.client.get(base + "&shape=matrix", format="json")
+            assert response.status_code == status.HTTP_200_OK
+            matrix = response.json()
+            assert [g["name"] for g in matrix["genes"]] == ["gene1", "gene2"]
+            assert [m["name"] for m in matrix["metacells"]] == ["meta1", "meta2"]
+            assert matrix["metacells"][0].keys() == {"name", "type", "color"}
+            assert set(matrix["values"]) == {"umi_raw", "umifrac", "fold_change", "log2_fold_change"}
+            for row in rows:
+                i = [g["name"] for g in matrix["genes"]].index(row["gene_name"])
+                j = [m["name"] for m in matrix["metacells"]].index(row["metacell_name"])
+                for field, values in matrix["values"].items():
+                    assert math.isclose(values[i][j], row[field], rel_tol=1e-6)
+
+        check_matrix()
+        with tempfile.TemporaryDirectory() as tmpdir, override_settings(EXPRESSION_STORE_DIR=tmpdir):
+            MetacellExpressionStore(Dataset.objects.get(name="dataset3")).build()
+            check_matrix()
+
+        # Missing values are null
+        response = self.client.get(base + "&shape=matrix&fc_min=2", format="json")
+        fold_change = response.json()["values"]["fold_change"]
+        assert fold_change[0] == [4, 5]
+        assert fold_change[1][1] is None
+
+        response = self.client.get(base + "&shape=wide", format="json")
+        assert response.status_code == status.HTTP_400_BAD_REQUEST
+
+    def test_retrieve_cell_type_expression(self):
+        dataset = Dataset.objects.get(name="dataset3")
+        assert refresh_cell_type_expression(dataset) == 2
+        # Refreshing replaces previous rows
+        assert refresh_cell_type_expression(dataset) == 2
+
+        url = "/api/v1/metacell_type_expression/?dataset=species3-dataset3"
+        response = self.client.get(url, format="json")
+        expression = response.data["results"]
+        assert response.status_code == status.HTTP_200_OK
+        assert [s["gene_name"] for s in expression] == ["gene1", "gene2"]
+        assert expression[0]["metacell_type"] == "type1"
+        assert expression[0]["metacells"] == 2
+        assert math.isclose(expression[0]["fold_change_mean"], 4.5)
+        assert math.isclose(expression[0]["fold_change_max"], 5)
+        assert math.isclose(expression[0]["umi_raw_sum"], 2)
+        assert math.isclose(expression[1]["umifrac_mean"], (2.34 + 1.01) / 2)
+
+        response = self.client.get(url + "&genes=gene2&metacell_types=type1", format="json")
+        assert [s["gene_name"] for s in response.data["results"]] == ["gene2"]
+        response = self.client.get(url + "&fc_min=3", format="json")
+        assert [s["gene_name"] for s in response.data["results"]] == ["gene1"]
+
     def test_retrieve_cell_markers(self):
         url = "/api/v1/markers/?dataset=species3-dataset3&metacells=meta1&fc_min_type=mean"
         response = self.client.get(url, format="json")
@@ -711,6 +1084,9 @@ class MetacellMarkerRawSQLTests(APITestCase):
         dataset.mge.create(gene=gene_t, metacell=mt1, umi_raw=5, umifrac=0.5, fold_change=4.0)
         dataset.mge.create(gene=gene_t, metacell=mt2, umi_raw=4, umifrac=0.4, fold_change=4.5)
 
+    def setUp(self):
+        cache.clear()
+
     def _get_markers(self, **params):
         # ``data`` is URL-encoded by the test client, which matters for values
         # containing spaces (e.g., ``metacells="B cell"``).
@@ -746,6 +1122,33 @@ class MetacellMarkerRawSQLTests(APITestCase):
         self.assertAlmostEqual(marker["fg_mean_fc"], 4.5, places=4)
         self.assertAlmostEqual(marker["fg_median_fc"], 4.5, places=4)
 
+    def test_array_backend_matches_rows(self):
+        """The array-per-gene query returns the same markers and stats as the row-based query."""
+        MetacellExpressionArrays(Dataset.objects.get(name="atlas3")).build()
+        queries = [{"metacells": "B cell", "fc_min": 2}, {"metacells": "mt1,mt2", "fc_min_type": "median", "fc_min": 0}]
+        for params in queries:
+            expected = self._get_markers(dataset="cellb-atlas3", **params).data["results"]
+            cache.clear()
+            with override_settings(METACELL_EXPRESSION_BACKEND="arrays"):
+                response = self._get_markers(dataset="cellb-atlas3", **params)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            markers = response.data["results"]
+            self.assertEqual([m["name"] for m in markers], [m["name"] for m in expected])
+            for marker, expected_marker in zip(markers, expected):
+                for field in ("fg_sum_umi", "bg_sum_umi", "umi_perc", "fg_mean_fc", "fg_median_fc"):
+                    self.assertAlmostEqual(marker[field], expected_marker[field], places=4)
+
+    def test_array_backend_without_arrays(self):
+        """Datasets without arrays built fall back to the row-based query."""
+        params = {"dataset": "cellb-atlas3", "metacells": "B cell", "fc_min": 2}
+        expected = self._get_markers(**params).data
+        cache.clear()
+        with override_settings(METACELL_EXPRESSION_BACKEND="arrays"):
+            response = self._get_markers(**params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertGreater(response.data["count"], 0)
+        self.assertEqual(response.data, expected)
+
     def test_median_threshold_filters_same_genes(self):
         """fc_min_type=median routes the HAVING to fg_median_fc."""
         response = self._get_markers(dataset="cellb-atlas3", metacells="B cell", fc_min_type="median", fc_min=2)
@@ -759,6 +1162,66 @@ class MetacellMarkerRawSQLTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data["results"], [])
 
+    def test_results_are_cached(self):
+        """Repeated queries of the same metacell set are served from the cache until the database version changes."""
+        params = {"dataset": "cellb-atlas3", "fc_min_type": "mean", "fc_min": 0}
+        with CaptureQueriesContext(connection) as queries:
+            first = self._get_markers(metacells="B cell", **params)
+            # Same metacells by name, next page
+            second = self._get_markers(metacells="mb2,mb1", limit=1, offset=1, **params)
+        self.assertEqual(sum("percentile_cont" in q["sql"] for q in queries.captured_queries), 1)
+        self.assertEqual(second.data["count"], first.data["count"])
+        self.assertEqual(second.data["results"][0]["name"], first.data["results"][1]["name"])
+
+        # A new database version invalidates cached rows
+        DBVersion.objects.create(version="new", description="new data")
+        Gene.objects.get(name="gene_t").mge.update(fold_change=10)
+        response = self._get_markers(metacells="B cell", **params)
+        self.assertEqual(response.data["results"][0]["name"], "gene_t")
+
+        # Too large results are not cached
+        with override_settings(MARKER_CACHE_MAX_ROWS=1), CaptureQueriesContext(connection) as queries:
+            self._get_markers(metacells="T cell", **params)
+            self._get_markers(metacells="T cell", **params)
+        self.assertEqual(sum("percentile_cont" in q["sql"] for q in queries.captured_queries), 2)
+
+    def test_pagination_in_sql(self):
+        """Pages of results too large to cache are fetched and counted by the marker query."""
+        params = {"dataset": "cellb-atlas3", "metacells": "B cell", "fc_min": 0}
+        expected = [m["name"] for m in self._get_markers(limit=0, **params).data]
+        self.assertEqual(expected, ["gene_marker", "gene_t", "gene_low"])
+
+        with override_settings(MARKER_CACHE_MAX_ROWS=0):
+            # Including the first page, before the count is cached
+            cache.clear()
+            for offset, name in enumerate(expected):
+                with CaptureQueriesContext(connection) as queries:
+                    response = self._get_markers(limit=1, offset=offset, **params)
+                self.assertEqual(response.data["count"], 3)
+                self.assertEqual([m["name"] for m in response.data["results"]], [name])
+                sql = [q["sql"] for q in queries.captured_queries if "percentile_cont" in q["sql"]]
+                self.assertEqual(len(sql), 1)
+                self.assertIn("LIMIT 1 OFFSET", sql[0])
+
+            # Pages past the last row are empty but still report the total count
+            response = self._get_markers(limit=1, offset=len(expected), **params)
+            self.assertEqual(response.data["count"], 3)
+            self.assertEqual(response.data["results"], [])
+
+    def test_pages_of_small_results_are_cached(self):
+        """A page of a result small enough to cache caches the whole result."""
+        params = {"dataset": "cellb-atlas3", "metacells": "B cell", "fc_min": 0}
+        expected = [m["name"] for m in self._get_markers(limit=0, **params).data]
+
+        cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            pages = [self._get_markers(limit=1, offset=offset, **params).data for offset in range(len(expected))]
+        sql = [q["sql"] for q in queries.captured_queries if "percentile_cont" in q["sql"]]
+        self.assertEqual(len(sql), 2)
+        self.assertIn("LIMIT 1 OFFSET", sql[0])
+        self.assertEqual([name for page in pages for name in (m["name"] for m in page["results"])], expected)
+        self.assertEqual({page["count"] for page in pages}, {len(expected)})
+
     def test_missing_dataset_returns_400(self):
         response = self.client.get("/api/v1/markers/?metacells=B cell", format="json")
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
@@ -824,6 +1287,9 @@ class MetacellMarkerOrderingTests(APITestCase):
         dataset.mge.create(gene=gene_bg, metacell=bg1, umi_raw=5, umifrac=0.5, fold_change=6.0)
         dataset.mge.create(gene=gene_bg, metacell=bg2, umi_raw=5, umifrac=0.5, fold_change=6.5)
 
+    def setUp(self):
+        cache.clear()
+
     def _get_markers(self, **params):
         return self.client.get("/api/v1/markers/", data=params, format="json")
 
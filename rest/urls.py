@@ -2,15 +2,38 @@ from django.urls import include, path
 from drf_spectacular.views import (
     SpectacularAPIView,
 )
+from rest_framework.urlpatterns import format_suffix_patterns
 
 from rest.routers import router
 
+from . import views
+from .async_views import offload_hdf5_reads
 from .schema import SpectacularElementsView
 
 app_name = "rest"
 
 urlpatterns = [
     path("", SpectacularElementsView.as_view(url_name="rest:schema"), name="index"),
+    # Read HDF5 expression off the event loop (takes precedence over the router URLs,
+    # including their format suffixes, e.g. single_cells.json)
+    *format_suffix_patterns(
+        [
+            path(
+                "single_cells/",
+                offload_hdf5_reads(
+                    views.SingleCellViewSet.as_view({"get": "list"}, basename="singlecell", detail=False)
+                ),
+            ),
+            path(
+                "single_cell_expression/",
+                offload_hdf5_reads(
+                    views.SingleCellGeneExpressionViewSet.as_view(
+                        {"get": "list"}, basename="singlecellgeneexpression", detail=False
+                    )
+                ),
+            ),
+        ]
+    ),
     path("", include(router.urls), name="rest"),
     path("schema/", SpectacularAPIView.as_view(), name="schema"),
     # path('swagger-ui/', SpectacularSwaggerView.as_view(url_name='schema'), name='swagger-ui'),
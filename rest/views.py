@@ -1,23 +1,31 @@
 """REST API views."""
 
+import hashlib
 import logging
 import os
 import subprocess  # nosec B603, B404
 import tempfile
 from urllib.parse import unquote_plus
 
+import numpy as np
 from django.conf import settings
-from django.db.models import Case, Count, IntegerField, Prefetch, Value, When, Q
+from django.db.models import Case, Count, IntegerField, Prefetch, Value, When
 from drf_spectacular.utils import OpenApiExample, OpenApiParameter, extend_schema
 from rest_framework import viewsets, status
 from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
-from app.managers import ExpressionDataManager
+from app.managers import ExpressionDataManager, MultiGeneExpressionDataManager
 from app import models
+from app.utils.cache import get_db_version, get_validated_cache, set_validated_cache
+from app.utils.expression_arrays import MetacellExpressionArrays
 from . import filters, serializers, services
+from .renderers import ColumnarRenderer, DictionaryColumn, dictionary_encode
 from .utils import get_enum_description, get_path_param, parse_species_dataset
 
+logger = logging.getLogger(__name__)
+
 
 class BaseReadOnlyModelViewSet(viewsets.ReadOnlyModelViewSet):
     @extend_schema(exclude=True)
@@ -410,6 +418,7 @@ class SingleCellViewSet(BaseReadOnlyModelViewSet):
     queryset = models.SingleCell.objects.prefetch_related("metacell", "metacell__type")
     serializer_class = serializers.SingleCellSerializer
     filterset_class = filters.SingleCellFilter
+    renderer_classes = [*api_settings.DEFAULT_RENDERER_CLASSES, ColumnarRenderer]
     lookup_field = "name"
 
     def get_serializer_context(self):
@@ -417,14 +426,125 @@ class SingleCellViewSet(BaseReadOnlyModelViewSet):
         context.update({"request": self.request})
         dataset = context["request"].GET.get("dataset")
         gene = context["request"].GET.get("gene")
-        if gene is None:
-            expression_dictionary = {}
-        else:
-            expression_data_manager = ExpressionDataManager(dataset, gene)
-            expression_dictionary = expression_data_manager.get_expression_dictionary()
-        context.update({"expression_dictionary": expression_dictionary})
+        expression = None
+        if gene is not None:
+            expression = ExpressionDataManager(dataset, gene, getattr(self.request, "expression", None))
+        context.update({"expression": expression})
         return context
 
+    def get_columns(self, queryset):
+        """Return single cells as columns, with dictionary-encoded metacells, types and colors."""
+        queryset = queryset.prefetch_related(None)
+        count = None
+        limit = self.paginator.get_limit(self.request)
+        if limit is not None:
+            count = queryset.count()
+            offset = self.paginator.get_offset(self.request)
+            queryset = queryset[offset : offset + limit]
+
+        fields = ["name", "x", "y", "cytotrace", "median_umis", "metacell_id"]
+        rows = list(queryset.values_list(*fields))
+        names, x, y, cytotrace, median_umis, metacell_ids = zip(*rows) if rows else [()] * len(fields)
+
+        # Encode cells by metacell, then map metacell codes to type and color codes
+        metacell = dictionary_encode(metacell_ids)
+        metacells = models.Metacell.objects.filter(pk__in=metacell.dictionary)
+        metacells = {pk: info for pk, *info in metacells.values_list("pk", "name", "type__name", "type__color")}
+        info = [metacells[pk] for pk in metacell.dictionary]
+        mc_names, mc_types, mc_colors = zip(*info) if info else [()] * 3
+
+        def per_cell(column):
+            codes = np.append(column.codes, np.array([-1], dtype=column.codes.dtype))[metacell.codes]
+            return DictionaryColumn(codes, column.dictionary)
+
+        columns = {
+            "name": np.array(names, dtype=object),
+            "x": np.array(x, dtype=np.float32),
+            "y": np.array(y, dtype=np.float32),
+            "cytotrace": np.array(cytotrace, dtype=np.float32),
+            "median_umis": np.array(median_umis, dtype=np.float32),
+            "metacell_name": DictionaryColumn(metacell.codes, list(mc_names)),
+            "metacell_type": per_cell(dictionary_encode(mc_types)),
+            "metacell_color": per_cell(dictionary_encode(mc_colors)),
+        }
+
+        gene = self.request.query_params.get("gene")
+        if gene is not None:
+            dataset = self.request.query_params.get("dataset")
+            expression = ExpressionDataManager(dataset, gene, getattr(self.request, "expression", None))
+            columns["umifrac"] = expression.get_umifrac(names)
+
+        return {"count": len(rows) if count is None else count, "columns": columns}
+
+    @extend_schema(
+        description="List single cells for a given dataset.\n\n"
+        + "Use `format=columnar` to retrieve the cells as typed little-endian arrays after a JSON header "
+        + "(see `rest.renderers.ColumnarRenderer`): float32 coordinates and dictionary-encoded metacell "
+        + "names, types and colors."
+    )
+    def list(self, request, *args, **kwargs):
+        if request.accepted_renderer.format != ColumnarRenderer.format:
+            return super().list(request, *args, **kwargs)
+
+        queryset = self.filter_queryset(self.get_queryset())
+        return Response(self.get_columns(queryset))
+
+
+@extend_schema(summary="List binned single cells", tags=["Single cell"])
+class SingleCellBinViewSet(BaseReadOnlyModelViewSet):
+    """
+    List the single-cell embedding of a dataset aggregated in bins (level of detail).
+
+    At each zoom level, the embedding is split in `resolution * 2^zoom` bins per axis. Only non-empty bins
+    overlapping the viewport (`xmin`, `xmax`, `ymin`, `ymax`) are returned, with their dominant cell type and,
+    if a `gene` is given, its mean expression.
+    """
+
+    queryset = models.SingleCell.objects.all()
+    serializer_class = serializers.SingleCellBinSerializer
+    filterset_class = filters.SingleCellBinFilter
+    pagination_class = None
+
+    def get_int_param(self, name, default, minimum, maximum):
+        value = self.request.query_params.get(name) or default
+        try:
+            value = int(value)
+        except ValueError:
+            raise ValidationError({name: f"'{value}' is not an integer."})
+        if not minimum <= value <= maximum:
+            raise ValidationError({name: f"Must be between {minimum} and {maximum}."})
+        return value
+
+    def get_viewport(self):
+        bounds = {"xmin": -np.inf, "xmax": np.inf, "ymin": -np.inf, "ymax": np.inf}
+        if not any(self.request.query_params.get(name) for name in bounds):
+            return None
+        for name in bounds:
+            value = self.request.query_params.get(name)
+            if value:
+                try:
+                    bounds[name] = float(value)
+                except ValueError:
+                    raise ValidationError({name: f"'{value}' is not a number."})
+        return tuple(bounds.values())
+
+    def list(self, request, *args, **kwargs):
+        # Validate query parameters
+        self.filter_queryset(self.get_queryset())
+        dataset = parse_species_dataset(request.query_params.get("dataset"))
+
+        service = services.EmbeddingBinningService
+        zoom = self.get_int_param("zoom", 0, 0, service.MAX_ZOOM)
+        resolution = self.get_int_param("resolution", service.DEFAULT_RESOLUTION, 1, service.MAX_RESOLUTION)
+
+        gene = request.query_params.get("gene")
+        if gene and not models.Gene.objects.filter(species=dataset.species, name=gene).exists():
+            raise NotFound(f"Gene '{gene}' not found in {dataset}.")
+
+        bins = service(dataset).bin(zoom, resolution, self.get_viewport(), gene or None)
+        serializer = self.get_serializer(bins, many=True)
+        return Response(serializer.data)
+
 
 @extend_schema(summary="List metacells", tags=["Metacell"])
 class MetacellViewSet(ExpressionPrefetchMixin, BaseReadOnlyModelViewSet):
@@ -480,18 +600,150 @@ class SingleCellGeneExpressionViewSet(viewsets.GenericViewSet):
     def list(self, request, *args, **kwargs):
         gene = request.query_params.get("gene")
         dataset = request.query_params.get("dataset")
-        expression_data_manager = ExpressionDataManager(dataset, gene)
         try:
+            expression_data_manager = ExpressionDataManager(dataset, gene, getattr(request, "expression", None))
             data = expression_data_manager.create_singlecellexpression_models()
             serializer = self.get_serializer(instance=data, many=True)
             return Response(serializer.data)
         except OSError:
-            logging.exception(f"Error reading expression data for {gene} in {dataset}")
+            logger.exception("Error reading expression data for %s in %s", gene, dataset)
             return Response("detail: error reading expression data", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
 
+class MultiGeneQueryMixin:
+    """Mixin to parse the dataset and a comma-separated list of genes from query parameters."""
+
+    limit = settings.MAX_EXPRESSION_GENES  # Limit number of genes per request
+
+    def get_dataset_and_genes(self):
+        dataset = self.request.query_params.get("dataset")
+        genes = self.request.query_params.get("genes", "").split(",")
+        genes = list(dict.fromkeys(g.strip() for g in genes if g.strip()))
+
+        if not dataset:
+            raise ValidationError({"dataset": "This parameter is required."})
+        if not genes:
+            raise ValidationError({"genes": "This parameter is required."})
+        if len(genes) > self.limit:
+            raise ValidationError({"genes": f"Query can only contain up to {self.limit} genes."})
+        return dataset, genes
+
+
+@extend_schema(
+    summary="Retrieve single-cell expression for multiple genes",
+    tags=["Single cell", "Gene"],
+    parameters=[
+        OpenApiParameter(
+            "genes",
+            str,
+            "query",
+            True,
+            f"Comma-separated gene names (maximum of {settings.MAX_EXPRESSION_GENES} genes).",
+            examples=[OpenApiExample("Example", value="Spolac_c99997_g1,Spolac_c100001_g1")],
+        ),
+        OpenApiParameter(
+            "dataset",
+            str,
+            "query",
+            True,
+            "dataset slug",
+            examples=[OpenApiExample("Example", value="spongilla-lacustris")],
+        ),
+    ],
+    responses={200: serializers.SingleCellGeneExpressionMatrixSerializer},
+)
+class SingleCellGeneExpressionMatrixViewSet(MultiGeneQueryMixin, viewsets.GenericViewSet):
+    """
+    Retrieve the single-cell expression of multiple genes in a dataset as a sparse cells x genes block.
+
+    Values are returned in coordinate (COO) format: `umifrac[i]` is the expression of gene `genes[col[i]]`
+    in single cell `cells[row[i]]`. Cells not expressing any of the genes are omitted.
+    """
+
+    http_method_names = ["get"]
+    serializer_class = serializers.SingleCellGeneExpressionMatrixSerializer
+    queryset = models.SingleCellGeneExpression.objects.none()
+    filterset_class = None
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        dataset, genes = self.get_dataset_and_genes()
+        manager = MultiGeneExpressionDataManager(dataset, genes)
+        try:
+            return Response(manager.get_coo())
+        except OSError:
+            logger.exception("Error reading expression data for %s in %s", genes, dataset)
+            return Response("detail: error reading expression data", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@extend_schema(
+    summary="List single-cell expression statistics per metacell or cell type",
+    tags=["Single cell", "Metacell", "Gene"],
+    parameters=[
+        OpenApiParameter(
+            "genes",
+            str,
+            "query",
+            True,
+            f"Comma-separated gene names (maximum of {settings.MAX_EXPRESSION_GENES} genes).",
+            examples=[OpenApiExample("Example", value="Spolac_c99997_g1,Spolac_c100001_g1")],
+        ),
+        OpenApiParameter(
+            "dataset",
+            str,
+            "query",
+            True,
+            "dataset slug",
+            examples=[OpenApiExample("Example", value="spongilla-lacustris")],
+        ),
+        OpenApiParameter(
+            "group_by",
+            str,
+            "query",
+            False,
+            get_enum_description(
+                "Group single cells by (default: `metacell`).", services.SingleCellDotPlotService.group_choices
+            ),
+            enum=list(services.SingleCellDotPlotService.group_choices),
+        ),
+    ],
+)
+class SingleCellDotPlotViewSet(MultiGeneQueryMixin, viewsets.GenericViewSet):
+    """
+    List the fraction of single cells expressing each gene and their mean expression per metacell or cell type.
+
+    Statistics are computed from single-cell data, with non-expressing cells counting as zero for the mean.
+    """
+
+    http_method_names = ["get"]
+    serializer_class = serializers.SingleCellDotPlotSerializer
+    queryset = models.SingleCell.objects.none()
+    filterset_class = None
+    pagination_class = None
+
+    def list(self, request, *args, **kwargs):
+        dataset, genes = self.get_dataset_and_genes()
+        group_by = request.query_params.get("group_by") or "metacell"
+        if group_by not in services.SingleCellDotPlotService.group_choices:
+            raise ValidationError({"group_by": f"'{group_by}' is not a valid choice."})
+
+        service = services.SingleCellDotPlotService(parse_species_dataset(dataset))
+        try:
+            stats = service.aggregate(genes, group_by)
+        except OSError:
+            logger.exception("Error reading expression data for %s in %s", genes, dataset)
+            return Response("detail: error reading expression data", status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        serializer = self.get_serializer(stats, many=True)
+        return Response(serializer.data)
+
+
 @extend_schema(
     summary="List gene expression per metacell",
+    description=(
+        "Rows are ordered by gene and metacell, unless genes are ranked with `sort_genes`. "
+        "Values read from the dense expression store are single-precision (about 7 significant digits)."
+    ),
     tags=["Metacell", "Gene"],
     parameters=[
         OpenApiParameter(
@@ -517,6 +769,142 @@ class MetacellGeneExpressionViewSet(BaseReadOnlyModelViewSet):
     serializer_class = serializers.MetacellGeneExpressionSerializer
     filterset_class = filters.MetacellGeneExpressionFilter
 
+    def get_shape(self):
+        """Return the requested response shape (`long` or `matrix`)."""
+        shape = self.request.query_params.get("shape") or "long"
+        if shape not in services.MetacellExpressionService.shape_choices:
+            raise ValidationError({"shape": f"'{shape}' is not a valid choice."})
+        return shape
+
+    def list_from_store(self, shape="long"):
+        """
+        List expression from the dense store of the dataset, if built for the current database version.
+
+        Returns None (to query the database instead) if the store is not available, if the query
+        parameters are invalid or if they require ranking genes (`n_markers` and `sort_genes`).
+        """
+        filterset = self.filterset_class(self.request.query_params, queryset=self.get_queryset(), request=self.request)
+        if not filterset.is_valid():
+            return None
+
+        params = filterset.form.cleaned_data
+        if params.get("n_markers") or params.get("sort_genes"):
+            return None
+
+        service = services.MetacellExpressionService(parse_species_dataset(params["dataset"]))
+        if not service.is_available():
+            return None
+
+        genes, metacells = params.get("genes"), params.get("metacells")
+        method = service.matrix if shape == "matrix" else service.list
+        return method(
+            genes=genes.split(",") if genes else None,
+            metacells=metacells.split(",") if metacells else None,
+            fc_min=params.get("fc_min"),
+            log2=bool(params.get("log2")),
+            clip_log2=params.get("clip_log2"),
+        )
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        # Order rows by gene and metacell like the store, unless already ranked (`sort_genes`)
+        if not queryset.query.order_by:
+            queryset = queryset.order_by("gene_id", "metacell_id")
+        return queryset
+
+    def get_matrix(self):
+        """Return the filtered expression as genes x metacells matrices (see `MetacellExpressionService.matrix`)."""
+        queryset = self.filter_queryset(self.get_queryset()).prefetch_related(None)
+        fields = ["umi_raw", "umifrac", "fold_change"]
+        if "log2_fold_change" in queryset.query.annotations:
+            fields.append("log2_fold_change")
+
+        rows = list(queryset.values_list("gene_id", "metacell_id", *fields))
+        gene_ids, metacell_ids, *values = zip(*rows) if rows else [()] * (len(fields) + 2)
+        return services.MetacellExpressionService.build_matrix(gene_ids, metacell_ids, dict(zip(fields, values)))
+
+    @extend_schema(
+        parameters=[
+            OpenApiParameter(
+                "shape",
+                str,
+                description=get_enum_description(
+                    "Response shape (default: `long`). Matrices are not paginated: `genes` and `metacells` "
+                    "list the axes, and `values` contains a genes x metacells matrix per field (null if missing).",
+                    services.MetacellExpressionService.shape_choices,
+                ),
+                enum=list(services.MetacellExpressionService.shape_choices),
+            ),
+        ],
+    )
+    def list(self, request, *args, **kwargs):
+        shape = self.get_shape()
+        data = self.list_from_store(shape)
+        if shape == "matrix":
+            return Response(self.get_matrix() if data is None else data)
+        if data is None:
+            return super().list(request, *args, **kwargs)
+
+        page = self.paginate_queryset(data)
+        if page is not None:
+            return self.get_paginated_response(page)
+        return Response(data)
+
+
+@extend_schema(
+    summary="List gene expression per cell type",
+    tags=["Metacell", "Gene"],
+    parameters=[
+        OpenApiParameter(
+            "genes",
+            str,
+            description=filters.MetacellTypeGeneExpressionFilter().base_filters["genes"].label,
+            examples=[OpenApiExample("Example", value="Transcription factors,Pkinase,Tadh_P33902")],
+        ),
+    ],
+)
+class MetacellTypeGeneExpressionViewSet(BaseReadOnlyModelViewSet):
+    """
+    List gene expression aggregated per metacell type.
+
+    Served from aggregates precomputed when loading data (refreshed with
+    `python manage.py refreshcelltypeexpression`).
+    """
+
+    queryset = models.MetacellTypeGeneExpression.objects.select_related("gene", "metacell_type").order_by(
+        "gene__name", "metacell_type__name"
+    )
+    serializer_class = serializers.MetacellTypeGeneExpressionSerializer
+    filterset_class = filters.MetacellTypeGeneExpressionFilter
+
+
+@extend_schema(
+    summary="List precomputed cell type markers",
+    tags=["Metacell"],
+    parameters=[
+        OpenApiParameter(
+            "metacell_types",
+            str,
+            description=filters.MetacellTypeMarkerFilter().base_filters["metacell_types"].label,
+            examples=[OpenApiExample("Example", value="Peptidergic1,Digestive")],
+        ),
+    ],
+)
+class MetacellTypeMarkerViewSet(BaseReadOnlyModelViewSet):
+    """
+    List gene markers of each cell type against all other metacells.
+
+    Served from markers precomputed for all cell types of a dataset when loading data
+    (refreshed with `python manage.py refreshcelltypemarkers`), with the same statistics
+    as the markers endpoint selecting a single cell type.
+    """
+
+    queryset = models.MetacellTypeMarker.objects.select_related("gene", "metacell_type").prefetch_related(
+        "gene__domains"
+    )
+    serializer_class = serializers.MetacellTypeMarkerSerializer
+    filterset_class = filters.MetacellTypeMarkerFilter
+
 
 @extend_schema(
     summary="List correlated genes",
@@ -553,7 +941,17 @@ class CorrelatedGenesViewSet(BaseReadOnlyModelViewSet):
             required=True,
             description=filters.MetacellMarkerFilter().base_filters["metacells"].label,
             examples=[OpenApiExample("Example", value="12,30,Peptidergic1")],
-        )
+        ),
+        OpenApiParameter(
+            name="backend",
+            type=str,
+            location="query",
+            description=get_enum_description(
+                "Marker computation backend (default: `sql`, unless configured otherwise).",
+                services.MetacellMarkerService.backend_choices,
+            ),
+            enum=list(services.MetacellMarkerService.backend_choices),
+        ),
     ],
 )
 class MetacellMarkerViewSet(BaseReadOnlyModelViewSet):
@@ -562,12 +960,41 @@ class MetacellMarkerViewSet(BaseReadOnlyModelViewSet):
     Runs a single CTE-based query against PostgreSQL instead of the
     django-filter annotation pipeline. The ORM equivalent still lives in
     ``filters.MetacellMarkerFilter.select_metacells`` for reference.
+
+    Query results are cached as compact rows (see ``get_marker_rows``) and
+    pages (including CSV exports) are served from them; pages of results too
+    large to cache are fetched and counted in SQL. Only the genes of the
+    requested page are fetched. The same rows can be
+    computed with NumPy from the dense expression store instead
+    (``services.MetacellMarkerService``), selected with the ``backend`` query
+    parameter or the ``MARKER_BACKEND`` setting.
     """
 
     serializer_class = serializers.MetacellMarkerSerializer
     filterset_class = filters.MetacellMarkerFilter  # kept for OpenAPI parameter docs
     queryset = models.Gene.objects.none()
 
+    # Final selection shared by the queries below, from the per-gene statistics in ``stats``.
+    # ``total`` counts all selected genes (before ``{page}``, the optional LIMIT/OFFSET clause).
+    _MARKER_RESULT_SQL = """
+        SELECT
+            s.gene_id AS id,
+            s.bg_sum_umi,
+            s.fg_sum_umi,
+            CASE WHEN s.fg_sum_umi + s.bg_sum_umi = 0 THEN NULL
+                 ELSE s.fg_sum_umi::float / (s.fg_sum_umi + s.bg_sum_umi) * 100
+            END AS umi_perc,
+            s.fg_mean_fc,
+            s.bg_mean_fc,
+            s.fg_median_fc,
+            s.bg_median_fc,
+            count(*) OVER () AS total
+        FROM stats s
+        WHERE {having_col} >= %(fc_min)s
+        ORDER BY {having_col} DESC NULLS LAST, s.gene_id
+        {page}
+    """
+
     _MARKER_SQL = """
         WITH fg_metacells AS (
             SELECT mc.id AS metacell_id
@@ -595,6 +1022,7 @@ class MetacellMarkerViewSet(BaseReadOnlyModelViewSet):
         --              loses more than it gains.
         -- ``is_fg`` is never NULL (both metacell_id columns are NOT NULL), so
         -- ``NOT is_fg`` is equivalent to the ``NOT IN`` it replaces.
+        -- ``manage.py benchmarkmarkerplan`` checks this plan shape on a synthetic dataset.
         tagged AS (
             SELECT
                 e.gene_id,
@@ -628,21 +1056,41 @@ class MetacellMarkerViewSet(BaseReadOnlyModelViewSet):
             FROM tagged t
             GROUP BY t.gene_id
         )
-        SELECT
-            s.gene_id AS id,
-            s.bg_sum_umi,
-            s.fg_sum_umi,
-            CASE WHEN s.fg_sum_umi + s.bg_sum_umi = 0 THEN NULL
-                 ELSE s.fg_sum_umi::float / (s.fg_sum_umi + s.bg_sum_umi) * 100
-            END AS umi_perc,
-            s.fg_mean_fc,
-            s.bg_mean_fc,
-            s.fg_median_fc,
-            s.bg_median_fc
-        FROM stats s
-        WHERE {having_col} >= %(fc_min)s
-        ORDER BY {having_col} DESC NULLS LAST, s.gene_id
-    """
+    """ + _MARKER_RESULT_SQL
+
+    # Same statistics from the array-per-gene storage (METACELL_EXPRESSION_BACKEND = "arrays"):
+    # foreground membership is computed once per metacell as a boolean array aligned to the
+    # dataset's metacell layout, and unnested alongside the expression arrays of each gene.
+    # Values are stored as real and aggregated as double precision. Missing (null) values are
+    # ignored by the aggregates, as missing rows are in ``_MARKER_SQL``.
+    _MARKER_ARRAY_SQL = """
+        WITH fg AS (
+            SELECT array_agg((mc.name = ANY(%(names)s) OR mct.name = ANY(%(names)s)) IS TRUE ORDER BY o.pos) AS mask
+            FROM app_metacellexpressionlayout l
+            CROSS JOIN unnest(l.metacells) WITH ORDINALITY AS o(metacell_id, pos)
+            LEFT JOIN app_metacell mc ON mc.id = o.metacell_id
+            LEFT JOIN app_metacelltype mct ON mc.type_id = mct.id
+            WHERE l.dataset_id = %(dataset_id)s
+        ),
+        -- MATERIALIZED for the same reason as in ``_MARKER_SQL``
+        stats AS MATERIALIZED (
+            SELECT
+                a.gene_id,
+                sum(v.umi_raw::float8) FILTER (WHERE v.is_fg) AS fg_sum_umi,
+                sum(v.umi_raw::float8) FILTER (WHERE NOT v.is_fg) AS bg_sum_umi,
+                avg(v.fold_change::float8) FILTER (WHERE v.is_fg) AS fg_mean_fc,
+                avg(v.fold_change::float8) FILTER (WHERE NOT v.is_fg) AS bg_mean_fc,
+                percentile_cont(0.5) WITHIN GROUP (ORDER BY v.fold_change::float8)
+                    FILTER (WHERE v.is_fg) AS fg_median_fc,
+                percentile_cont(0.5) WITHIN GROUP (ORDER BY v.fold_change::float8)
+                    FILTER (WHERE NOT v.is_fg) AS bg_median_fc
+            FROM app_metacellgeneexpressionarray a
+            CROSS JOIN fg
+            CROSS JOIN LATERAL unnest(a.umi_raw, a.fold_change, fg.mask) AS v(umi_raw, fold_change, is_fg)
+            WHERE a.dataset_id = %(dataset_id)s
+            GROUP BY a.gene_id
+        )
+    """ + _MARKER_RESULT_SQL
 
     _ANNOTATION_FIELDS = (
         "bg_sum_umi",
@@ -658,7 +1106,8 @@ class MetacellMarkerViewSet(BaseReadOnlyModelViewSet):
         # django-filter is bypassed; query parameters are read in get_queryset().
         return queryset
 
-    def get_queryset(self):
+    def get_params(self):
+        """Return the validated dataset, metacell names, `fc_min` and `fc_min_type` query parameters."""
         params = self.request.query_params
         dataset_slug = params.get("dataset")
         metacells = params.get("metacells")
@@ -668,7 +1117,6 @@ class MetacellMarkerViewSet(BaseReadOnlyModelViewSet):
         fc_min_type = params.get("fc_min_type") or "mean"
         if fc_min_type not in ("mean", "median"):
             raise ValidationError({"fc_min_type": "Must be 'mean' or 'median'."})
-        having_col = "s.fg_median_fc" if fc_min_type == "median" else "s.fg_mean_fc"
 
         try:
             fc_min = float(params.get("fc_min") or 2)
@@ -683,32 +1131,114 @@ class MetacellMarkerViewSet(BaseReadOnlyModelViewSet):
             # (CodeQL py/stack-trace-exposure).
             raise ValidationError({"dataset": f"Cannot find dataset for {dataset_slug!r}."}) from None
         names = [n.strip() for n in metacells.split(",") if n.strip()]
+        return dataset, names, fc_min, fc_min_type
 
-        sql = self._MARKER_SQL.format(having_col=having_col)
+    def get_raw_queryset(self, dataset, names, fc_min, fc_min_type, limit=None, offset=0):
+        having_col = "s.fg_median_fc" if fc_min_type == "median" else "s.fg_mean_fc"
+        page = "" if limit is None else "LIMIT %(limit)s OFFSET %(offset)s"
+        # Datasets without arrays (not built yet) are read from the expression rows
+        arrays = settings.METACELL_EXPRESSION_BACKEND == "arrays" and MetacellExpressionArrays(dataset).exists()
+        sql = self._MARKER_ARRAY_SQL if arrays else self._MARKER_SQL
+        sql = sql.format(having_col=having_col, page=page)
         return models.Gene.objects.raw(
             sql,
-            params={"dataset_id": dataset.id, "names": names, "fc_min": fc_min},
+            params={"dataset_id": dataset.id, "names": names, "fc_min": fc_min, "limit": limit, "offset": offset},
         )
 
+    def fetch_marker_rows(self, dataset, names, fc_min, fc_min_type, limit=None, offset=0):
+        """Run the marker query, returning compact rows (of a page if `limit` is given) and the total count."""
+        raw_rows = list(self.get_raw_queryset(dataset, names, fc_min, fc_min_type, limit, offset))
+        rows = [(raw.id, *(getattr(raw, attr, None) for attr in self._ANNOTATION_FIELDS)) for raw in raw_rows]
+        if raw_rows:
+            return rows, raw_rows[0].total
+        if offset:
+            # The window count is not returned for an offset past the last row: fetch it from the first row
+            first = list(self.get_raw_queryset(dataset, names, fc_min, fc_min_type, 1, 0))
+            return rows, first[0].total if first else 0
+        return rows, 0
+
+    def get_queryset(self):
+        return self.get_raw_queryset(*self.get_params())
+
+    def get_backend(self):
+        """Return the requested marker backend (default: `MARKER_BACKEND` setting)."""
+        backend = self.request.query_params.get("backend") or settings.MARKER_BACKEND
+        if backend not in services.MetacellMarkerService.backend_choices:
+            raise ValidationError({"backend": f"'{backend}' is not a valid choice."})
+        return backend
+
+    @staticmethod
+    def get_cache_key(dataset, metacell_ids, fc_min, fc_min_type):
+        """Return the cache key of a marker query, based on the sorted IDs of the selected metacells."""
+        digest = hashlib.sha1(",".join(str(pk) for pk in sorted(metacell_ids)).encode()).hexdigest()
+        return f"markers:{dataset.pk}:{fc_min_type}:{fc_min!r}:{digest}"
+
+    def get_marker_rows(self, limit=None, offset=0):
+        """
+        Return the markers as compact (gene ID, *statistics) tuples, strongest first, and their total count.
+
+        Rows are cached per dataset, set of selected metacells (however they were named),
+        `fc_min` and `fc_min_type`, and invalidated when the database version changes, so
+        paging, sorting or exporting the same selection does not re-run the marker query.
+        Both backends return the same rows, so they share cached results.
+
+        Pages requested with the SQL backend are fetched with LIMIT/OFFSET in the marker query unless
+        the whole result is cached, so only the rows of the page are built. Results of more than
+        `MARKER_CACHE_MAX_ROWS` genes are not cached (only their count is). Smaller results are
+        cached whole: from the page if it holds all rows, or else with a query for all rows.
+
+        Args:
+            limit (int, optional): Maximum number of rows to return (default: all rows).
+            offset (int): Number of rows to skip.
+        """
+        dataset, names, fc_min, fc_min_type = self.get_params()
+        backend = self.get_backend()
+        service = services.MetacellMarkerService(dataset)
+        metacell_ids = service.get_metacell_ids(names)
+
+        key = self.get_cache_key(dataset, metacell_ids, fc_min, fc_min_type)
+        validation = get_db_version()
+        rows = get_validated_cache(key, validation)
+        if not isinstance(rows, list) and limit is not None and backend == "sql":
+            page, count = self.fetch_marker_rows(dataset, names, fc_min, fc_min_type, limit, offset)
+            if count > settings.MARKER_CACHE_MAX_ROWS:
+                if rows is None:
+                    set_validated_cache(key, validation, count)
+                return page, count
+            if offset == 0 and len(page) == count:
+                set_validated_cache(key, validation, page)
+                return page, count
+
+        if not isinstance(rows, list):
+            rows = service.compute(metacell_ids, fc_min, fc_min_type) if backend == "numpy" else None
+            if rows is None:
+                # SQL backend, or expression store not built for the current database version
+                rows, _ = self.fetch_marker_rows(dataset, names, fc_min, fc_min_type)
+            set_validated_cache(key, validation, rows if len(rows) <= settings.MARKER_CACHE_MAX_ROWS else len(rows))
+        return rows[offset : None if limit is None else offset + limit], len(rows)
+
     def list(self, request, *args, **kwargs):
-        raw_rows = list(self.get_queryset())
+        rows = None if self.paginator is None else self.paginator.paginate_rows(self.get_marker_rows, request)
+        page = rows is not None
+        if not page:
+            rows, _ = self.get_marker_rows()
 
-        ids = [g.id for g in raw_rows]
+        # Only fetch the genes of the requested page (with a batched query per relation)
+        ids = [row[0] for row in rows]
         prefetched = {g.id: g for g in models.Gene.objects.filter(id__in=ids).prefetch_related("domains", "genelists")}
         results = []
-        for raw in raw_rows:
-            gene = prefetched.get(raw.id)
+        for gene_id, *stats in rows:
+            gene = prefetched.get(gene_id)
             if gene is None:
                 continue
-            for attr in self._ANNOTATION_FIELDS:
-                setattr(gene, attr, getattr(raw, attr, None))
+            for attr, value in zip(self._ANNOTATION_FIELDS, stats):
+                setattr(gene, attr, value)
             results.append(gene)
 
-        page = self.paginate_queryset(results)
-        if page is not None:
-            serializer = self.get_serializer(page, many=True)
+        serializer = self.get_serializer(results, many=True)
+        if page:
             return self.get_paginated_response(serializer.data)
-        return Response(self.get_serializer(results, many=True).data)
+        return Response(serializer.data)
 
     @extend_schema(exclude=True)
     def retrieve(self, request, *args, **kwargs):
@@ -923,7 +1453,8 @@ using [GOATOOLS {settings.GOATOOLS_VERSION}](https://github.com/tanghaibao/goato
 
 Background genes are derived from all the genes in the selected dataset's metacell gene expression.
 
-> Processing may take 10+ seconds depending on input.
+> The Gene Ontology is parsed once per server process, so processing time is mostly spent
+> on the enrichment statistics and may take a few seconds depending on input.
 > Please use responsibly to avoid excessive server load.
 """,
 )
@@ -940,16 +1471,8 @@ class EnrichmentAnalysisViewSet(viewsets.ViewSet):
         if len(genes) == 0:
             raise NotFound(detail="Genes not found.")
 
-        queryset = dataset.species.genes.filter(
-            Q(name__in=genes)
-            | Q(domains__name__in=genes)
-            | Q(genelists__name__in=genes)
-            | Q(modules__module__name__in=genes, modules__module__dataset=dataset)
-        ).distinct()
-
         # Get name of selected genes
-        query = list(queryset.values_list("name", flat=True))
-        return query
+        return services.GeneSetResolver(dataset.species, dataset).resolve_names(genes)
 
     @extend_schema(
         request=serializers.EnrichmentAnalysisRequestSerializer,
@@ -971,10 +1494,16 @@ class EnrichmentAnalysisViewSet(viewsets.ViewSet):
         obsolete = validated["obsolete"] or False
 
         go_obo = models.GlobalFile.objects.get(type="go-basic-obo").file.path
-        emapper = dataset.species.files.get(type="eggnog-mapper").file.path
+        emapper = dataset.species.files.get(type="eggnog-mapper")
 
         service = services.GeneOntologyEnrichmentService(
-            go_obo, emapper, background, qvalue=qvalue, methods=["bonferroni"], load_obsolete=obsolete
+            go_obo,
+            emapper.file.path,
+            background,
+            qvalue=qvalue,
+            methods=["bonferroni"],
+            load_obsolete=obsolete,
+            annotation_checksum=emapper.checksum,
         )
         results = service.run(genes, sort=True)
 
@@ -17,10 +17,16 @@ import pandas as pd
 import psutil
 import psycopg2
 import yaml
+from django.conf import settings
 from django.db.models import Count, F, OuterRef, Subquery, Sum
 from rds2py import read_rds
 
 from app import models
+from app.utils.cell_type_expression import refresh_cell_type_expression
+from app.utils.expression_arrays import MetacellExpressionArrays
+from app.utils.expression_store import MetacellExpressionStore
+from app.utils.partitions import reset_partition
+from rest.services import MetacellMarkerService
 
 # Auto-flush print statements
 print = functools.partial(print, flush=True)
@@ -477,8 +483,14 @@ def add_species_data(species_config, dir, r_colors, load, force=False):
         fc = read_rds(f_fc)
         umi = read_rds(f_umi)
         umifrac = read_rds(f_umifrac)
+
+        # Replace previous data of the dataset (drops its partition instead of deleting rows)
+        reset_partition(dataset.pk)
         add_metacell_gene_expression(species, dataset, fc, umi, umifrac)
 
+        print("Aggregating gene expression per metacell type...")
+        refresh_cell_type_expression(dataset)
+
     if load_mc_stats:
         # Requires metacell gene expression data
         print("Adding metacell stats...")
@@ -490,6 +502,23 @@ def add_species_data(species_config, dir, r_colors, load, force=False):
         counts = read_rds(f)
         add_sc_gene_expression(species, dataset, counts)
 
+    # Dataset whose derived expression data must be rebuilt
+    return dataset if load_mge else None
+
+
+def build_expression_data(dataset):
+    """Build the data derived from the metacell gene expression of a dataset (for the current database version)."""
+    print("Building memory-mapped store of gene expression per metacell...")
+    MetacellExpressionStore(dataset).build()
+
+    if settings.METACELL_EXPRESSION_BACKEND == "arrays":
+        print("Building array-per-gene storage of gene expression per metacell...")
+        MetacellExpressionArrays(dataset).build()
+
+    # Requires the memory-mapped store
+    print("Computing markers of every metacell type...")
+    MetacellMarkerService(dataset).refresh_cell_type_markers()
+
 
 def addOrthologGroups(data_dir):
     print("Loading orthologous groups...")
@@ -513,7 +542,7 @@ def addOrthologGroups(data_dir):
     return validate_and_bulk_create(models.Ortholog, og_list)
 
 
-def main(data_dir, load, filter=[], exclude=["nvec_old"], force=False):
+def main(data_dir, load, filter=[], exclude=["nvec_old"], force=False, version=None, description=None):
     r_colors_file = f"{data_dir}/R_colors.tsv"
     r_colors = pd.read_csv(r_colors_file, sep="\t")
 
@@ -521,6 +550,7 @@ def main(data_dir, load, filter=[], exclude=["nvec_old"], force=False):
     with open(config) as file:
         data = yaml.safe_load(file)
 
+    datasets = []
     for key, species_config in data.items():
         if key in exclude or key == "default":
             continue
@@ -531,11 +561,23 @@ def main(data_dir, load, filter=[], exclude=["nvec_old"], force=False):
 
         print("\n================================================================")
         print(f"Processing species {species_config['species']} [{key}]...")
-        add_species_data(species_config, species_dir, r_colors, load, force)
+        dataset = add_species_data(species_config, species_dir, r_colors, load, force)
+        if dataset is not None:
+            datasets.append(dataset)
 
     if load["orthologs"]:
         addOrthologGroups(data_dir)
 
+    # Stores and arrays are versioned by the latest database version, so build them once it is logged
+    if version is not None:
+        print(f"Logging database version {version}...")
+        models.DBVersion.objects.create(version=version, description=description or "Added data")
+    elif datasets:
+        print("No database version given: rebuild stores after logging it (python manage.py buildexpressionstore)")
+    for dataset in datasets:
+        print(f"\nBuilding expression data of {dataset}...")
+        build_expression_data(dataset)
+
     print("All done!")
 
 
@@ -0,0 +1,66 @@
+"""Benchmark of the conversion of UMI counts to UMI fractions in HDF5 (rds2hdf5.py)
+
+Times compute_umifractions and the batched HDF5 writer on a synthetic CSC
+matrix of UMI counts (the format read from RDS files), for both layouts,
+and reports the peak memory of the process and the size of each file.
+
+Usage: python benchmark_rds2hdf5.py [--genes 20000] [--cells 20000] [--density 0.01]
+       [--max-memory 16] [--encoding float32]
+"""
+
+import argparse
+import os
+import resource
+import tempfile
+import time
+
+import numpy as np
+import scipy.sparse
+from hdf5_writer import CSR_LAYOUT, ENCODING_DTYPES, FLOAT32_ENCODING, GENE_LAYOUT, compute_umifractions, write_hdf5
+
+
+def synthetic_counts(n_genes: int, n_cells: int, density: float, seed: int = 1):
+    """Genes x cells CSC matrix of UMI counts between 1 and 10"""
+    counts = scipy.sparse.random(n_genes, n_cells, density=density, format="csc", random_state=seed, dtype=np.float64)
+    counts.data = np.ceil(counts.data * 10)
+    genes = [f"gene{i}" for i in range(n_genes)]
+    cells = [f"cell{j}" for j in range(n_cells)]
+    return genes, cells, counts
+
+
+def peak_memory() -> float:
+    """Peak resident memory of the process (MiB)"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--genes", type=int, default=20000)
+    parser.add_argument("--cells", type=int, default=20000)
+    parser.add_argument("--density", type=float, default=0.01)
+    parser.add_argument("--max-memory", type=float, default=16, help="memory for the buffers of each batch (MiB)")
+    parser.add_argument("--encoding", choices=list(ENCODING_DTYPES), default=FLOAT32_ENCODING)
+    args = parser.parse_args()
+
+    genes, cells, counts = synthetic_counts(args.genes, args.cells, args.density)
+    matrix_size = (counts.data.nbytes + counts.indices.nbytes + counts.indptr.nbytes) / 1024**2
+    print(f"Matrix: {args.genes} genes x {args.cells} cells, {counts.nnz} values ({matrix_size:.0f} MiB)")
+
+    start = time.perf_counter()
+    compute_umifractions(counts)
+    print(f"UMI fractions: {time.perf_counter() - start:.2f} s")
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for layout in (GENE_LAYOUT, CSR_LAYOUT):
+            path = os.path.join(tmpdir, f"{layout}.hdf5")
+            start = time.perf_counter()
+            write_hdf5(path, genes, cells, counts, layout, args.max_memory, args.encoding)
+            elapsed = time.perf_counter() - start
+            size = os.path.getsize(path) / 1024**2
+            print(
+                f"{layout:>5} | write (s): {elapsed:.2f}, size (MiB): {size:.2f}, peak RSS (MiB): {peak_memory():.0f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""Writer of UMI fraction matrices to HDF5 files in the layouts and encodings
+read by app.utils.hdf5 (shared by rds2hdf5.py and the test suite)
+"""
+
+import functools
+
+import h5py
+import numpy as np
+import scipy.sparse
+
+# On-disk layouts (must match the ones read by app.utils.hdf5)
+GENE_LAYOUT = "genes"
+CSR_LAYOUT = "csr"
+
+# Encodings of the UMI fractions (must match the ones read by app.utils.hdf5):
+# - float32: exact values
+# - float16: half precision (relative error below 0.05% above 6e-5)
+# - uint16: log-scaled codes with a per-gene scale and offset (stored once per
+#   file in the datasets scale and offset, indexed like gene_names), decoded as
+#   exp(offset + (code - 1) * scale), code 0 being zero (see quantize)
+FLOAT32_ENCODING = "float32"
+FLOAT16_ENCODING = "float16"
+UINT16_ENCODING = "uint16"
+ENCODING_DTYPES = {FLOAT32_ENCODING: np.float32, FLOAT16_ENCODING: np.float16, UINT16_ENCODING: np.uint16}
+
+# Elements per chunk of the CSR indices/data arrays (16 KiB of int32/float32):
+# small enough that reading one gene decompresses little data beyond its row
+CSR_CHUNK_SIZE = 4096
+
+# Default ceiling (in MiB) for the buffers of each batch of genes written
+MAX_MEMORY = 512
+
+# Approximate bytes per value of the buffers of a batch: 64-bit positions,
+# sort order and values while slicing rows out of a CSC matrix (see row_slice),
+# then int32 cell positions and values of the output records
+BYTES_PER_VALUE = 32
+
+# Auto-flush print statements
+print = functools.partial(print, flush=True)
+
+
+def print_progress(index, total):
+    perc = int(index / total * 100)
+    msg = f"{perc}% ({index} out of {total})"
+    print(msg)
+    return msg
+
+
+def compute_umifractions(matrix):
+    """Computes umifrac values in place
+
+    Each value is scaled by 10000 / total UMIs of its cell (column), using
+    the sparse structure directly instead of visiting elements one by one.
+    """
+    column_sums = np.asarray(matrix.sum(axis=0), dtype=np.float64).ravel()
+    scale = np.divide(10000.0, column_sums, out=np.zeros_like(column_sums), where=column_sums != 0)
+
+    if not np.issubdtype(matrix.data.dtype, np.floating):
+        matrix.data = matrix.data.astype(np.float64)
+    if matrix.format == "csc":
+        matrix.data *= np.repeat(scale, np.diff(matrix.indptr))
+    elif matrix.format == "csr":
+        matrix.data *= scale[matrix.indices]
+    else:
+        raise ValueError(f"unsupported sparse matrix format: {matrix.format}")
+
+
+def row_pointers(matrix) -> np.ndarray:
+    """Returns the row pointers of a CSR or CSC matrix in CSR form, without converting it"""
+    if matrix.format == "csr":
+        return matrix.indptr.astype(np.int64)
+    counts = np.bincount(matrix.indices, minlength=matrix.shape[0])
+    return np.concatenate([[0], np.cumsum(counts)])
+
+
+def row_batches(indptr: np.ndarray, max_memory: float = MAX_MEMORY):
+    """Splits the rows of a CSR matrix in batches within a memory ceiling
+
+    Args:
+        indptr: row pointers of the CSR matrix
+        max_memory: maximum memory (in MiB) for the buffers of each batch
+    Yields:
+        Tuples with (first row, last row + 1); rows larger than the ceiling
+        are yielded on their own
+    """
+    max_values = max(int(max_memory * 1024**2 / BYTES_PER_VALUE), 1)
+    n_rows = indptr.size - 1
+    start = 0
+    while start < n_rows:
+        end = np.searchsorted(indptr, indptr[start] + max_values, side="right") - 1
+        end = min(max(end, start + 1), n_rows)
+        yield start, end
+        start = end
+
+
+def row_slice(matrix, start: int, end: int):
+    """Returns rows [start, end) of a CSR or CSC matrix as a CSR matrix with sorted column indices
+
+    Only the values of the slice are copied: the rows of a CSC matrix are
+    selected with a boolean mask over its row indices, so the whole matrix
+    is never converted to CSR.
+    """
+    if matrix.format == "csr":
+        rows = matrix[start:end]
+        rows.sort_indices()
+        return rows
+
+    selected = np.flatnonzero((matrix.indices >= start) & (matrix.indices < end))
+    row = matrix.indices[selected] - start
+    # Values are stored column by column, so a stable sort keeps the columns of each row sorted
+    selected = selected[np.argsort(row, kind="stable")]
+    columns = (np.searchsorted(matrix.indptr, selected, side="right") - 1).astype(np.int32)
+    indptr = np.concatenate([[0], np.cumsum(np.bincount(row, minlength=end - start))])
+    return scipy.sparse.csr_matrix((matrix.data[selected], columns, indptr), shape=(end - start, matrix.shape[1]))
+
+
+def quantize(data: np.ndarray, indptr: np.ndarray):
+    """Encodes the values of consecutive rows as log-scaled uint16 codes
+
+    The logarithms of the positive values of each row are spread evenly over
+    codes 1 to 65535, so the relative error is bounded by half a step
+    (below 0.01% for values spanning six orders of magnitude).
+
+    Args:
+        data: values of the rows
+        indptr: row pointers into data (starting at 0)
+    Returns:
+        Tuple with (uint16 codes, scale and offset of each row)
+    """
+    lengths = np.diff(indptr)
+    positive = data > 0
+    logs = np.log(data, out=np.full(data.shape, np.nan), where=positive)
+
+    low = np.zeros(lengths.size)
+    high = np.zeros(lengths.size)
+    starts = indptr[:-1][lengths > 0]
+    if starts.size:
+        low[lengths > 0] = np.fmin.reduceat(logs, starts)
+        high[lengths > 0] = np.fmax.reduceat(logs, starts)
+    # Rows without positive values only have code 0
+    low, high = np.nan_to_num(low), np.nan_to_num(high)
+
+    scale = (high - low) / (np.iinfo(np.uint16).max - 1)
+    scale[scale == 0] = 1.0
+    codes = np.rint((logs - np.repeat(low, lengths)) / np.repeat(scale, lengths)) + 1
+    return np.where(positive, codes, 0).astype(np.uint16), scale, low
+
+
+def encode_rows(rows, encoding: str = FLOAT32_ENCODING):
+    """Encodes the values of a CSR row slice
+
+    Returns:
+        Tuple with (encoded values, scale and offset of each row); scale and
+        offset are None unless the encoding is uint16
+    """
+    if encoding == UINT16_ENCODING:
+        return quantize(rows.data, rows.indptr)
+    return rows.data.astype(ENCODING_DTYPES[encoding]), None, None
+
+
+def chunk_options(size: int) -> dict:
+    """Chunking and compression options for a 1-D CSR array"""
+    if size == 0:
+        return {}
+    return {
+        "chunks": (min(size, CSR_CHUNK_SIZE),),
+        "compression": "gzip",
+        "compression_opts": 4,
+        "shuffle": True,
+    }
+
+
+def create_quantization_datasets(root: h5py.File, genes) -> None:
+    """Creates the datasets scale and offset of the uint16 encoding, with one value per gene
+
+    They are filled by the writer of each batch (see write_quantization) and
+    stored once per file rather than as attributes of each gene dataset,
+    whose per-object overhead would outweigh the smaller values.
+    """
+    root.create_dataset("scale", shape=(len(genes),), dtype=np.float64)
+    root.create_dataset("offset", shape=(len(genes),), dtype=np.float64)
+
+
+def write_quantization(root: h5py.File, scale: np.ndarray, offset: np.ndarray, start: int) -> None:
+    """Writes the scale and offset of genes[start:] (see create_quantization_datasets)"""
+    root["scale"][start : start + scale.size] = scale
+    root["offset"][start : start + offset.size] = offset
+
+
+def create_gene_datasets(root: h5py.File, genes, indptr: np.ndarray, encoding: str = FLOAT32_ENCODING) -> None:
+    """Creates the per-file datasets of the per-gene layout, filled by write_gene_datasets
+
+    Only the uint16 encoding needs any: gene_names, to index the scale and
+    offset of each gene.
+    """
+    if encoding == UINT16_ENCODING:
+        # Fixed-length names compress well, unlike variable-length strings stored in a heap
+        names = np.array([gene.encode() for gene in genes])
+        names = names.astype(h5py.string_dtype(length=names.dtype.itemsize))
+        root.create_dataset("gene_names", data=names, **chunk_options(names.size))
+        create_quantization_datasets(root, genes)
+
+
+def write_gene_datasets(root: h5py.File, genes, rows, start: int, encoding: str = FLOAT32_ENCODING) -> None:
+    """Writes one dataset of (cell position, value) records per expressed gene of a CSR row slice
+
+    The slice holds the rows of genes[start:].
+    """
+    values, scale, offset = encode_rows(rows, encoding)
+    records = np.empty(shape=values.size, dtype=[("c", np.int32), ("e", ENCODING_DTYPES[encoding])])
+    records["c"] = rows.indices
+    records["e"] = values
+    if scale is not None:
+        write_quantization(root, scale, offset, start)
+
+    for i in range(rows.shape[0]):
+        first, last = rows.indptr[i], rows.indptr[i + 1]
+        if first == last:
+            continue
+        try:
+            root.create_dataset(genes[start + i], data=records[first:last])
+        except ValueError:
+            print(f"duplicated gene {genes[start + i]}")
+
+
+def create_csr_datasets(root: h5py.File, genes, indptr: np.ndarray, encoding: str = FLOAT32_ENCODING) -> None:
+    """Creates the global CSR arrays of a genes x cells matrix, filled by write_csr
+
+    The file contains the datasets gene_names, indptr (row pointers),
+    indices (cell positions) and data (values). The values of the gene in
+    row i are stored in indices/data[indptr[i]:indptr[i + 1]]. With the
+    uint16 encoding, the datasets scale and offset hold one value per gene.
+    """
+    nnz = int(indptr[-1])
+    root.create_dataset("gene_names", data=list(genes), dtype=h5py.string_dtype())
+    root.create_dataset("indptr", data=indptr.astype(np.int64))
+    root.create_dataset("indices", shape=(nnz,), dtype=np.int32, **chunk_options(nnz))
+    root.create_dataset("data", shape=(nnz,), dtype=ENCODING_DTYPES[encoding], **chunk_options(nnz))
+    if encoding == UINT16_ENCODING:
+        create_quantization_datasets(root, genes)
+
+
+def write_csr(root: h5py.File, genes, rows, start: int, encoding: str = FLOAT32_ENCODING) -> None:
+    """Writes a CSR row slice of genes[start:] into the global CSR arrays (see create_csr_datasets)"""
+    first = root["indptr"][start]
+    values, scale, offset = encode_rows(rows, encoding)
+    root["indices"][first : first + rows.nnz] = rows.indices
+    root["data"][first : first + rows.nnz] = values
+    if scale is not None:
+        write_quantization(root, scale, offset, start)
+
+
+def write_hdf5(
+    output_file: str,
+    genes,
+    cells,
+    matrix,
+    layout: str = GENE_LAYOUT,
+    max_memory: float = MAX_MEMORY,
+    encoding: str = FLOAT32_ENCODING,
+) -> None:
+    """Writes a genes x cells matrix of UMI fractions to a HDF5 file
+
+    Genes are written in batches of row slices whose buffers stay within
+    max_memory. A CSC matrix (as read from RDS files) is sliced without
+    converting it to CSR, so the peak memory is the input matrix, a boolean
+    mask over its values and the buffers of one batch.
+
+    Args:
+        output_file: path to output (hdf) file
+        genes: gene names (matrix rows)
+        cells: cell names (matrix columns)
+        matrix: scipy sparse matrix (CSC or CSR; other formats are converted to CSR)
+        layout: on-disk layout ("genes" or "csr")
+        max_memory: maximum memory (in MiB) for the buffers of each batch
+        encoding: encoding of the values ("float32", "float16" or "uint16")
+    """
+    writers = {GENE_LAYOUT: (create_gene_datasets, write_gene_datasets), CSR_LAYOUT: (create_csr_datasets, write_csr)}
+    if layout not in writers:
+        raise ValueError(f"unknown HDF5 layout: {layout}")
+    if encoding not in ENCODING_DTYPES:
+        raise ValueError(f"unknown HDF5 encoding: {encoding}")
+
+    if matrix.format not in ("csr", "csc"):
+        matrix = scipy.sparse.csr_matrix(matrix)
+    genes = list(genes)
+    indptr = row_pointers(matrix)
+
+    with h5py.File(output_file, "w") as root:
+        root.attrs["layout"] = layout
+        root.attrs["encoding"] = encoding
+        root.create_dataset("cell_names", data=cells, dtype=h5py.string_dtype())
+        if matrix.shape[0] == 0:
+            return
+        create_datasets, write_rows = writers[layout]
+        create_datasets(root, genes, indptr, encoding)
+        for start, end in row_batches(indptr, max_memory):
+            write_rows(root, genes, row_slice(matrix, start, end), start, encoding)
+            print_progress(end, len(genes))
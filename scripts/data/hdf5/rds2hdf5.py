@@ -2,13 +2,29 @@
 in a HDF5 file optimized for fast gene retrieval
 """
 
+import argparse
+import functools
+import time
+
 import h5py
 import numpy as np
 import rds2py
+from hdf5_writer import (
+    BYTES_PER_VALUE,
+    CSR_LAYOUT,
+    ENCODING_DTYPES,
+    FLOAT32_ENCODING,
+    GENE_LAYOUT,
+    MAX_MEMORY,
+    chunk_options,
+    compute_umifractions,
+    print_progress,
+    write_hdf5,
+)
 from rds2py.read_matrix import read_dgcmatrix
 
-# pylint: disable=unused-import
-import scipy  # noqa
+# Auto-flush print statements
+print = functools.partial(print, flush=True)
 
 
 def read_matrix(rds_file: str):
@@ -26,15 +42,13 @@ def read_matrix(rds_file: str):
     return (genes, cells, matrix)
 
 
-def compute_umifractions(matrix):
-    """Computes umifrac values in place"""
-    column_sums = matrix.sum(axis=0)
-    (row_indices, col_indices) = matrix.nonzero()
-    for i, j in zip(row_indices, col_indices):
-        matrix[i, j] = 10000.0 * matrix[i, j] / column_sums[0, j]
-
-
-def rds2hdf(rds_file: str, output_file: str) -> None:
+def rds2hdf(
+    rds_file: str,
+    output_file: str,
+    layout: str = GENE_LAYOUT,
+    max_memory: float = MAX_MEMORY,
+    encoding: str = FLOAT32_ENCODING,
+) -> None:
     """Transforms a gene expression matrix in RDS to HDF
 
     Assumption:
@@ -45,32 +59,100 @@ def rds2hdf(rds_file: str, output_file: str) -> None:
     Args:
         rds_file: path to RDS file
         output_file: path to output (hdf) file
+        layout: on-disk layout ("genes" or "csr")
+        max_memory: maximum memory (in MiB) for the buffers of each batch of genes
+        encoding: encoding of the values ("float32", "float16" or "uint16");
+            the quantized encodings halve the size of the values, not of the
+            cell positions (int32), nor of the per-gene scale and offset of uint16
 
     Side effect:
         Creates an hdf5 file in location output_file.
-        The file has a dataset cell_names and datasets named after each gene
-        cell_names is an array of names
-        Each gene dataset is an array of pairs (pos, expressionValue)
-        The integer pos points to the position of the cell name in the array cell_names
+        The file has a dataset cell_names and, depending on the layout:
+        - genes: datasets named after each gene
+          Each gene dataset is an array of pairs (pos, expressionValue)
+          The integer pos points to the position of the cell name in the array cell_names
+          With the uint16 encoding, the datasets gene_names, scale and offset hold
+          the scale and offset of each gene (see create_gene_datasets)
+        - csr: datasets gene_names, indptr, indices and data (see write_csr)
 
     Import requirements: pandas rds2py *scipy (or read_dgcmatrix fails)*
     Dependencies: {rds2py scipy}
     """
+    start_time = time.time()
     try:
         (genes, cells, matrix) = read_matrix(rds_file)
     except IOError:
         print("Problem opening the RDS file")
+        raise
+    print(f"Read {len(genes)} genes x {len(cells)} cells ({matrix.nnz} values)")
+
     compute_umifractions(matrix)
-    with h5py.File(output_file, "w") as root:
-        root.create_dataset("cell_names", data=cells, dtype=h5py.string_dtype())
+    # Genes are sliced out of the CSC matrix in batches, without a CSR copy of the whole matrix
+    write_hdf5(output_file, genes, cells, matrix, layout, max_memory, encoding)
+    print(f"Finished! Elapsed time: {time.time() - start_time:.2f} seconds")
+
+
+def convert_to_csr(input_file: str, output_file: str, max_memory: float = MAX_MEMORY) -> None:
+    """Converts a HDF5 file from the per-gene layout to the CSR layout
+
+    Genes are written in the (alphabetical) order of the input datasets and
+    the values are copied in batches to bound memory usage.
+
+    Args:
+        input_file: path to HDF5 file with one dataset per gene
+        output_file: path to output (hdf) file
+        max_memory: maximum memory (in MiB) for the buffers of each batch of genes
+    """
+    batch_size = max(int(max_memory * 1024**2 / BYTES_PER_VALUE), 1)
+
+    with h5py.File(input_file, "r") as src, h5py.File(output_file, "w") as root:
+        if src.attrs.get("layout", GENE_LAYOUT) != GENE_LAYOUT:
+            raise ValueError(f"{input_file} is not in the per-gene layout")
+        if src.attrs.get("encoding", FLOAT32_ENCODING) != FLOAT32_ENCODING:
+            raise ValueError(f"{input_file} is not float32-encoded")
+
+        root.attrs["layout"] = CSR_LAYOUT
+        root.attrs["encoding"] = FLOAT32_ENCODING
+        src.copy("cell_names", root)
+
+        genes = [name for name in src if name != "cell_names"]
+        lengths = np.array([src[gene].shape[0] for gene in genes], dtype=np.int64)
+        indptr = np.concatenate([[0], np.cumsum(lengths)])
+        nnz = int(indptr[-1])
+
+        root.create_dataset("gene_names", data=genes, dtype=h5py.string_dtype())
+        root.create_dataset("indptr", data=indptr)
+        indices = root.create_dataset("indices", shape=(nnz,), dtype=np.int32, **chunk_options(nnz))
+        data = root.create_dataset("data", shape=(nnz,), dtype=np.float32, **chunk_options(nnz))
+
+        batch, offset = [], 0
         for i, gene in enumerate(genes):
-            row = matrix.getrow(i)
-            (_, columns) = row.nonzero()
-            dataset = np.empty(shape=len(columns), dtype=[("c", np.int32), ("e", np.float32)])
-            if columns.size > 0:
-                for p, j in enumerate(columns):
-                    dataset[p] = (j, matrix[i, j])
-                try:
-                    root.create_dataset(gene, data=dataset)
-                except ():
-                    print(f"duplicated gene {gene}")
+            if lengths[i]:
+                batch.append(np.sort(src[gene][:], order="c"))
+            if batch and (indptr[i + 1] - offset >= batch_size or i == len(genes) - 1):
+                records = np.concatenate(batch)
+                indices[offset : offset + records.size] = records["c"]
+                data[offset : offset + records.size] = records["e"]
+                batch, offset = [], offset + records.size
+                print_progress(i + 1, len(genes))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert UMI matrices to UMI fractions in HDF5")
+    parser.add_argument("input", help="RDS file (or HDF5 file in the per-gene layout with --convert)")
+    parser.add_argument("output", help="output HDF5 file")
+    parser.add_argument("--layout", choices=[GENE_LAYOUT, CSR_LAYOUT], default=GENE_LAYOUT)
+    parser.add_argument("--convert", action="store_true", help="convert per-gene HDF5 file to the CSR layout")
+    parser.add_argument("--encoding", choices=list(ENCODING_DTYPES), default=FLOAT32_ENCODING)
+    parser.add_argument(
+        "--max-memory",
+        type=float,
+        default=MAX_MEMORY,
+        help="maximum memory for the buffers of each batch of genes, besides the input matrix (MiB)",
+    )
+    args = parser.parse_args()
+
+    if args.convert:
+        convert_to_csr(args.input, args.output, args.max_memory)
+    else:
+        rds2hdf(args.input, args.output, args.layout, args.max_memory, args.encoding)
@@ -45,7 +45,8 @@ def get_tables(db):
             FROM pg_class c
             JOIN pg_namespace n ON n.oid = c.relnamespace
             LEFT JOIN pg_constraint fk ON fk.conrelid = c.oid AND fk.contype = 'f'
-            WHERE c.relkind = 'r'  -- only regular tables
+            WHERE c.relkind IN ('r', 'p')  -- only regular and partitioned tables
+            AND NOT c.relispartition  -- partitions are copied with their table
             AND n.nspname = 'public'
             GROUP BY c.relname
             ORDER BY COUNT(fk.conname) ASC;
@@ -87,9 +88,9 @@ def dump_data(db_src, db_dst, tables=[], exclude_table_data=[], args=None):
 
     if tables or exclude_table_data:
         for table in tables or []:
-            pg.extend(["-t", table])
+            pg.extend(["--table-and-children", table])
         for table in exclude_table_data or []:
-            pg.extend(["--exclude-table-data", table])
+            pg.extend(["--exclude-table-data-and-children", table])
 
     print(f"{YELLOW}DUMP DATA (SHELL):{CYAN} {' '.join(pg)} | {' '.join(ps)}{RESET}\n")
     if not args.dry_run: